@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to benchmark the lookups in database.Archive.getData.
+
+This script builds a temporary archive from archive/wx-data.sql that is
+filled with a reading every 90 seconds for the last few years and then
+times the queries that rtl_osv21.py and utils.py make - the latest entry,
+the entry from an hour ago, and the entry from just after local midnight -
+against the original, unbounded versions of them.  The number of years to
+fill can be set with the '-y' option and the number of times each lookup is
+repeated with the '-r' option.
+"""
+
+import os
+import sys
+import time
+import random
+import getopt
+import shutil
+import sqlite3
+import tempfile
+
+from database import Archive
+
+
+# Schema for the archive
+_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive', 'wx-data.sql')
+
+# Time between readings in s
+_CADENCE = 90
+
+
+def _buildArchive(filename, years, seed=0):
+	"""
+	Create an archive in the specified file with a reading every _CADENCE
+	seconds for the specified number of years, ending now.  Returns the
+	number of rows written.
+	"""
+	
+	rng = random.Random(seed)
+	
+	fh = open(_SCHEMA_FILE, 'r')
+	schema = fh.read()
+	fh.close()
+	
+	conn = sqlite3.connect(filename)
+	conn.executescript(schema)
+	
+	tNow = int(time.time())
+	tStart = tNow - int(years*365.25*86400)
+	
+	def rows():
+		for t in xrange(tStart, tNow+1, _CADENCE):
+			yield (t, 0, round(rng.uniform(950, 1050), 1), round(rng.uniform(15, 25), 1),
+				  round(rng.uniform(-20, 35), 1), round(rng.uniform(-20, 35), 1), -99.0,
+				  rng.randint(20, 60), rng.randint(10, 99), rng.randint(10, 99), -99.0,
+				  round(rng.uniform(0, 5), 1), rng.randint(0, 12))
+				
+	conn.executemany('INSERT INTO wx (dateTime, usUnits, barometer, inTemp, outTemp, outTemp1, outTemp2, inHumidity, outHumidity, outHumidity1, outHumidity2, rainRate, uv) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', rows())
+	conn.commit()
+	nRows = conn.execute('SELECT COUNT(*) FROM wx').fetchone()[0]
+	conn.close()
+	
+	return nRows
+
+
+def _referenceGetData(archive, age=0):
+	"""
+	Original version of Archive.getData that uses dict_factory and does not
+	limit the number of rows the query returns.
+	"""
+	
+	if archive._dbConn is None:
+		archive.open()
+	archive._dbConn.row_factory = archive.dict_factory
+	cursor = archive._dbConn.cursor()
+	
+	# Fetch the entries that match
+	if age <= 0:
+		cursor.execute('SELECT * FROM wx ORDER BY dateTime DESC')
+	else:
+		# Figure out how far to look back into the database
+		tNow = time.time()
+		tLookback = tNow - age
+		cursor.execute('SELECT * FROM wx WHERE dateTime >= %i ORDER BY dateTime' % tLookback)
+	row = cursor.fetchone()
+	archive._dbConn.row_factory = None
+	
+	# Check for an empty database
+	if row is None:
+		return 0, {}
+		
+	# Convert it to the "standard" dictionary format
+	timestamp = row['dateTime']
+	output = {'temperature': row['outTemp'], 'humidity': row['outHumidity'],
+			  'dewpoint': row['outDewpoint'], 'windchill': row['windchill'],
+			  'indoorTemperature': row['inTemp'], 'indoorHumidity': row['inHumidity'],
+			  'indoorDewpoint': row['inDewpoint'], 'pressure': row['barometer'],
+			  'rainrate': row['rainRate'], 'rainfall': row['rain'],
+			  'altTemperature': [], 'altHumdity': [], 'altDewpoint': [],
+			  'uvIndex': row['uv']}
+	for i in xrange(1, 5):
+		output['altTemperature'].append( row['outTemp%i' % i] if row['outTemp%i' % i] != -99 else None )
+		output['altHumdity'].append( row['outHumidity%i' % i] if row['outHumidity%i' % i] != -99 else None )
+		output['altDewpoint'].append( row['outDewpoint%i' % i] if row['outDewpoint%i' % i] != -99 else None )
+		
+	return timestamp, output
+
+
+def _time(repeat, func, *args):
+	"""
+	Run a function 'repeat' times and return a two-element tuple of the
+	average run time in seconds and the output of the function.
+	"""
+	
+	t0 = time.time()
+	for r in xrange(repeat):
+		output = func(*args)
+	t1 = time.time()
+	
+	return (t1-t0)/repeat, output
+
+
+def main(args):
+	# Parse the command line
+	opts, args = getopt.getopt(args, 'y:r:', ['years=', 'repeat='])
+	years = 3.0
+	repeat = 200
+	for opt,value in opts:
+		if opt in ('-y', '--years'):
+			years = float(value)
+		elif opt in ('-r', '--repeat'):
+			repeat = int(value, 10)
+			
+	# Lookbacks - the same as the ones used by rtl_osv21.py and utils.py
+	tNow = time.time()
+	tLocalMidnight = time.mktime(time.localtime(tNow)[:3] + (0, 0, 0, 0, 0, -1))
+	lookbacks = [('latest', 0), ('1 hour ago', 3660), ('local midnight', tNow-tLocalMidnight+60)]
+	
+	allGood = True
+	workDir = tempfile.mkdtemp(prefix='rtl_osv21-')
+	try:
+		filename = os.path.join(workDir, 'wx-data.db')
+		t0 = time.time()
+		nRows = _buildArchive(filename, years)
+		print "Archive: %.1f years, %i rows, %.1f MB (built in %.1f s)" % \
+			(years, nRows, os.path.getsize(filename)/1024.0**2, time.time()-t0)
+			
+		archive = Archive(filename=filename)
+		try:
+			for label,age in lookbacks:
+				## Make sure that the results match
+				refOutput = _referenceGetData(archive, age)
+				newOutput = archive.getData(age)
+				same = newOutput == refOutput
+				allGood &= same
+				
+				refTime, refOutput = _time(repeat, _referenceGetData, archive, age)
+				newTime, newOutput = _time(repeat, archive.getData, age)
+				print "  %-15s %8.1f us -> %8.1f us (%6.1fx) - %s" % \
+					(label+':', refTime*1e6, newTime*1e6, refTime/max(newTime, 1e-9), 'same' if same else 'DIFFERENT')
+		finally:
+			archive.close()
+	finally:
+		shutil.rmtree(workDir)
+		
+	# Exit with an error if the results ever changed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
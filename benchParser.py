@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to benchmark the bit stream parsing in parser.py.
+
+This script takes zero or more filenames to read raw RTL SDR data from.  If
+no filenames are given, a synthetic bit stream of random bits with valid
+packets from each of the supported sensors mixed in is used instead.  The
+length of the synthetic stream in bits can be set with the '-n' option and
+the number of times each test is repeated with the '-r' option.  The
+synthetic run also includes microbenchmarks of the packet level functions.
+"""
+
+import sys
+import time
+import random
+import timeit
+import getopt
+
+import parser
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+from parser import nibbles2value, computeChecksum, parsePacketv21, parseBitStream
+from synthetic import SENSORS, makePacket, randomPacket
+
+
+def _syntheticStream(nBits, seed=0):
+	"""
+	Return a bytearray of random bits with two copies of a packet with 
+	random values from each of the supported sensors, in turn, mixed in 
+	every 2000 bits or so.
+	"""
+	
+	rng = random.Random(seed)
+	
+	bits = bytearray()
+	k = 0
+	while len(bits) < nBits:
+		## Noise
+		bits.extend( [rng.getrandbits(1) for i in xrange(rng.randint(1000, 3000))] )
+		
+		## Packet - each bit is followed by its logical negation
+		sensorName = sorted(SENSORS.keys())[k % len(SENSORS)]
+		packet = randomPacket(sensorName, rng=rng)[3]
+		for r in xrange(2):
+			for bit in packet:
+				bits.append( bit )
+				bits.append( 1-bit )
+			bits.extend( [rng.getrandbits(1) for i in xrange(40)] )
+		k += 1
+		
+	return bits[:nBits]
+
+
+def _referenceScan(bits, stop):
+	"""
+	Original index-by-index preamble scan from parseBitStream.
+	"""
+	
+	indices = []
+	i = 0
+	while i < stop:
+		if sum(bits[i:i+32:2]) == 16 and sum(bits[i+1:i+1+32:2]) == 0:
+			indices.append( i )
+		i += 1
+		
+	return indices
+
+
+def _referenceParse(bits):
+	"""
+	parseBitStream with the original preamble scan.
+	"""
+	
+	original = parser._findPreambles
+	parser._findPreambles = _referenceScan
+	try:
+		return parseBitStream(bits)
+	finally:
+		parser._findPreambles = original
+
+
+def _referenceNibbles2value(nibbles):
+	"""
+	Original list-based version of parser.nibbles2value.
+	"""
+	
+	n = len(nibbles)/4
+	out = []
+	for i in xrange(n):
+		out.append( (nibbles[4*i+3]<<3) | (nibbles[4*i+2]<<2) | (nibbles[4*i+1]<<1) | nibbles[4*i+0] )
+	return out
+
+
+def _referenceChecksum(bits):
+	"""
+	Original list-based version of parser.computeChecksum.
+	"""
+	
+	value = sum(_referenceNibbles2value(bits))
+	return (value & 0xFF) + (value >> 8)
+
+
+def _time(repeat, func, *args):
+	"""
+	Run a function 'repeat' times and return a two-element tuple of the
+	best run time in seconds and the output of the function.
+	"""
+	
+	best = None
+	for r in xrange(repeat):
+		t0 = time.time()
+		output = func(*args)
+		t1 = time.time()
+		if best is None or t1-t0 < best:
+			best = t1 - t0
+			
+	return best, output
+
+
+def _benchmark(label, bits, repeat):
+	"""
+	Benchmark the parsing of a bit stream and return whether or not the
+	results match the reference implementation.
+	"""
+	
+	print "%s: %i bits" % (label, len(bits))
+	stop = len(bits) - 32
+	
+	## Preamble scan
+	refTime, refIndices = _time(repeat, _referenceScan, bits, stop)
+	newTime, newIndices = _time(repeat, parser._findPreambles, bits, stop)
+	same = newIndices == refIndices
+	print "  preamble scan:  %4i candidates, %8.4f s -> %8.4f s (%6.1fx) - %s" % \
+		(len(newIndices), refTime, newTime, refTime/max(newTime, 1e-9), 'same' if same else 'DIFFERENT')
+		
+	## Full parse
+	refTime, refOutput = _time(repeat, _referenceParse, bits)
+	newTime, newOutput = _time(repeat, parseBitStream, bits)
+	same &= newOutput == refOutput
+	print "  parseBitStream: %4i values,     %8.4f s -> %8.4f s (%6.1fx) - %s" % \
+		(len(newOutput), refTime, newTime, refTime/max(newTime, 1e-9), 'same' if newOutput == refOutput else 'DIFFERENT')
+		
+	return same
+
+
+def _microbenchmark(repeat, number=20000):
+	"""
+	Benchmark the nibble and checksum functions against the original 
+	list-based versions, and parsePacketv21 on valid and invalid packets.  
+	Returns whether or not the results match the reference implementations.
+	"""
+	
+	print "microbenchmarks: best of %i x %i calls" % (repeat, number)
+	
+	def timeCall(func, *args):
+		timer = timeit.Timer(lambda: func(*args))
+		return min(timer.repeat(repeat, number)) / number * 1e6
+		
+	sensorId, ds = SENSORS['BHTR968']
+	packet = bytearray(makePacket('BHTR968', 0, [5,3,2,0, 5,4, 0, 7,9, 0,12]))
+	invalid = bytearray(packet)
+	invalid[ds] ^= 1
+	
+	same = True
+	for label,refFunc,newFunc,bits in (('nibbles2value  ', _referenceNibbles2value, nibbles2value, packet[20:ds]),
+								('computeChecksum', _referenceChecksum, computeChecksum, packet[20:ds])):
+		match = refFunc(bits) == newFunc(bits) and refFunc(list(bits)) == newFunc(list(bits))
+		same &= match
+		refTime = timeCall(refFunc, bits)
+		newTime = timeCall(newFunc, bits)
+		print "  %s: %6.2f us -> %6.2f us (%4.1fx) - %s" % \
+			(label, refTime, newTime, refTime/newTime, 'same' if match else 'DIFFERENT')
+			
+	for label,bits in (('valid', packet), ('bad checksum', invalid)):
+		print "  parsePacketv21, %s: %6.2f us" % (label, timeCall(parsePacketv21, bits))
+		
+	return same
+
+
+def main(args):
+	# Parse the command line
+	opts, args = getopt.getopt(args, 'n:r:', ['bits=', 'repeat='])
+	nBits = 200000
+	repeat = 3
+	for opt,value in opts:
+		if opt in ('-n', '--bits'):
+			nBits = int(value, 10)
+		elif opt in ('-r', '--repeat'):
+			repeat = int(value, 10)
+			
+	allGood = True
+	if len(args) == 0:
+		## Synthetic data
+		allGood &= _microbenchmark(repeat)
+		allGood &= _benchmark('synthetic', _syntheticStream(nBits), repeat)
+		
+	else:
+		## Recordings - decoded with the extension if it is available
+		try:
+			from decoder import readRTLFile
+		except ImportError:
+			from pydecoder import readRTLFile
+			
+		config = loadConfig(CONFIG_FILE)
+		options = getDecoderOptions(config, live=False)
+		for filename in args:
+			bits = readRTLFile(filename, asBytes=True, **options)
+			allGood &= _benchmark(filename, bits, repeat)
+			
+	# Exit with an error if the results ever changed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to benchmark the decoder and parser end-to-end on synthetic
+recordings made with synthetic.py.  For each of a set of scenarios
+(different signal-to-noise ratios, timing jitter, and packet densities, 
+and a signal too weak for the fixed threshold, sparse packets, and noise
+alone that are decoded with the adaptive one) this reports:
+  * the decoding speed of readRTLFile in samples/s,
+  * the parsing speed of parseBitStream in bits/s, 
+  * the fraction of the packets sent that were recovered, both from the
+    raw bits and, with the decoder extension, in framed mode, and
+  * for the adaptive threshold, the final noise level relative to the 
+    noise in the recording and the fraction of the samples detected as
+    pulses.
+
+The scenarios with the adaptive threshold fail if the noise level is not
+within a factor of two of the noise in the recording or if more of the
+samples are detected as pulses than are covered by the transmissions, 
+plus 1% of the recording.
+
+The results can be saved as a baseline with the '-s' option.  Later runs
+are compared against the baseline and the script exits with an error if
+any of the speeds drops by more than the tolerance set with the '-t'
+option (default = 25%) or any of the recovery rates drops by more than 2%.
+The benchmark.json that comes with the scripts only has the recovery 
+rates for 60 s recordings since these do not depend on the machine.  The
+speeds are only compared once a baseline has been saved locally, and only
+if it was saved with the same decoder.  To save just the recovery rates,
+use the '-R' option along with '-s'.
+
+The baseline file can be set with the '-b' option, the length of each
+recording in seconds with the '-d' option, and the minimum number of times
+each step is timed with the '-r' option.  The recordings are written to
+a temporary directory unless a directory to keep them in is given with the
+'-o' option.  The '-h' option prints this message.
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import inspect
+import shutil
+import tempfile
+
+from synthetic import noisePower, generateRecording
+from parser import iterBitStream, iterFrames, parseBitStream
+try:
+	import decoder
+except ImportError:
+	import pydecoder as decoder
+
+
+# Default baseline file
+_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.json')
+
+# Scenarios - name, keywords for generateRecording, and keywords for 
+# readRTLFile
+_SCENARIOS = [('clean',  {'snr': 30.0, 'jitter': 0.0,  'density': 0.5, 'seed': 1}, {}),
+			  ('noisy',  {'snr': 5.0,  'jitter': 0.0,  'density': 0.5, 'seed': 2}, {}),
+			  ('jitter', {'snr': 20.0, 'jitter': 0.06, 'density': 0.5, 'seed': 3}, {}),
+			  ('dense',  {'snr': 20.0, 'jitter': 0.02, 'density': 2.0, 'seed': 4}, {}),
+			  ('weak',   {'snr': 20.0, 'jitter': 0.0,  'density': 0.5, 'seed': 5, 'amplitude': 60.0}, {'adaptive': True}),
+			  ('sparse', {'snr': 30.0, 'jitter': 0.0,  'density': 0.05, 'seed': 8}, {'adaptive': True}),
+			  ('quiet',  {'snr': 20.0, 'jitter': 0.0,  'density': 0.0, 'seed': 9}, {'adaptive': True})]
+
+# Results that depend on the machine and those that do not
+_RATE_KEYS = ('decodeRate', 'parseRate')
+_RECOVERY_KEYS = ('bitsRecovery', 'framedRecovery')
+
+# Allowed drop in the recovery rates
+_RECOVERY_TOLERANCE = 0.02
+
+# Allowed range of the adaptive noise level relative to the noise power in 
+# the recording
+_NOISE_RANGE = (0.5, 2.0)
+
+# Allowed fraction of the recording outside of the transmissions that is 
+# detected as pulses with the adaptive threshold
+_PULSE_TOLERANCE = 0.01
+
+# Minimum time to spend timing each step in s
+_MIN_TIME = 1.0
+
+
+def _readingKey(sensorName, channel, values):
+	"""
+	Return a hashable version of a reading that can be compared between
+	what was sent and what was recovered.
+	"""
+	
+	items = []
+	for key,value in sorted(values.items()):
+		if not isinstance(value, str):
+			value = round(float(value), 1)
+		items.append( (key, value) )
+		
+	return (sensorName, channel, tuple(items))
+
+
+def _recoveryRate(sent, readings):
+	"""
+	Given the list of packets sent from generateRecording and an iterable
+	of Readings, return a two-element tuple of the fraction of the packets
+	sent that were recovered and the number of Readings that do not match
+	any packet sent.
+	"""
+	
+	remaining = {}
+	for start,stop,sensorName,channel,values in sent:
+		key = _readingKey(sensorName, channel, values)
+		remaining[key] = remaining.get(key, 0) + 1
+		
+	recovered, spurious = 0, 0
+	for reading in readings:
+		key = _readingKey(reading.sensorName, reading.channel, reading.data)
+		if remaining.get(key, 0) > 0:
+			remaining[key] -= 1
+			recovered += 1
+		else:
+			spurious += 1
+			
+	return float(recovered)/max(1, len(sent)), spurious
+
+
+def _supports(options):
+	"""
+	Return whether or not the decoder accepts all of the readRTLFile 
+	keywords in 'options'.
+	"""
+	
+	try:
+		argNames = inspect.getargspec(decoder.readRTLFile).args
+	except TypeError:
+		## The extension's functions cannot be inspected but take them all
+		return True
+		
+	return all([key in argNames for key in options])
+
+
+def _best(repeat, func, *args, **kwds):
+	"""
+	Run a function at least 'repeat' times, and for at least _MIN_TIME 
+	seconds in total, and return a two-element tuple of the best run time in
+	seconds and the output of the function.
+	"""
+	
+	best, total, r = None, 0.0, 0
+	while r < repeat or total < _MIN_TIME:
+		t0 = time.time()
+		output = func(*args, **kwds)
+		t1 = time.time()
+		if best is None or t1-t0 < best:
+			best = t1 - t0
+		total += t1 - t0
+		r += 1
+		
+	return best, output
+
+
+def _runScenario(filename, sent, noise, repeat, options):
+	"""
+	Benchmark a single recording with the given noise power, decoded with 
+	the readRTLFile keywords in 'options', and return a dictionary of the 
+	results.
+	"""
+	
+	nSamples = os.path.getsize(filename) // 2
+	results = {}
+	
+	# Decoding
+	decodeTime, bits = _best(repeat, decoder.readRTLFile, filename, asBytes=True, **options)
+	results['decodeRate'] = nSamples / decodeTime
+	
+	# Parsing
+	parseTime, output = _best(repeat, parseBitStream, bits)
+	results['parseRate'] = len(bits) / max(parseTime, 1e-9)
+	results['bits'] = len(bits)
+	
+	# Recovery
+	results['sent'] = len(sent)
+	results['bitsRecovery'], results['bitsSpurious'] = _recoveryRate(sent, iterBitStream(bits))
+	try:
+		frames = decoder.readRTLFile(filename, asBytes=True, framed=True, **options)
+		results['framedRecovery'], results['framedSpurious'] = _recoveryRate(sent, iterFrames(frames))
+	except TypeError:
+		## No framed mode in pydecoder
+		pass
+		
+	# Adaptive threshold levels at the end of the last decoding
+	if options.get('adaptive', False):
+		stats = decoder.stats()
+		results['noiseRatio'] = stats['noiseLevel'] / noise if noise > 0 else None
+		results['pulseFraction'] = float(stats['pulseSamples']) / nSamples
+		results['busyFraction'] = float(sum([stop-start for start,stop,sensorName,channel,values in sent])) / nSamples
+		
+	return results
+
+
+def _checkAdaptive(name, results):
+	"""
+	Check that the adaptive threshold tracked the noise in the recording and
+	did not detect pulses outside of the transmissions, print out any 
+	problems, and return whether or not everything is fine.
+	"""
+	
+	good = True
+	if results['noiseRatio'] is not None and not (_NOISE_RANGE[0] <= results['noiseRatio'] <= _NOISE_RANGE[1]):
+		print "  ERROR: %s noise level is %.2f times the noise in the recording" % (name, results['noiseRatio'])
+		good = False
+	if results['pulseFraction'] > results['busyFraction'] + _PULSE_TOLERANCE:
+		print "  ERROR: %s has %.1f%% of the samples as pulses but only %.1f%% in transmissions" % \
+			(name, 100*results['pulseFraction'], 100*results['busyFraction'])
+		good = False
+		
+	return good
+
+
+def _compare(name, results, baseline, tolerance):
+	"""
+	Compare the results for a scenario against the baseline, print out any
+	regressions, and return whether or not everything is within tolerance.
+	"""
+	
+	good = True
+	for key in _RATE_KEYS:
+		if key in baseline and results[key] < (1-tolerance)*baseline[key]:
+			print "  REGRESSION: %s %s is %.3g, baseline is %.3g" % (name, key, results[key], baseline[key])
+			good = False
+	for key in _RECOVERY_KEYS:
+		if key in baseline and key in results and results[key] < baseline[key] - _RECOVERY_TOLERANCE:
+			print "  REGRESSION: %s %s is %.1f%%, baseline is %.1f%%" % (name, key, 100*results[key], 100*baseline[key])
+			good = False
+			
+	return good
+
+
+def usage(exitCode=None, msg=None):
+	"""
+	Print the usage information, along with an optional message, and exit
+	with the given code, if any.
+	"""
+	
+	print __doc__.strip()
+	if msg is not None:
+		print " "
+		print msg
+		
+	if exitCode is not None:
+		sys.exit(exitCode)
+
+
+def main(args):
+	# Parse the command line
+	try:
+		opts, args = getopt.getopt(args, 'hsRb:t:d:r:o:', ['help', 'save', 'recovery-only', 'baseline=', 'tolerance=', 'duration=', 'repeat=', 'output='])
+	except getopt.GetoptError, err:
+		usage(exitCode=2, msg=str(err))
+	save = False
+	recoveryOnly = False
+	baselineFile = _BASELINE_FILE
+	tolerance = 0.25
+	duration = 60.0
+	repeat = 3
+	outputDir = None
+	for opt,value in opts:
+		if opt in ('-h', '--help'):
+			usage(exitCode=0)
+		elif opt in ('-s', '--save'):
+			save = True
+		elif opt in ('-R', '--recovery-only'):
+			recoveryOnly = True
+		elif opt in ('-b', '--baseline'):
+			baselineFile = value
+		elif opt in ('-t', '--tolerance'):
+			tolerance = float(value)
+		elif opt in ('-d', '--duration'):
+			duration = float(value)
+		elif opt in ('-r', '--repeat'):
+			repeat = int(value, 10)
+		elif opt in ('-o', '--output'):
+			outputDir = value
+			
+	# Load the baseline, if there is one that matches
+	backend = decoder.__name__
+	baseline = {}
+	if not save and os.path.exists(baselineFile):
+		fh = open(baselineFile, 'r')
+		stored = json.load(fh)
+		fh.close()
+		
+		if stored.get('duration') != duration:
+			print "NOTE: baseline is for %.1f s recordings but running with %.1f s, ignoring" % (stored.get('duration'), duration)
+		else:
+			baseline = stored['scenarios']
+			
+			## Speeds are only comparable with the same decoder
+			if stored.get('backend', backend) != backend:
+				print "NOTE: baseline speeds are for '%s' but running with '%s', only comparing recovery" % (stored.get('backend'), backend)
+				for name in baseline:
+					for key in _RATE_KEYS:
+						baseline[name].pop(key, None)
+						
+	# Run
+	workDir = outputDir
+	if workDir is None:
+		workDir = tempfile.mkdtemp(prefix='rtl_osv21-')
+	elif not os.path.exists(workDir):
+		os.makedirs(workDir)
+		
+	allGood = True
+	scenarios = {}
+	try:
+		print "Backend: %s, %.1f s recordings" % (backend, duration)
+		for name,keywords,options in _SCENARIOS:
+			if not _supports(options):
+				print "%s: skipped, '%s' does not support %s" % (name, backend, ', '.join(sorted(options.keys())))
+				continue
+				
+			filename = os.path.join(workDir, 'synthetic-%s.bin' % name)
+			sent = generateRecording(filename, duration=duration, **keywords)
+			noise = noisePower(keywords['snr'], keywords.get('amplitude', 116.0))
+			results = _runScenario(filename, sent, noise, repeat, options)
+			scenarios[name] = results
+			
+			amplitude = ', amplitude %.0f' % keywords['amplitude'] if 'amplitude' in keywords else ''
+			print "%s: SNR %.0f dB, jitter %.0f%%, %g packets/s%s" % (name, keywords['snr'], 100*keywords['jitter'], keywords['density'], amplitude)
+			if options:
+				print "  options:        %s" % ', '.join(['%s=%s' % (key, options[key]) for key in sorted(options.keys())])
+			print "  readRTLFile:    %6.2f Msamples/s" % (results['decodeRate']/1e6,)
+			print "  parseBitStream: %6.3f Mbits/s (%i bits)" % (results['parseRate']/1e6, results['bits'])
+			print "  recovery:       %5.1f%% of %i packets from bits (%i spurious)" % \
+				(100*results['bitsRecovery'], results['sent'], results['bitsSpurious'])
+			if 'framedRecovery' in results:
+				print "                  %5.1f%% of %i packets framed (%i spurious)" % \
+					(100*results['framedRecovery'], results['sent'], results['framedSpurious'])
+			if 'pulseFraction' in results:
+				noiseRatio = '%.2f times the noise' % results['noiseRatio'] if results['noiseRatio'] is not None else 'no noise'
+				print "  threshold:      noise level %s, %.1f%% pulses (%.1f%% in transmissions)" % \
+					(noiseRatio, 100*results['pulseFraction'], 100*results['busyFraction'])
+				allGood &= _checkAdaptive(name, results)
+				
+			if name in baseline:
+				allGood &= _compare(name, results, baseline[name], tolerance)
+				
+	finally:
+		if outputDir is None:
+			shutil.rmtree(workDir)
+			
+	# Save
+	if save:
+		stored = {'duration': duration, 'scenarios': scenarios}
+		if recoveryOnly:
+			for name in scenarios:
+				scenarios[name] = dict([(key, value) for key,value in scenarios[name].items() if key in _RECOVERY_KEYS])
+		else:
+			stored['backend'] = backend
+			
+		fh = open(baselineFile, 'w')
+		json.dump(stored, fh, indent=2, separators=(',', ': '), sort_keys=True)
+		fh.write('\n')
+		fh.close()
+		print "Saved baseline to '%s'" % baselineFile
+		
+	# Exit with an error if anything regressed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
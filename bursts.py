@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for reading the burst recordings written by readRTL with 'bursts'
+set.  A burst recording only holds the raw RTL SDR data around the bursts
+of signal along with the sample offset and time of each piece.
+
+The file starts with a 16 byte header of:
+  * the 8 character magic string "RTLBURST",
+  * a 32-bit version number, and
+  * the 32-bit sample rate in Hz.
+This is followed by chunks of raw data, each with a 20 byte header of:
+  * the 64-bit sample counter of the first sample in the chunk, counting
+    from zero at the start of the capture,
+  * the 64-bit double UNIX time of the first sample, and
+  * the 32-bit number of bytes of interleaved 8-bit I/Q samples that follow.
+All values are little endian.  Chunks whose sample counters follow on from
+each other are part of the same burst.
+"""
+
+import struct
+
+__version__ = '0.1'
+__all__ = ['BURST_MAGIC', 'isBurstFile', 'getBurstSampleRate', 'iterBursts',
+		   '__version__', '__all__']
+
+
+# File format
+BURST_MAGIC = 'RTLBURST'
+_BURST_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sII')
+_CHUNK_HEADER = struct.Struct('<qdI')
+
+
+def _readHeader(fh):
+	"""
+	Read the header of a burst recording from an open file handle and
+	return the sample rate in Hz, or None if the file is not a burst
+	recording.
+	"""
+	
+	header = fh.read(_FILE_HEADER.size)
+	if len(header) != _FILE_HEADER.size:
+		return None
+		
+	magic, version, sampleRate = _FILE_HEADER.unpack(header)
+	if magic != BURST_MAGIC or version != _BURST_VERSION:
+		return None
+		
+	return sampleRate
+
+
+def getBurstSampleRate(filename):
+	"""
+	Return the sample rate in Hz of a burst recording, or None if the file
+	is not a burst recording.
+	"""
+	
+	fh = open(filename, 'rb')
+	try:
+		return _readHeader(fh)
+	finally:
+		fh.close()
+
+
+def isBurstFile(filename):
+	"""
+	Return whether or not a file is a burst recording.
+	"""
+	
+	return getBurstSampleRate(filename) is not None
+
+
+def iterBursts(filename):
+	"""
+	Iterate over the bursts in a burst recording and yield a three-element
+	tuple of the sample offset of the first sample, the UNIX time of the
+	first sample, and the raw interleaved 8-bit I/Q data as a string for
+	each one.
+	"""
+	
+	fh = open(filename, 'rb')
+	try:
+		if _readHeader(fh) is None:
+			raise ValueError("'%s' is not a burst recording" % filename)
+			
+		burst, nextOffset = None, None
+		while True:
+			header = fh.read(_CHUNK_HEADER.size)
+			if len(header) != _CHUNK_HEADER.size:
+				break
+			offset, timestamp, size = _CHUNK_HEADER.unpack(header)
+			data = fh.read(size)
+			
+			## Continue the current burst or start a new one
+			if burst is not None and offset == nextOffset:
+				burst[2].append( data )
+			else:
+				if burst is not None:
+					yield burst[0], burst[1], ''.join(burst[2])
+				burst = (offset, timestamp, [data,])
+			nextOffset = offset + len(data)//2
+			
+		if burst is not None:
+			yield burst[0], burst[1], ''.join(burst[2])
+			
+	finally:
+		fh.close()
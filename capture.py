@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for capturing data from several RTL SDR devices at once and for 
+decoding large RTL SDR recordings in parallel.
+"""
+
+import os
+import sys
+import mmap
+import threading
+import multiprocessing.pool
+
+from bursts import isBurstFile
+from decoder import readRTL, readRTLFile, Decoder, stats, SAMPLE_RATE, DECIMATION
+
+__version__ = '0.1'
+__all__ = ['readMultipleRTL', 'readRTLFileParallel', '__version__', '__all__']
+
+
+# Default chunk size and overlap in seconds for readRTLFileParallel
+_CHUNK_TIME = 30.0
+_OVERLAP_TIME = 2.0
+
+
+def readMultipleRTL(duration, devices, callback, **kwds):
+	"""
+	Capture data from several RTL SDR devices at once for the specified 
+	duration in seconds.  'devices' is a list of device indices or serial 
+	numbers and each device is read from its own thread with readRTL.  The 
+	output of each device is passed to the callback as 
+	callback(chunk, device=device) so a single BitStreamParser can be used 
+	to collect the data from all of them.  If 'record' is provided, it is 
+	a function that is called with each device and returns the filename to
+	record the raw data from that device to.  All other keywords are passed 
+	on to readRTL.
+	
+	If the callback returns True for a device, that capture stops early.  
+	If any of the captures fails, the first exception is re-raised once all
+	of the captures have finished.  Otherwise, a dictionary of the decoder
+	statistics for each device, keyed by device, is returned.
+	
+	Example:
+	>>> bsp = BitStreamParser(elevation=elevation, framed=True)
+	>>> readMultipleRTL(90, [0, '00000002'], bsp, asBytes=True, framed=True)
+	>>> output = bsp.flush()
+	"""
+	
+	errors = []
+	deviceStats = {}
+	record = kwds.pop('record', None)
+	
+	def _capture(device):
+		def _callback(chunk):
+			return callback(chunk, device=device)
+			
+		try:
+			filename = record(device) if record is not None else None
+			readRTL(duration, callback=_callback, device=device, record=filename, **kwds)
+		except Exception:
+			errors.append( sys.exc_info() )
+		deviceStats[device] = stats()
+			
+	# Start the captures
+	threads = []
+	for device in devices:
+		thread = threading.Thread(target=_capture, args=(device,))
+		thread.daemon = True
+		thread.start()
+		threads.append( thread )
+		
+	# Wait for them to finish
+	for thread in threads:
+		thread.join()
+		
+	# Report the first problem
+	if errors:
+		raise errors[0][0], errors[0][1], errors[0][2]
+		
+	return deviceStats
+
+
+def readRTLFileParallel(filename, nThreads=None, chunkTime=_CHUNK_TIME, overlapTime=_OVERLAP_TIME, asBytes=False, **kwds):
+	"""
+	Decode a RTL SDR recording in framed mode using several threads and 
+	return the list of (sample offset, timestamp, packet bits) candidate 
+	packets, i.e., the same output as readRTLFile(filename, framed=True).
+	
+	The file is memory mapped and split into chunks of 'chunkTime' seconds 
+	that are decoded by a pool of 'nThreads' threads (default = number of 
+	CPUs).  Each chunk is decoded starting 'overlapTime' seconds early so 
+	that the decoder has settled by the start of the chunk, and continues 
+	'overlapTime' seconds past the end of the chunk so that packets which 
+	start near the end are completed.  A packet belongs to the chunk that 
+	its first preamble bit was decoded in, so packets in the overlaps are 
+	neither lost nor duplicated.  The overlap needs to be longer than a 
+	packet and longer than the time constants used by the decoder.
+	
+	The decoders for all but the first chunk start in 'midStream' mode so
+	that, like the serial decoding, the first edge after a quiet lead-in 
+	restarts the Manchester decoding rather than being rejected.  The 
+	exception is a chunk whose lead-in starts before the first edge in the
+	recording, which is decoded again without it.  A frame 
+	is only complete once it has all of its bits, which can take until the 
+	next transmission, so the decoding also continues past the overlap, 
+	'overlapTime' seconds at a time, until every frame that starts in the 
+	chunk is complete.
+	
+	The timestamps are startTime plus the sample offset divided by the 
+	sample rate, as for readRTLFile.  All other keywords are passed on to 
+	Decoder.
+	
+	Burst recordings are already small so they are decoded with a single 
+	call to readRTLFile instead.
+	"""
+	
+	if isBurstFile(filename):
+		return readRTLFile(filename, asBytes=asBytes, framed=True, **kwds)
+		
+	
+	startTime = kwds.pop('startTime', 0.0)
+	
+	# Setup the chunking in samples, aligned to the decimation
+	sampleRate = kwds.get('sampleRate', SAMPLE_RATE)
+	decimation = kwds.get('decimation', DECIMATION)
+	if decimation is None:
+		decimation = DECIMATION
+	chunkSize = max(1, int(chunkTime*sampleRate) // decimation) * decimation
+	overlapSize = int(overlapTime*sampleRate + decimation - 1) // decimation * decimation
+	if nThreads is None:
+		nThreads = multiprocessing.cpu_count()
+		
+	# Map the file
+	fh = open(filename, 'rb')
+	try:
+		nSamples = os.fstat(fh.fileno()).st_size // 2
+		if nSamples == 0:
+			return []
+		mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+		fh.close()
+		
+	# Offset into each chunk of the start of the lead-in of a later chunk, 
+	# and how many chunks later that is
+	splitOffset = -overlapSize % chunkSize
+	splitLag = (overlapSize + chunkSize - 1) // chunkSize
+	
+	def _pending(decoder, frames, stop):
+		## Frames are completed in the order that they start so the ones
+		## that start by 'stop' are done once a later one is complete or
+		## once there are none in progress
+		decoderStats = decoder.stats()
+		if decoderStats['frames'] - decoderStats['framesDropped'] == len(frames):
+			return False
+		return len(frames) == 0 or frames[-1][0] <= stop
+		
+	def _decode(start, midStream=True):
+		stop = min(start+chunkSize, nSamples)
+		split = min(start+splitOffset, stop)
+		leadIn = max(start-overlapSize, 0)
+		leadOut = min(stop+overlapSize, nSamples)
+		
+		## Decode - the decoder releases the GIL so the chunks run in parallel.
+		## The data are fed in pieces to find out if there are any edges in 
+		## the chunk, and before 'split', for the midStream check.
+		decoder = Decoder(asBytes=asBytes, framed=True, midStream=(midStream and leadIn > 0), **kwds)
+		frames, edges = [], []
+		for position,end in ((leadIn, start), (start, split), (split, stop), (stop, leadOut)):
+			frames.extend(decoder.feed(buffer(mm, 2*position, 2*(end-position))))
+			edges.append( decoder.stats()['edges'] )
+		while leadOut < nSamples and _pending(decoder, frames, stop-leadIn):
+			position, leadOut = leadOut, min(leadOut+overlapSize, nSamples)
+			frames.extend(decoder.feed(buffer(mm, 2*position, 2*(leadOut-position))))
+		frames.extend(decoder.flush())
+		
+		## Keep only the packets that start in this chunk.  The sample 
+		## offsets count from one.
+		output = []
+		for offset,timestamp,bits in frames:
+			offset += leadIn
+			if offset > start and offset <= stop:
+				output.append( (offset, startTime + offset/float(sampleRate), bits) )
+		return output, edges[1] > edges[0], edges[2] > edges[0], decoder.stats()['edges'] > 0
+		
+	# Decode the chunks
+	starts = range(0, nSamples, chunkSize)
+	pool = multiprocessing.pool.ThreadPool(nThreads)
+	try:
+		chunks = pool.map(_decode, starts)
+		
+		## Find the chunks that saw edges but have lead-ins that start before
+		## the first edge in the recording and decode them again
+		redo = []
+		seenEdge = False
+		for m in xrange(splitLag, len(chunks)):
+			k = m - splitLag
+			if starts[m] > overlapSize and chunks[m][3] and not (seenEdge or chunks[k][1]):
+				redo.append( m )
+			seenEdge |= chunks[k][2]
+		for m,chunk in zip(redo, pool.map(lambda m: _decode(starts[m], midStream=False), redo)):
+			chunks[m] = chunk
+	finally:
+		pool.close()
+		pool.join()
+		mm.close()
+		
+	# Stitch the packets back together
+	frames = []
+	for chunk in chunks:
+		frames.extend(chunk[0])
+	return frames
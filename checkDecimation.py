@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to check the decimating front end of the decoder against the full
+rate decoding on one or more saved rtl_sdr files.
+
+This script takes one or more filenames to read raw RTL SDR data from.  The
+decimation factors to try can be set with the '-d' option, e.g.,
+'-d 2,4,8'.
+"""
+
+import sys
+import time
+import getopt
+
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+from decoder import readRTLFile
+from parser import parseBitStream
+
+
+def _decode(filename, decimation, options):
+	"""
+	Decode a file with the given decimation and return a three-element tuple
+	of the raw bits, the packets found, and the run time in seconds.
+	"""
+	
+	options = dict(options)
+	options['decimation'] = decimation
+	
+	t0 = time.time()
+	bits = readRTLFile(filename, asBytes=True, **options)
+	t1 = time.time()
+	frames = readRTLFile(filename, asBytes=True, framed=True, **options)
+	
+	packets = set([str(packet) for offset,timestamp,packet in frames])
+	return bits, packets, t1-t0
+
+
+def main(args):
+	# Parse the command line
+	opts, args = getopt.getopt(args, 'd:', ['decimation=',])
+	decimations = [2, 4, 5, 8, 10]
+	for opt,value in opts:
+		if opt in ('-d', '--decimation'):
+			decimations = [int(v, 10) for v in value.split(',')]
+	if len(args) == 0:
+		raise RuntimeError("Invalid number of arguments provided, expected at least one filename")
+		
+	# Read in the configuration file
+	config = loadConfig(CONFIG_FILE)
+	options = getDecoderOptions(config, live=False)
+	try:
+		del options['decimation']
+	except KeyError:
+		pass
+		
+	allGood = True
+	for filename in args:
+		print "%s:" % filename
+		
+		## Reference decoding at the full rate
+		refBits, refPackets, refTime = _decode(filename, 1, options)
+		refOutput = parseBitStream(refBits)
+		print "  decimation  1: %7i bits, %4i packets, %6.2f s" % (len(refBits), len(refPackets), refTime)
+		
+		## Decimated decoding
+		for decimation in decimations:
+			bits, packets, runTime = _decode(filename, decimation, options)
+			output = parseBitStream(bits)
+			
+			exact = 'bit-exact' if bits == refBits else 'bits differ'
+			same = 'same values' if output == refOutput else 'VALUES DIFFER'
+			if output != refOutput:
+				allGood = False
+				
+			print "  decimation %2i: %7i bits, %4i packets (%i in common, %i missing, %i extra), %6.2f s - %s, %s" % \
+				(decimation, len(bits), len(packets), len(packets & refPackets), len(refPackets - packets),
+				len(packets - refPackets), runTime, exact, same)
+				
+	# Exit with an error if the decoded values ever changed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to check the parallel decoding of capture.readRTLFileParallel
+against the serial decoding of readRTLFile in framed mode.
+
+This script takes zero or more filenames to read raw RTL SDR data from.  If
+no filenames are given, a 30 s synthetic recording made with synthetic.py
+is used instead.  The chunk lengths in seconds to try can be set with the
+'-c' option, e.g., '-c 1,2.5,5'.  These are kept short, even shorter than
+the overlap, so that there are many seams between the chunks.
+"""
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import tempfile
+
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+from decoder import readRTLFile
+from capture import readRTLFileParallel
+from synthetic import generateRecording
+
+
+def _check(filename, chunkTimes, options):
+	"""
+	Decode a file serially and in parallel with each of the chunk lengths
+	and return whether or not the frames always match.
+	"""
+	
+	print "%s:" % filename
+	
+	## Reference serial decoding
+	t0 = time.time()
+	refFrames = readRTLFile(filename, asBytes=True, framed=True, **options)
+	t1 = time.time()
+	refOffsets = set([offset for offset,timestamp,bits in refFrames])
+	print "  serial:          %4i frames, %6.2f s" % (len(refFrames), t1-t0)
+	
+	## Parallel decoding
+	allGood = True
+	for chunkTime in chunkTimes:
+		t0 = time.time()
+		frames = readRTLFileParallel(filename, chunkTime=chunkTime, asBytes=True, **options)
+		t1 = time.time()
+		offsets = set([offset for offset,timestamp,bits in frames])
+		
+		same = frames == refFrames
+		allGood &= same
+		print "  chunks of %4.1f s: %4i frames (%i missing, %i extra), %6.2f s - %s" % \
+			(chunkTime, len(frames), len(refOffsets - offsets), len(offsets - refOffsets), t1-t0,
+			'same' if same else 'DIFFERENT')
+			
+	return allGood
+
+
+def main(args):
+	# Parse the command line
+	opts, args = getopt.getopt(args, 'c:', ['chunks=',])
+	chunkTimes = [1.0, 2.5, 3.0, 5.0, 7.0, 10.0]
+	for opt,value in opts:
+		if opt in ('-c', '--chunks'):
+			chunkTimes = [float(v) for v in value.split(',')]
+			
+	# Read in the configuration file
+	config = loadConfig(CONFIG_FILE)
+	options = getDecoderOptions(config, live=False)
+	
+	allGood = True
+	if len(args) == 0:
+		## Synthetic data
+		workDir = tempfile.mkdtemp(prefix='rtl_osv21-')
+		try:
+			filename = os.path.join(workDir, 'synthetic.bin')
+			generateRecording(filename, duration=30.0, snr=15.0, seed=7)
+			allGood &= _check(filename, chunkTimes, options)
+		finally:
+			shutil.rmtree(workDir)
+			
+	else:
+		## Recordings
+		for filename in args:
+			allGood &= _check(filename, chunkTimes, options)
+			
+	# Exit with an error if the frames ever changed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
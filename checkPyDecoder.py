@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Script to check the pure NumPy decoder in pydecoder.py against the decoder
+extension on one or more saved rtl_sdr files, and to compare how long each 
+of them takes.
+
+This script takes one or more filenames to read raw RTL SDR data from.
+"""
+
+import sys
+import time
+
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+import pydecoder
+try:
+	import decoder
+except ImportError:
+	decoder = None
+
+
+def main(args):
+	# Parse the command line
+	if len(args) == 0:
+		raise RuntimeError("Invalid number of arguments provided, expected at least one filename")
+		
+	# Read in the configuration file
+	config = loadConfig(CONFIG_FILE)
+	options = getDecoderOptions(config, live=False)
+	if options.get('adaptive', False):
+		print "NOTE: the adaptive threshold is only available in the decoder extension, ignoring"
+	try:
+		del options['adaptive']
+	except KeyError:
+		pass
+		
+	allGood = True
+	for filename in args:
+		print "%s:" % filename
+		
+		## NumPy
+		t0 = time.time()
+		pyBits = pydecoder.readRTLFile(filename, asBytes=True, **options)
+		pyTime = time.time() - t0
+		print "  NumPy: %7i bits, %6.2f s" % (len(pyBits), pyTime)
+		
+		## C, if we have it
+		if decoder is not None:
+			t0 = time.time()
+			cBits = decoder.readRTLFile(filename, asBytes=True, **options)
+			cTime = time.time() - t0
+			
+			exact = 'bit-exact' if pyBits == cBits else 'BITS DIFFER'
+			if pyBits != cBits:
+				allGood = False
+			print "  C:     %7i bits, %6.2f s - %s, NumPy takes %.1fx as long" % (len(cBits), cTime, exact, pyTime/max(cTime, 1e-6))
+			
+	# Exit with an error if the bits ever differed
+	if not allGood:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
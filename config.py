@@ -8,7 +8,7 @@ import os
 import re
 
 __version__ = '0.1'
-__all__ = ['CONFIG_FILE', 'loadConfig', '__version__', '__all__']
+__all__ = ['CONFIG_FILE', 'loadConfig', 'getDecoderOptions', '__version__', '__all__']
 
 
 # Files
@@ -18,6 +18,29 @@ _BASE_PATH = os.path.dirname(os.path.abspath(__file__))
 ## Wunderground Configuration
 CONFIG_FILE = os.path.join(_BASE_PATH, 'rtl_osv21.config')
 
+# Strings accepted for boolean values
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+_FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def _parseBool(value):
+	"""
+	Convert a boolean configuration value to a bool.  Strings are matched
+	against _TRUE_VALUES and _FALSE_VALUES without regard to case and a
+	ValueError is raised for anything else.
+	"""
+	
+	if isinstance(value, bool):
+		return value
+		
+	lowered = value.strip().lower()
+	if lowered in _TRUE_VALUES:
+		return True
+	elif lowered in _FALSE_VALUES:
+		return False
+	else:
+		raise ValueError("Invalid boolean value '%s'" % value)
+
 
 def loadConfig(filename):
 	"""
@@ -35,7 +58,18 @@ def loadConfig(filename):
 			  'retainData': False,  
 		  	  'useTimeout': False, 
 			  'includeIndoor': False, 
-			  'elevation': 0.0}
+			  'elevation': 0.0, 
+			  'expectedSensors': [], 
+			  'devices': [], 
+			  'frequency': None, 
+			  'sampleRate': None, 
+			  'smoothWindow': None, 
+			  'threshold': None, 
+			  'decimation': None, 
+			  'adaptive': None, 
+			  'recordDir': None, 
+			  'recordKeep': 15.0, 
+			  'recordBursts': False}
 
 	# Parse the file
 	try:
@@ -57,15 +91,46 @@ def loadConfig(filename):
 		# Float type conversion
 		config['duration'] = float(config['duration'])
 		config['elevation'] = float(config['elevation'])
+		config['recordKeep'] = float(config['recordKeep'])
 		
 		# Boolean type conversions
-		config['verbose'] = bool(config['verbose'])
-		config['useTimeout'] = bool(config['useTimeout'])
-		config['retainData'] = bool(config['retainData'])
-		config['includeIndoor'] = bool(config['includeIndoor'])
+		config['verbose'] = _parseBool(config['verbose'])
+		config['useTimeout'] = _parseBool(config['useTimeout'])
+		config['retainData'] = _parseBool(config['retainData'])
+		config['includeIndoor'] = _parseBool(config['includeIndoor'])
+		config['recordBursts'] = _parseBool(config['recordBursts'])
+		
+		# Optional decoder parameter conversions
+		for key,cnv in (('frequency', int), ('sampleRate', int), ('smoothWindow', int), ('threshold', float), ('decimation', int), ('adaptive', _parseBool)):
+			if config[key] is not None:
+				config[key] = cnv(config[key])
+				
+		# List type conversions
+		for key in ('expectedSensors', 'devices'):
+			if isinstance(config[key], str):
+				config[key] = [v.strip() for v in config[key].split(',') if v.strip() != '']
 		
 	except IOError:
 		pass
 		
 	# Done
-	return config
\ No newline at end of file
+	return config
+
+
+def getDecoderOptions(config, live=True):
+	"""
+	Given a configuration dictionary from loadConfig, return a dictionary
+	of the radio and detection keywords to pass to readRTL.  If 'live' is
+	False, only the keywords accepted by readRTLFile are returned.
+	"""
+	
+	keys = ['sampleRate', 'smoothWindow', 'threshold', 'decimation', 'adaptive']
+	if live:
+		keys.insert(0, 'frequency')
+		
+	options = {}
+	for key in keys:
+		if config[key] is not None:
+			options[key] = config[key]
+			
+	return options
\ No newline at end of file
@@ -11,6 +11,23 @@ __all__ = ["Archive", "__version__", "__all__"]
 
 
 class Archive(object):
+	"""
+	Class for reading from and writing to the weather archive.  The database
+	is opened in write-ahead log (WAL) mode so that each commit costs a 
+	single append to the log rather than several writes and syncs of the 
+	database file.
+	
+	By default every reading written is committed right away.  Setting the
+	'batchSize' keyword to more than one groups the readings into 
+	transactions of up to that many readings and setting 'batchTime' limits
+	how long, in seconds, a reading can wait to be committed.  Both limits 
+	are checked as each reading is written.  Any readings still waiting are
+	committed by flush() and close().
+	
+	The 'filename' keyword can be used to open a database other than the 
+	default one in the 'archive' directory.
+	"""
+	
 	_dbConn = None
 	_cursor = None
 	_dbMapper = {'temperature': 'outTemp', 
@@ -27,12 +44,31 @@ class Archive(object):
 				 'rainrate': 'rainRate', 
 				 'rainfall': 'rain',
 				 'uvIndex': 'uv'}
-				 
-	def __init__(self):
-		self._dbName = os.path.join(os.path.dirname(__file__), 'archive', 'wx-data.db')
+	
+	# Columns read by getData and the queries for the latest entry and for the
+	# first entry after a given time.  Both only need to visit one row of the
+	# primary key.
+	_getColumns = ('dateTime', 'outTemp', 'outHumidity', 'outDewpoint', 'windchill', 
+				   'inTemp', 'inHumidity', 'inDewpoint', 'barometer', 'rainRate', 'rain', 'uv', 
+				   'outTemp1', 'outTemp2', 'outTemp3', 'outTemp4', 
+				   'outHumidity1', 'outHumidity2', 'outHumidity3', 'outHumidity4', 
+				   'outDewpoint1', 'outDewpoint2', 'outDewpoint3', 'outDewpoint4')
+	_latestQuery = 'SELECT %s FROM wx ORDER BY dateTime DESC LIMIT 1' % ','.join(_getColumns)
+	_lookbackQuery = 'SELECT %s FROM wx WHERE dateTime >= ? ORDER BY dateTime LIMIT 1' % ','.join(_getColumns)
+	
+	def __init__(self, batchSize=1, batchTime=None, filename=None):
+		self._dbName = filename
+		if self._dbName is None:
+			self._dbName = os.path.join(os.path.dirname(__file__), 'archive', 'wx-data.db')
 		if not os.path.exists(self._dbName):
 			raise RuntimeError("Archive database not found")
 			
+		# Write batching
+		self.batchSize = max(1, int(batchSize))
+		self.batchTime = batchTime
+		self._pending = 0
+		self._pendingSince = None
+		
 		self.open()
 		
 	def dict_factory(self, cursor, row):
@@ -47,17 +83,34 @@ class Archive(object):
 		"""
 		
 		self._dbConn = sqlite3.connect(self._dbName)
-		self._dbConn.row_factory = self.dict_factory
 		self._cursor = self._dbConn.cursor()
 		
+		# Use the write-ahead log, which only needs to be synced at 
+		# checkpoints in this mode
+		self._cursor.execute('PRAGMA journal_mode=WAL')
+		self._cursor.execute('PRAGMA synchronous=NORMAL')
+		
+	def flush(self):
+		"""
+		Commit any readings that are waiting to be written.
+		"""
+		
+		if self._dbConn is not None and self._pending:
+			self._dbConn.commit()
+		self._pending = 0
+		self._pendingSince = None
+		
 	def close(self):
 		"""
 		Close the database.
 		"""
 	
 		if self._dbConn is not None:
+			self.flush()
 			self._dbConn.commit()
 			self._dbConn.close()
+			self._dbConn = None
+			self._cursor = None
 		
 	def getData(self, age=0):
 		"""
@@ -67,20 +120,21 @@ class Archive(object):
 		if self._dbConn is None:
 			self.open()
 		
-		# Fetch the entries that match
+		# Fetch the entry that matches
 		if age <= 0:
-			self._cursor.execute('SELECT * FROM wx ORDER BY dateTime DESC')
+			self._cursor.execute(self._latestQuery)
 		else:
 			# Figure out how far to look back into the database
 			tNow = time.time()
 			tLookback = tNow - age
-			self._cursor.execute('SELECT * FROM wx WHERE dateTime >= %i ORDER BY dateTime' % tLookback)
+			self._cursor.execute(self._lookbackQuery, (int(tLookback),))
 		row = self._cursor.fetchone()
 
 		# Check for an empty database
 		if row is None:
 			return 0, {}
-			
+		row = dict(zip(self._getColumns, row))
+		
 		# Convert it to the "standard" dictionary format
 		timestamp = row['dateTime']
 		output = {'temperature': row['outTemp'], 'humidity': row['outHumidity'], 
@@ -99,7 +153,9 @@ class Archive(object):
 
 	def writeData(self, timestamp, data):
 		"""
-		Write a collection of data to the database.
+		Write a collection of data to the database.  If there already is an
+		entry for the timestamp, it is replaced.  Values that are None are
+		left at the column default.
 		"""
 		if self._dbConn is None:
 			self.open()
@@ -107,10 +163,11 @@ class Archive(object):
 		# Build up the values to insert
 		cNames = ['dateTime', 'usUnits']
 		dValues = [int(timestamp), 0]
-		for key in data.keys():
+		for key in sorted(data.keys()):
 			try:
-				cNames.append( self._dbMapper[key] )
-				dValues.append( data[key] )
+				if data[key] is not None:
+					cNames.append( self._dbMapper[key] )
+					dValues.append( data[key] )
 			except KeyError:
 				if key[:3] == 'alt':
 					if key[3:6] == 'Tem':
@@ -125,7 +182,16 @@ class Archive(object):
 							cNames.append( "%s%i" % (nameBase, i+1) )
 							dValues.append( data[key][i] )
 							
-		self._cursor.execute('INSERT INTO wx (%s) VALUES (%s)' % (','.join(cNames), ','.join([str(v) for v in dValues])))
-		self._dbConn.commit()
-	
+		# Insert with bound parameters - the statement text only depends on 
+		# the columns present so sqlite3's statement cache can reuse it
+		self._cursor.execute('INSERT OR REPLACE INTO wx (%s) VALUES (%s)' % (','.join(cNames), ','.join(['?']*len(dValues))), dValues)
+		
+		# Commit, if it is time
+		self._pending += 1
+		if self._pendingSince is None:
+			self._pendingSince = time.time()
+		if self._pending >= self.batchSize \
+		   or (self.batchTime is not None and time.time() - self._pendingSince >= self.batchTime):
+			self.flush()
+			
 		return True
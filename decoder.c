@@ -4,19 +4,69 @@
 #include <signal.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <time.h>
+#include <sys/time.h>
 #include <unistd.h>
+#include <pthread.h>
 #include "rtl-sdr.h"
 
-// Device/detection parameters
+// Device/detection parameters - defaults
 #define FREQUENCY 433800000
 #define SAMPLE_RATE 1000000
 #define SMOOTH_WINDOW 488
 #define RTL_BUFFER_SIZE 32768
 #define THRESHOLD 6800.0
+#define DECIMATION 1
+#define BIT_BUFFER_SIZE 4096
 
-static int do_exit = 0;
-static rtlsdr_dev_t *dev = NULL;
+// Adaptive threshold parameters - noise and signal level time constants in
+// seconds, the time constant for the signal level to rise to a stronger pulse,
+// the time constant for the signal level to decay when there are no pulses, hysteresis as a power of two fraction of the signal-to-noise swing,
+// the minimum signal-to-noise power ratio needed to detect a pulse, and the 
+// number of fractional bits the levels are kept with
+#define NOISE_TIME 0.2
+#define SIGNAL_TIME 0.002
+#define ATTACK_TIME 0.00005
+#define DECAY_TIME 0.5
+#define HYSTERESIS_SHIFT 3
+#define MIN_SNR 2
+#define LEVEL_SHIFT 24
+
+// Edge timing windows in samples at SAMPLE_RATE
+#define EDGE_RESET 80000
+#define RISE_MIN 200
+#define RISE_SHORT 615
+#define RISE_MAX 1100
+#define FALL_MIN 400
+#define FALL_SHORT 850
+#define FALL_MAX 1400
+
+// Number of RTL_BUFFER_SIZE buffers that the raw data recorder can hold while
+// waiting for the disk
+#define RECORD_BUFFERS 128
+
+// Burst recording parameters - default padding in seconds on either side of a
+// burst, the maximum padding in RTL_BUFFER_SIZE buffers, and the file format
+#define BURST_PADDING 0.05
+#define BURST_MAX_PADDING 16
+#define BURST_VERSION 1
+#define BURST_FILE_HEADER 16
+#define BURST_CHUNK_HEADER 20
+
+// Packet framing parameters
+#define FRAME_BITS 112
+#define FRAME_BUFFER_SIZE 16
+#define MAX_ACTIVE_FRAMES 8
+
+// Key used to keep the statistics of the last readRTL/readRTLFile call in 
+// the thread state dictionary
+#define STATS_KEY "decoder.stats"
+
+static volatile sig_atomic_t do_exit = 0;
+
+// Instantaneous power lookup table for the unsigned 8-bit I/Q samples
+static int32_t powerTable[256];
 
 /*
   sighandler - Signal handler for the readRTL function
@@ -26,135 +76,1401 @@ static void sighandler(int signum)
 {
 	fprintf(stderr, "Signal caught, exiting!\n");
 	do_exit = 1;
-	rtlsdr_cancel_async(dev);
 }
 
 
-// Setup the variables - time control
-static int tStart, tNow, diff;
+/*
+  BitBuffer - Growable buffer that holds the decoded bits, one per byte, until
+  they are handed back to Python.
+*/
+
+typedef struct {
+	unsigned char *data;
+	Py_ssize_t size;
+	Py_ssize_t capacity;
+	int failed;
+} BitBuffer;
+
+static int bitbuffer_init(BitBuffer *bb) {
+	bb->data = (unsigned char *) malloc(BIT_BUFFER_SIZE*sizeof(unsigned char));
+	bb->size = 0;
+	bb->capacity = BIT_BUFFER_SIZE;
+	bb->failed = 0;
+	if( bb->data == NULL ) {
+		bb->capacity = 0;
+		bb->failed = 1;
+		return -1;
+	}
+	return 0;
+}
+
+static void bitbuffer_free(BitBuffer *bb) {
+	free(bb->data);
+	bb->data = NULL;
+	bb->size = 0;
+	bb->capacity = 0;
+}
+
+static inline void bitbuffer_append(BitBuffer *bb, unsigned char bit) {
+	unsigned char *temp;
+	
+	if( bb->size == bb->capacity ) {
+		temp = (unsigned char *) realloc(bb->data, 2*bb->capacity*sizeof(unsigned char));
+		if( temp == NULL ) {
+			bb->failed = 1;
+			return;
+		}
+		bb->data = temp;
+		bb->capacity *= 2;
+	}
+	*(bb->data + bb->size) = bit;
+	bb->size += 1;
+}
+
+/*
+  bitbuffer_to_python - Convert the contents of a BitBuffer into either a 
+  list of integers or a bytearray with one bit per byte.
+*/
+
+static PyObject *bitbuffer_to_python(BitBuffer *bb, int asBytes) {
+	PyObject *output, *temp;
+	Py_ssize_t i;
+	
+	if( asBytes ) {
+		return PyByteArray_FromStringAndSize((char *) bb->data, bb->size);
+	}
+	
+	output = PyList_New(bb->size);
+	if( output == NULL ) {
+		return NULL;
+	}
+	for(i=0; i<bb->size; i++) {
+		temp = PyInt_FromLong(*(bb->data + i));
+		if( temp == NULL ) {
+			Py_DECREF(output);
+			return NULL;
+		}
+		PyList_SET_ITEM(output, i, temp);
+	}
+	return output;
+}
+
+
+/*
+  Frame - Candidate Oregon Scientific v2.1 packet found in the bit stream.  The
+  bits are stored de-interleaved, i.e., as bits[i::2] of the raw stream where 
+  i is the start of the preamble, and sampleOffset is the sample counter at 
+  which the first preamble bit was decoded.  timestamp is the corresponding
+  time in seconds.
+*/
+
+typedef struct {
+	long sampleOffset;
+	double timestamp;
+	long bitOffset;
+	int nBits;
+	unsigned char bits[FRAME_BITS];
+} Frame;
+
+/*
+  FrameBuffer - Growable buffer that holds the completed frames until they are
+  handed back to Python.
+*/
+
+typedef struct {
+	Frame *data;
+	Py_ssize_t size;
+	Py_ssize_t capacity;
+	int failed;
+} FrameBuffer;
+
+static int framebuffer_init(FrameBuffer *fb) {
+	fb->data = (Frame *) malloc(FRAME_BUFFER_SIZE*sizeof(Frame));
+	fb->size = 0;
+	fb->capacity = FRAME_BUFFER_SIZE;
+	fb->failed = 0;
+	if( fb->data == NULL ) {
+		fb->capacity = 0;
+		fb->failed = 1;
+		return -1;
+	}
+	return 0;
+}
+
+static void framebuffer_free(FrameBuffer *fb) {
+	free(fb->data);
+	fb->data = NULL;
+	fb->size = 0;
+	fb->capacity = 0;
+}
+
+static void framebuffer_append(FrameBuffer *fb, const Frame *frame) {
+	Frame *temp;
+	
+	if( fb->size == fb->capacity ) {
+		temp = (Frame *) realloc(fb->data, 2*fb->capacity*sizeof(Frame));
+		if( temp == NULL ) {
+			fb->failed = 1;
+			return;
+		}
+		fb->data = temp;
+		fb->capacity *= 2;
+	}
+	memcpy(fb->data + fb->size, frame, sizeof(Frame));
+	fb->size += 1;
+}
+
+/*
+  framebuffer_to_python - Convert the contents of a FrameBuffer into a list of
+  (sample offset, timestamp, bits) tuples where the bits are either a list of
+  integers or a bytearray with one bit per byte.
+*/
+
+static PyObject *framebuffer_to_python(FrameBuffer *fb, int asBytes) {
+	PyObject *output, *temp;
+	Py_ssize_t i;
+	BitBuffer bb;
+	
+	output = PyList_New(fb->size);
+	if( output == NULL ) {
+		return NULL;
+	}
+	for(i=0; i<fb->size; i++) {
+		bb.data = (fb->data + i)->bits;
+		bb.size = (fb->data + i)->nBits;
+		temp = Py_BuildValue("(ldN)", (fb->data + i)->sampleOffset, (fb->data + i)->timestamp, \
+		                     bitbuffer_to_python(&bb, asBytes));
+		if( temp == NULL ) {
+			Py_DECREF(output);
+			return NULL;
+		}
+		PyList_SET_ITEM(output, i, temp);
+	}
+	return output;
+}
+
+
+/*
+  Preamble and sync word matching - A v2.1 packet starts with 16 ones in the 
+  de-interleaved stream, i.e., 32 alternating raw bits starting with a one, 
+  followed by the 0xA sync nibble (sent LSB first) in the even raw bits.  These
+  40 raw bits are matched against the most recent raw bits with the newest bit
+  in the least significant position.
+*/
+
+#define SYNC_WINDOW 40
+#define SAMPLE_HISTORY 64
+
+static const uint64_t syncMask  = 0xFFFFFFFFAAULL;
+static const uint64_t syncValue = 0xAAAAAAAA22ULL;
+
+
+/*
+  powertable_init - Fill in the instantaneous power lookup table.
+*/
+
+static void powertable_init(void) {
+	int i;
+
+	for(i=0; i<256; i++) {
+		powerTable[i] = (i - 127)*(i - 127);
+	}
+}
+
+
+/*
+  DecoderConfig - Detection parameters for a DecoderState.  The edge timing 
+  windows, the number of smoothing taps, and the integer threshold are derived 
+  from the sample rate and decimation by decoderconfig_setup.
+*/
+
+typedef struct {
+	// Detection parameters
+	long sampleRate;
+	int smoothWindow;
+	double threshold;
+	int decimation;
+	int adaptive;
+	int framed;
+
+	// Whether the stream starts partway through a longer one, in which case
+	// the first edge restarts the Manchester decoding
+	int midStream;
+
+	// Power detection after decimation
+	int nTaps;
+	long long thresholdSum;
+	int noiseShift;
+	int signalShift;
+	int attackShift;
+	int decayShift;
+
+	// Edge timing windows in samples
+	long edgeReset;
+	long riseMin, riseShort, riseMax;
+	long fallMin, fallShort, fallMax;
+} DecoderConfig;
+
+static void decoderconfig_init(DecoderConfig *config) {
+	config->sampleRate = SAMPLE_RATE;
+	config->smoothWindow = -1;
+	config->threshold = THRESHOLD;
+	config->decimation = DECIMATION;
+	config->adaptive = 0;
+	config->framed = 0;
+	config->midStream = 0;
+}
+
+static inline long scale_window(long value, double scale) {
+	return (long) (value*scale + 0.5);
+}
+
+static inline int time_to_shift(double value, double rate) {
+	int shift;
+
+	shift = (int) floor(log2(value*rate) + 0.5);
+	return shift < 0 ? 0 : shift;
+}
+
+/*
+  decoderconfig_setup - Validate the detection parameters and scale the edge 
+  timing windows, and the smoothing window if it was not set, from SAMPLE_RATE
+  to the actual sample rate.  The smoothing window is then converted to a 
+  number of decimated taps.  Returns 0 on success and -1 with a Python 
+  exception set if the parameters are invalid.
+*/
+
+static int decoderconfig_setup(DecoderConfig *config) {
+	double scale;
+
+	if( config->sampleRate <= 0 ) {
+		PyErr_Format(PyExc_ValueError, "Sample rate must be greater than zero");
+		return -1;
+	}
+	if( config->threshold <= 0 ) {
+		PyErr_Format(PyExc_ValueError, "Threshold must be greater than zero");
+		return -1;
+	}
+	scale = ((double) config->sampleRate) / SAMPLE_RATE;
+
+	if( config->smoothWindow < 0 ) {
+		config->smoothWindow = (int) scale_window(SMOOTH_WINDOW, scale);
+	}
+	if( config->smoothWindow < 1 ) {
+		PyErr_Format(PyExc_ValueError, "Smoothing window must be at least one sample");
+		return -1;
+	}
+	if( config->decimation < 1 || config->decimation > config->smoothWindow ) {
+		PyErr_Format(PyExc_ValueError, "Decimation must be between one and the smoothing window length");
+		return -1;
+	}
+
+	// Smoothing in decimated samples - the threshold is compared against the
+	// sum of the power over all of the raw samples in the window
+	config->nTaps = (config->smoothWindow + config->decimation/2) / config->decimation;
+	config->thresholdSum = (long long) ceil(config->threshold*config->nTaps*config->decimation);
+
+	// Adaptive threshold time constants as powers of two in decimated samples
+	config->noiseShift = time_to_shift(NOISE_TIME, ((double) config->sampleRate) / config->decimation);
+	config->signalShift = time_to_shift(SIGNAL_TIME, ((double) config->sampleRate) / config->decimation);
+	config->attackShift = time_to_shift(ATTACK_TIME, ((double) config->sampleRate) / config->decimation);
+	config->decayShift = time_to_shift(DECAY_TIME, ((double) config->sampleRate) / config->decimation);
+
+	config->edgeReset = scale_window(EDGE_RESET, scale);
+	config->riseMin = scale_window(RISE_MIN, scale);
+	config->riseShort = scale_window(RISE_SHORT, scale);
+	config->riseMax = scale_window(RISE_MAX, scale);
+	config->fallMin = scale_window(FALL_MIN, scale);
+	config->fallShort = scale_window(FALL_SHORT, scale);
+	config->fallMax = scale_window(FALL_MAX, scale);
+
+	return 0;
+}
+
+
+/*
+  DecoderStats - Counters that describe what the decoder has done with the 
+  data it has been given so far.  The edges that are rejected are counted by 
+  the edge timing window that they fell outside of.
+*/
+
+typedef struct {
+	// Input
+	long long samples;
+	long buffers;
+	long shortBuffers;
+	long overruns;
+	long readErrors;
+	double processTime;
+	double maxProcessTime;
+
+	// Power detection and edge timing - pulseSamples is kept as the sum of the
+	// falling edge sample counters minus the sum of the rising edge ones
+	long long pulseSamples;
+	long edges;
+	long edgeResets;
+	long riseTooShort;
+	long riseTooLong;
+	long fallTooShort;
+	long fallTooLong;
+
+	// Output
+	long long bits;
+	long frames;
+	long framesDropped;
+	long recordDropped;
+	long long recordSamples;
+} DecoderStats;
+
+
+/*
+  wall_time - Return the current UNIX time in seconds.
+*/
+
+static inline double wall_time(void) {
+	struct timeval now;
+
+	gettimeofday(&now, NULL);
+	return now.tv_sec + now.tv_usec/1e6;
+}
+
+
+/*
+  DecoderState - Power detection, edge timing, and output state for a single
+  stream of RTL SDR data.  Everything that the Manchester decoding needs to
+  carry from one buffer to the next lives here so that several streams can be
+  decoded at the same time.
+*/
+
+typedef struct {
+	// Configuration
+	DecoderConfig config;
+
+	// Power detection
+	long long blockSum;
+	int blockCount;
+	long long runningSum;
+	int64_t *powerBuffer;
+	int tapIndex;
+	int prevPower;
+
+	// Adaptive threshold - fixed point with LEVEL_SHIFT fractional bits
+	long long noiseLevel;
+	long long signalLevel;
+	long onStart;
+
+	// Edge timing
+	long dataCounter;
+	long prevEdge;
+	long edgeCountDiff;
+	long halfTime;
+
+	// Clock - the time in seconds at sample counter clockCounter
+	double clockTime;
+	long clockCounter;
+
+	// Output
+	BitBuffer bits;
+
+	// Packet framing
+	uint64_t window;
+	long bitCount;
+	long sampleHistory[SAMPLE_HISTORY];
+	int nActive;
+	Frame active[MAX_ACTIVE_FRAMES];
+	FrameBuffer frames;
+
+	// Statistics
+	DecoderStats stats;
+} DecoderState;
+
+static void decoderstate_reset(DecoderState *state) {
+	int i;
+
+	// Reset the loop control
+	state->blockSum = 0;
+	state->blockCount = 0;
+	state->runningSum = 0;
+	state->tapIndex = 0;
+	state->prevPower = 0;
+	state->noiseLevel = 0;
+	state->signalLevel = (2*state->config.thresholdSum) << LEVEL_SHIFT;
+	state->onStart = 0;
+	state->dataCounter = 0;
+	state->edgeCountDiff = -1;
+	state->halfTime = 0;
+
+	// A previous edge of -1 means that there has not been one yet, so the 
+	// first edge only starts the timing.  Partway through a stream, the last
+	// edge is instead placed far enough in the past that the first edge is 
+	// an edge reset, as it would be after a quiet stretch.
+	if( state->config.midStream ) {
+		state->prevEdge = -(state->config.edgeReset + 2);
+	} else {
+		state->prevEdge = -1;
+	}
+
+	// Reset the packet framing
+	state->window = 0;
+	state->bitCount = 0;
+	state->nActive = 0;
+
+	// Reset the power detection
+	for(i=0; i<state->config.nTaps; i++) {
+		*(state->powerBuffer + i) = 0;
+	}
+}
+
+/*
+  decoderstate_init - Initialize a DecoderState using a DecoderConfig that has
+  already been through decoderconfig_setup.  Returns 0 on success and -1 if 
+  memory could not be allocated.
+*/
+
+static int decoderstate_init(DecoderState *state, const DecoderConfig *config) {
+	memcpy(&(state->config), config, sizeof(DecoderConfig));
+	state->clockTime = 0.0;
+	state->clockCounter = 0;
+	memset(&(state->stats), 0, sizeof(DecoderStats));
+
+	state->powerBuffer = (int64_t *) malloc(state->config.nTaps*sizeof(int64_t));
+	if( state->powerBuffer == NULL ) {
+		return -1;
+	}
+	if( bitbuffer_init(&(state->bits)) < 0 ) {
+		free(state->powerBuffer);
+		state->powerBuffer = NULL;
+		return -1;
+	}
+	if( framebuffer_init(&(state->frames)) < 0 ) {
+		free(state->powerBuffer);
+		state->powerBuffer = NULL;
+		bitbuffer_free(&(state->bits));
+		return -1;
+	}
+
+	decoderstate_reset(state);
+	return 0;
+}
+
+/*
+  decoderstate_set_clock - Tie the sample counter to a time in seconds so that
+  the frames can be time stamped.  The sample counter was 'counter' at time
+  'clockTime'.
+*/
+
+static inline void decoderstate_set_clock(DecoderState *state, double clockTime, long counter) {
+	state->clockTime = clockTime;
+	state->clockCounter = counter;
+}
+
+/*
+  decoderstate_skip_to - Move the sample counter ahead to 'counter' for data
+  that does not follow on from the data processed so far, e.g., the next burst
+  in a burst recording.  The power smoothing starts over but the adaptive
+  threshold levels are kept.  Any pulse in progress ends at the gap and the 
+  edge timing treats the gap like any other stretch without edges.
+*/
+
+static void decoderstate_skip_to(DecoderState *state, long counter) {
+	int i;
+
+	if( state->prevPower ) {
+		state->stats.pulseSamples += state->dataCounter;
+	}
+
+	state->blockSum = 0;
+	state->blockCount = 0;
+	state->runningSum = 0;
+	state->tapIndex = 0;
+	state->prevPower = 0;
+	for(i=0; i<state->config.nTaps; i++) {
+		*(state->powerBuffer + i) = 0;
+	}
+
+	state->dataCounter = counter;
+}
+
+static void decoderstate_free(DecoderState *state) {
+	free(state->powerBuffer);
+	state->powerBuffer = NULL;
+	bitbuffer_free(&(state->bits));
+	framebuffer_free(&(state->frames));
+}
+
+
+/*
+  decoderstate_count_buffer - Update the input statistics for a buffer of 'len'
+  bytes that took 'elapsed' seconds to deal with.  A buffer that takes longer
+  to deal with than it took to record is an overrun.
+*/
+
+static void decoderstate_count_buffer(DecoderState *state, uint32_t len, double elapsed) {
+	DecoderStats *stats = &(state->stats);
+
+	stats->buffers += 1;
+	stats->samples += len/2;
+	stats->processTime += elapsed;
+	if( elapsed > stats->maxProcessTime ) {
+		stats->maxProcessTime = elapsed;
+	}
+	if( elapsed*state->config.sampleRate > len/2 ) {
+		stats->overruns += 1;
+	}
+}
+
+
+/*
+  decoderstate_stats - Return the statistics for a DecoderState as a Python 
+  dictionary.
+*/
+
+static PyObject *decoderstate_stats(DecoderState *state) {
+	PyObject *output, *temp;
+	const DecoderStats *stats = &(state->stats);
+	const DecoderConfig *config = &(state->config);
+	long long pulseSamples;
+	double scale;
+
+	// Close out any pulse that is still in progress
+	pulseSamples = stats->pulseSamples;
+	if( state->prevPower ) {
+		pulseSamples += state->dataCounter;
+	}
+
+	output = Py_BuildValue("{s:L,s:l,s:l,s:l,s:l,s:d,s:d,s:L,s:l,s:l,s:l,s:l,s:l,s:l,s:L,s:l,s:l,s:l,s:L}", \
+	                       "samples", stats->samples, "buffers", stats->buffers, \
+	                       "shortBuffers", stats->shortBuffers, "overruns", stats->overruns, \
+	                       "readErrors", stats->readErrors, "processTime", stats->processTime, \
+	                       "maxProcessTime", stats->maxProcessTime, \
+	                       "pulseSamples", pulseSamples, \
+	                       "edges", stats->edges, "edgeResets", stats->edgeResets, \
+	                       "riseTooShort", stats->riseTooShort, "riseTooLong", stats->riseTooLong, \
+	                       "fallTooShort", stats->fallTooShort, "fallTooLong", stats->fallTooLong, \
+	                       "bits", stats->bits, "frames", stats->frames, \
+	                       "framesDropped", stats->framesDropped, "recordDropped", stats->recordDropped, \
+	                       "recordSamples", stats->recordSamples);
+	if( output == NULL ) {
+		return NULL;
+	}
+
+	// Current adaptive threshold levels as the mean power per sample
+	if( config->adaptive ) {
+		scale = ldexp(1.0 / ((double) config->nTaps*config->decimation), -LEVEL_SHIFT);
+
+		temp = PyFloat_FromDouble(state->noiseLevel*scale);
+		if( temp == NULL || PyDict_SetItemString(output, "noiseLevel", temp) < 0 ) {
+			Py_XDECREF(temp);
+			Py_DECREF(output);
+			return NULL;
+		}
+		Py_DECREF(temp);
+
+		temp = PyFloat_FromDouble(state->signalLevel*scale);
+		if( temp == NULL || PyDict_SetItemString(output, "signalLevel", temp) < 0 ) {
+			Py_XDECREF(temp);
+			Py_DECREF(output);
+			return NULL;
+		}
+		Py_DECREF(temp);
+	}
+
+	return output;
+}
+
+
+/*
+  decoderstate_save_stats - Save the statistics for a DecoderState in the 
+  thread state dictionary so that they can be retrieved with stats().  Any
+  Python exception that is already set is preserved.
+*/
 
-// Setup the variables - power detection
-static float runningSum = 0;
-static float *powerBuffer;
+static void decoderstate_save_stats(DecoderState *state) {
+	PyObject *type, *value, *traceback, *dict, *output;
 
-// Setup the control loop
-static int loopTimeOut = 0;
-static int prevPower = 0;
-static long dataCounter = 0;
-static long prevEdge = -1;
-static long edgeCountDiff = -1;
-static long halfTime = 0;
+	PyErr_Fetch(&type, &value, &traceback);
+	dict = PyThreadState_GetDict();
+	output = decoderstate_stats(state);
+	if( dict != NULL && output != NULL ) {
+		PyDict_SetItemString(dict, STATS_KEY, output);
+	}
+	Py_XDECREF(output);
+	PyErr_Clear();
+	PyErr_Restore(type, value, traceback);
+}
 
 
 /*
-  decorder_callback - Function that receives the RTL-SDR buffer and performs 
-  the Manchester decoding.  ctx is a pointer to a PyList object that is updaated
-  when a new bit is found.
+  decoderstate_frame_bit - Run a newly decoded bit through the preamble/sync
+  matcher and add it to any frames that are in progress.
+*/
+
+static void decoderstate_frame_bit(DecoderState *state, unsigned char bit) {
+	int k, n;
+	long start;
+	Frame *frame;
+
+	state->window = (state->window << 1) | bit;
+	state->sampleHistory[state->bitCount % SAMPLE_HISTORY] = state->dataCounter;
+	state->bitCount += 1;
+
+	// Add the bit to the frames in progress, keeping only the first of each 
+	// pair of raw bits
+	n = 0;
+	for(k=0; k<state->nActive; k++) {
+		frame = &(state->active[k]);
+		if( (state->bitCount - 1 - frame->bitOffset) % 2 == 0 ) {
+			frame->bits[frame->nBits] = bit;
+			frame->nBits += 1;
+		}
+
+		if( frame->nBits == FRAME_BITS ) {
+			framebuffer_append(&(state->frames), frame);
+		} else {
+			if( n != k ) {
+				memcpy(&(state->active[n]), frame, sizeof(Frame));
+			}
+			n += 1;
+		}
+	}
+	state->nActive = n;
+
+	// Look for the start of a new frame
+	if( state->bitCount >= SYNC_WINDOW && (state->window & syncMask) == syncValue ) {
+		state->stats.frames += 1;
+		if( state->nActive >= MAX_ACTIVE_FRAMES ) {
+			state->stats.framesDropped += 1;
+		} else {
+			frame = &(state->active[state->nActive]);
+			start = state->bitCount - SYNC_WINDOW;
+			frame->sampleOffset = state->sampleHistory[start % SAMPLE_HISTORY];
+			frame->timestamp = state->clockTime + ((double) (frame->sampleOffset - state->clockCounter)) / state->config.sampleRate;
+			frame->bitOffset = start;
+			for(k=0; k<SYNC_WINDOW/2; k++) {
+				frame->bits[k] = (state->window >> (SYNC_WINDOW-1-2*k)) & 1;
+			}
+			frame->nBits = SYNC_WINDOW/2;
+			state->nActive += 1;
+		}
+	}
+}
+
+static inline void decoderstate_emit(DecoderState *state, unsigned char bit) {
+	state->stats.bits += 1;
+	if( state->config.framed ) {
+		decoderstate_frame_bit(state, bit);
+	} else {
+		bitbuffer_append(&(state->bits), bit);
+	}
+}
+
+
+/*
+  decoderstate_finish - Signal the end of a stream so that any frames that are
+  still in progress are moved to the output as-is.
+*/
+
+static void decoderstate_finish(DecoderState *state) {
+	int k;
+
+	for(k=0; k<state->nActive; k++) {
+		framebuffer_append(&(state->frames), &(state->active[k]));
+	}
+	state->nActive = 0;
+}
+
+static inline Py_ssize_t decoderstate_pending(DecoderState *state) {
+	return state->config.framed ? state->frames.size : state->bits.size;
+}
+
+static inline int decoderstate_failed(DecoderState *state) {
+	return state->bits.failed || state->frames.failed;
+}
+
+
+/*
+  decoderstate_take - Return the bits, or frames, decoded so far as a Python 
+  object and empty the output buffers.
+*/
+
+static PyObject *decoderstate_take(DecoderState *state, int asBytes) {
+	PyObject *output;
+
+	if( state->config.framed ) {
+		output = framebuffer_to_python(&(state->frames), asBytes);
+	} else {
+		output = bitbuffer_to_python(&(state->bits), asBytes);
+	}
+	state->bits.size = 0;
+	state->frames.size = 0;
+	return output;
+}
+
+
+/*
+  decoderstate_adaptive_power - Compare the smoothed power to a threshold that
+  sits midway between running estimates of the noise floor and the signal 
+  level, with hysteresis, and update the estimates.  Returns 1 if a pulse is
+  present and 0 if it is not.
+  
+  The noise floor is only updated while there is no pulse and the signal level
+  only while there is one.  Without pulses the signal level decays toward 
+  2*MIN_SNR times the noise floor so that the threshold can come down to find
+  sensors weaker than the starting one.  The signal level rises to a stronger
+  pulse within ATTACK_TIME so that, after a quiet stretch has let the 
+  threshold come down, the first pulses of a transmission are not stretched
+  out by a threshold that sits too close to the noise floor.  A pulse also 
+  needs at least MIN_SNR times the noise floor to start.  If the power stays high for longer than any
+  valid pulse, it is treated as a change in the noise floor instead.
+  
+  The levels are kept in fixed point with LEVEL_SHIFT fractional bits.  
+  Otherwise the shifts in the updates would drop any change smaller than 
+  2^noiseShift, which is more than the smoothed power of a typical noise 
+  floor, and the noise floor would never rise from zero.
+*/
+
+static inline int decoderstate_adaptive_power(DecoderState *state) {
+	int power;
+	long long sum, level, hysteresis, onLevel;
+	const DecoderConfig *config = &(state->config);
+
+	// Smoothed power in the same fixed point as the levels
+	sum = state->runningSum << LEVEL_SHIFT;
+
+	// Threshold
+	level = (state->noiseLevel + state->signalLevel) / 2;
+	hysteresis = (state->signalLevel - state->noiseLevel) >> HYSTERESIS_SHIFT;
+	if( hysteresis < 0 ) {
+		hysteresis = 0;
+	}
+
+	if( state->prevPower ) {
+		power = (sum >= level - hysteresis);
+	} else {
+		onLevel = level + hysteresis;
+		if( onLevel < MIN_SNR*state->noiseLevel ) {
+			onLevel = MIN_SNR*state->noiseLevel;
+		}
+		power = (sum >= onLevel);
+		if( power ) {
+			state->onStart = state->dataCounter;
+		}
+	}
+
+	// Level updates
+	if( power && state->dataCounter - state->onStart <= config->edgeReset ) {
+		if( sum > state->signalLevel ) {
+			state->signalLevel += (sum - state->signalLevel) >> config->attackShift;
+		} else {
+			state->signalLevel += (sum - state->signalLevel) >> config->signalShift;
+		}
+	} else {
+		state->noiseLevel += (sum - state->noiseLevel) >> config->noiseShift;
+		state->signalLevel += (2*MIN_SNR*state->noiseLevel - state->signalLevel) >> config->decayShift;
+	}
+
+	return power;
+}
+
+
+/*
+  decoderstate_process - Function that receives a buffer of interleaved 8-bit
+  I/Q samples and performs the Manchester decoding.  The decoded bits are
+  appended to the state's BitBuffer or, in framed mode, run through the packet
+  framing.
+  
+  The power detection is done entirely in integers:  the instantaneous power 
+  comes from a lookup table, is summed over blocks of 'decimation' samples, and
+  the blocks are run through an exact boxcar average.  The edge detection and
+  timing then only run once per block.  The sample counter still counts raw 
+  samples so that the edge timing windows do not depend on the decimation.
+*/
+
+static void decoderstate_process(DecoderState *state, const unsigned char *buf, uint32_t len) {
+	uint32_t j;
+	int power, edge, addBit;
+	const DecoderConfig *config = &(state->config);
+
+	// Process the buffer
+	for(j=0; j<len/2; j++) {
+		//// Unpack and decimate
+		state->blockSum += powerTable[*(buf + 2*j+0)] + powerTable[*(buf + 2*j+1)];
+		state->dataCounter += 1;
+		state->blockCount += 1;
+		if( state->blockCount < config->decimation ) {
+			continue;
+		}
+		state->blockCount = 0;
+
+		//// Moving average
+		state->runningSum += state->blockSum - *(state->powerBuffer + state->tapIndex);
+		*(state->powerBuffer + state->tapIndex) = state->blockSum;
+		state->blockSum = 0;
+		state->tapIndex += 1;
+		if( state->tapIndex == config->nTaps ) {
+			state->tapIndex = 0;
+		}
+
+		//// Convert to an integer
+		if( config->adaptive ) {
+			power = decoderstate_adaptive_power(state);
+		} else if( state->runningSum >= config->thresholdSum ) {
+			power = 1;
+		} else {
+			power = 0;
+		}
+
+		//// Edge detection
+		edge = power - state->prevPower;
+		state->prevPower = power;
+
+		//// Timing
+		if( edge != 0 ) {
+			state->stats.edges += 1;
+			state->stats.pulseSamples -= edge*state->dataCounter;
+			if( state->prevEdge == -1 ) {
+				state->prevEdge = state->dataCounter;
+			}
+			state->edgeCountDiff = state->dataCounter - state->prevEdge;
+		}
+
+		if( edge == 1 ) {
+			////// Rising edge
+
+			if( state->edgeCountDiff > config->edgeReset ) {
+				state->stats.edgeResets += 1;
+				state->prevEdge = state->dataCounter;
+				state->halfTime = 0;
+				addBit = 1;
+			} else if( state->edgeCountDiff < config->riseMin ) {
+				state->stats.riseTooShort += 1;
+				addBit = 0;
+			} else if( state->edgeCountDiff > config->riseMax ) {
+				state->stats.riseTooLong += 1;
+				addBit = 0;
+			} else if( state->edgeCountDiff < config->riseShort ) {
+				state->prevEdge = state->dataCounter;
+				state->halfTime += 1;
+				addBit = 1;
+			} else {
+				state->prevEdge = state->dataCounter;
+				state->halfTime += 2;
+				addBit = 1;
+			}
+
+			if( addBit && state->halfTime % 2 == 0 ) {
+				decoderstate_emit(state, 1);
+			}
+
+		} else if( edge == -1 ) {
+			////// Falling edge
+
+			if( state->edgeCountDiff > config->edgeReset ) {
+				state->stats.edgeResets += 1;
+				state->prevEdge = state->dataCounter;
+				state->halfTime = 0;
+				addBit = 1;
+			} else if( state->edgeCountDiff < config->fallMin ) {
+				state->stats.fallTooShort += 1;
+				addBit = 0;
+			} else if( state->edgeCountDiff > config->fallMax ) {
+				state->stats.fallTooLong += 1;
+				addBit = 0;
+			} else if( state->edgeCountDiff < config->fallShort ) {
+				state->prevEdge = state->dataCounter;
+				state->halfTime += 1;
+				addBit = 1;
+			} else {
+				state->prevEdge = state->dataCounter;
+				state->halfTime += 2;
+				addBit = 1;
+			}
+
+			if( addBit && state->halfTime % 2 == 0 ) {
+				decoderstate_emit(state, 0);
+			}
+		}
+	}
+	// end buffer processing loop
+}
+
+
+/*
+  decoderstate_publish - Hand the bits, or frames, decoded so far off to a Python
+  callback and empty the output buffers.  Returns 0 on success, 1 if the callback
+  returned a true value to request that the decoding stop, and -1 if the 
+  conversion or the callback failed, in which case a Python exception is set.
+*/
+
+static int decoderstate_publish(DecoderState *state, PyObject *callback, int asBytes) {
+	PyObject *chunk, *temp;
+	int status;
+
+	if( decoderstate_pending(state) == 0 ) {
+		return 0;
+	}
+
+	chunk = decoderstate_take(state, asBytes);
+	if( chunk == NULL ) {
+		return -1;
+	}
+
+	temp = PyObject_CallFunctionObjArgs(callback, chunk, NULL);
+	Py_DECREF(chunk);
+	if( temp == NULL ) {
+		return -1;
+	}
+	status = PyObject_IsTrue(temp);
+	Py_DECREF(temp);
+	return status;
+}
+
+
+/*
+  Burst recordings - Files that only hold the raw data around the bursts of 
+  signal.  The file starts with a BURST_FILE_HEADER byte header of:
+    * the 8 character magic string "RTLBURST",
+    * a 32-bit version number, and
+    * the 32-bit sample rate in Hz.
+  This is followed by chunks of raw data, each with a BURST_CHUNK_HEADER byte
+  header of:
+    * the 64-bit sample counter of the first sample in the chunk, counting 
+      from zero at the start of the capture,
+    * the 64-bit double UNIX time of the first sample, and
+    * the 32-bit number of bytes of interleaved 8-bit I/Q samples that follow.
+  All values are little endian.  Chunks whose sample counters follow on from
+  each other are part of the same burst.
+*/
+
+static const char burstMagic[8] = {'R', 'T', 'L', 'B', 'U', 'R', 'S', 'T'};
+
+static void pack_le(unsigned char *buf, uint64_t value, int size) {
+	int k;
+
+	for(k=0; k<size; k++) {
+		*(buf + k) = (value >> (8*k)) & 0xFF;
+	}
+}
+
+static uint64_t unpack_le(const unsigned char *buf, int size) {
+	int k;
+	uint64_t value = 0;
+
+	for(k=size-1; k>=0; k--) {
+		value = (value << 8) | *(buf + k);
+	}
+	return value;
+}
+
+static void pack_double_le(unsigned char *buf, double value) {
+	uint64_t temp;
+
+	memcpy(&temp, &value, sizeof(double));
+	pack_le(buf, temp, 8);
+}
+
+static double unpack_double_le(const unsigned char *buf) {
+	uint64_t temp;
+	double value;
+
+	temp = unpack_le(buf, 8);
+	memcpy(&value, &temp, sizeof(double));
+	return value;
+}
+
+
+/*
+  burstfile_check - Check whether an open file is a burst recording.  Returns 1
+  with the file at the first chunk if it is and 0 with the file rewound if it
+  is not.  The sample rate of the recording is returned in 'sampleRate'.
+*/
+
+static int burstfile_check(FILE *fh, long *sampleRate) {
+	unsigned char header[BURST_FILE_HEADER];
+
+	if( fread(header, sizeof(unsigned char), BURST_FILE_HEADER, fh) == BURST_FILE_HEADER \
+	    && memcmp(header, burstMagic, 8) == 0 && unpack_le(header + 8, 4) == BURST_VERSION ) {
+		*sampleRate = (long) unpack_le(header + 12, 4);
+		return 1;
+	}
+
+	rewind(fh);
+	return 0;
+}
+
+
+/*
+  burstfile_read - Read the next chunk from a burst recording into 'raw', which
+  needs to hold RTL_BUFFER_SIZE bytes.  Returns the number of bytes read, 0 at
+  the end of the file, and -1 if the chunk is not valid.  The sample counter 
+  and time of the first sample are returned in 'offset' and 'timestamp'.
+*/
+
+static int burstfile_read(FILE *fh, unsigned char *raw, long *offset, double *timestamp) {
+	unsigned char header[BURST_CHUNK_HEADER];
+	uint32_t size;
+
+	if( fread(header, sizeof(unsigned char), BURST_CHUNK_HEADER, fh) != BURST_CHUNK_HEADER ) {
+		return 0;
+	}
+	*offset = (long) unpack_le(header, 8);
+	*timestamp = unpack_double_le(header + 8);
+	size = (uint32_t) unpack_le(header + 16, 4);
+	if( size > RTL_BUFFER_SIZE ) {
+		return -1;
+	}
+
+	return (int) fread(raw, sizeof(unsigned char), size, fh);
+}
+
+
+/*
+  Recorder - Writer for the raw RTL SDR data that runs in its own thread so 
+  that a slow disk does not hold up the decoding.  The buffers are copied into
+  a ring of RECORD_BUFFERS slots that the thread empties.  If the ring is full
+  the buffer is dropped from the recording rather than blocking.
+  
+  In burst mode only the buffers with signal in them, plus prePadding buffers
+  before and postPadding buffers after, are recorded.  The most recent buffers
+  without signal are held in a separate 'pending' ring until they are either 
+  needed as padding or replaced.
+*/
+
+typedef struct {
+	long offset;
+	double timestamp;
+	uint32_t size;
+} RecordSlot;
+
+typedef struct {
+	FILE *fh;
+	int bursts;
+	unsigned char *data;
+	RecordSlot slots[RECORD_BUFFERS];
+	int head;
+	int count;
+	int done;
+	int failed;
+	long dropped;
+	long long written;
+
+	// Burst mode padding
+	int prePadding;
+	int postPadding;
+	int postLeft;
+	unsigned char *pending;
+	RecordSlot pendingSlots[BURST_MAX_PADDING];
+	int pendingHead;
+	int nPending;
+
+	pthread_mutex_t lock;
+	pthread_cond_t ready;
+	pthread_t thread;
+} Recorder;
+
+static void *recorder_run(void *arg) {
+	Recorder *rec = (Recorder *) arg;
+	int tail;
+	RecordSlot slot;
+	unsigned char header[BURST_CHUNK_HEADER];
+
+	pthread_mutex_lock(&(rec->lock));
+	while( 1 ) {
+		//// Wait for a buffer
+		while( rec->count == 0 && !rec->done ) {
+			pthread_cond_wait(&(rec->ready), &(rec->lock));
+		}
+		if( rec->count == 0 ) {
+			break;
+		}
+		tail = (rec->head - rec->count + RECORD_BUFFERS) % RECORD_BUFFERS;
+		slot = rec->slots[tail];
+		pthread_mutex_unlock(&(rec->lock));
+
+		//// Write it out - the slot is not reused until the count goes down
+		if( !rec->failed && rec->bursts ) {
+			pack_le(header, (uint64_t) slot.offset, 8);
+			pack_double_le(header + 8, slot.timestamp);
+			pack_le(header + 16, slot.size, 4);
+			if( fwrite(header, sizeof(unsigned char), BURST_CHUNK_HEADER, rec->fh) != BURST_CHUNK_HEADER ) {
+				rec->failed = 1;
+			}
+		}
+		if( !rec->failed && fwrite(rec->data + (size_t) tail*RTL_BUFFER_SIZE, sizeof(unsigned char), slot.size, rec->fh) != slot.size ) {
+			rec->failed = 1;
+		}
+		rec->written += slot.size/2;
+
+		pthread_mutex_lock(&(rec->lock));
+		rec->count -= 1;
+	}
+	pthread_mutex_unlock(&(rec->lock));
+
+	return NULL;
+}
+
+
+/*
+  recorder_start - Open the output file and start the writer thread.  If 
+  'bursts' is true, the file is a burst recording with 'padding' buffers of 
+  padding on either side of each burst.  Returns 0 on success, -1 if the file
+  could not be opened, and -2 if the rings or the thread could not be setup.
+*/
+
+static int recorder_start(Recorder *rec, const char *filename, long sampleRate, int bursts, int padding) {
+	unsigned char header[BURST_FILE_HEADER];
+
+	rec->bursts = bursts;
+	rec->head = 0;
+	rec->count = 0;
+	rec->done = 0;
+	rec->failed = 0;
+	rec->dropped = 0;
+	rec->written = 0;
+	rec->prePadding = padding;
+	rec->postPadding = padding;
+	rec->postLeft = 0;
+	rec->pending = NULL;
+	rec->pendingHead = 0;
+	rec->nPending = 0;
+
+	rec->fh = fopen(filename, "wb");
+	if( rec->fh == NULL ) {
+		return -1;
+	}
+	if( bursts ) {
+		memcpy(header, burstMagic, 8);
+		pack_le(header + 8, BURST_VERSION, 4);
+		pack_le(header + 12, (uint64_t) sampleRate, 4);
+		if( fwrite(header, sizeof(unsigned char), BURST_FILE_HEADER, rec->fh) != BURST_FILE_HEADER ) {
+			fclose(rec->fh);
+			return -1;
+		}
+	}
+
+	rec->data = (unsigned char *) malloc((size_t) RECORD_BUFFERS*RTL_BUFFER_SIZE*sizeof(unsigned char));
+	if( rec->data == NULL ) {
+		fclose(rec->fh);
+		return -2;
+	}
+	if( bursts && padding > 0 ) {
+		rec->pending = (unsigned char *) malloc((size_t) padding*RTL_BUFFER_SIZE*sizeof(unsigned char));
+		if( rec->pending == NULL ) {
+			free(rec->data);
+			fclose(rec->fh);
+			return -2;
+		}
+	}
+
+	pthread_mutex_init(&(rec->lock), NULL);
+	pthread_cond_init(&(rec->ready), NULL);
+	if( pthread_create(&(rec->thread), NULL, recorder_run, (void *) rec) != 0 ) {
+		pthread_mutex_destroy(&(rec->lock));
+		pthread_cond_destroy(&(rec->ready));
+		free(rec->data);
+		free(rec->pending);
+		fclose(rec->fh);
+		return -2;
+	}
+
+	return 0;
+}
+
+
+/*
+  recorder_queue - Copy a buffer into the ring for the writer thread.  This 
+  needs to be called with the lock held.
+*/
+
+static void recorder_queue(Recorder *rec, const unsigned char *buf, const RecordSlot *slot) {
+	if( rec->count == RECORD_BUFFERS ) {
+		rec->dropped += 1;
+		return;
+	}
+
+	memcpy(rec->data + (size_t) rec->head*RTL_BUFFER_SIZE, buf, slot->size);
+	rec->slots[rec->head] = *slot;
+	rec->head = (rec->head + 1) % RECORD_BUFFERS;
+	rec->count += 1;
+	pthread_cond_signal(&(rec->ready));
+}
+
+
+/*
+  recorder_write - Queue a buffer of raw data for writing.  'len' can be at 
+  most RTL_BUFFER_SIZE.  'offset' and 'timestamp' are the sample counter and
+  time of the first sample in the buffer, and 'active' is whether or not there
+  is signal in the buffer.  The last three are only used in burst mode.
+*/
+
+static void recorder_write(Recorder *rec, const unsigned char *buf, uint32_t len, long offset, double timestamp, int active) {
+	int k, i;
+	RecordSlot slot;
+
+	slot.offset = offset;
+	slot.timestamp = timestamp;
+	slot.size = len;
+
+	pthread_mutex_lock(&(rec->lock));
+	if( len > RTL_BUFFER_SIZE ) {
+		rec->dropped += 1;
+	} else if( !rec->bursts ) {
+		recorder_queue(rec, buf, &slot);
+	} else if( active ) {
+		//// Signal - queue the padding from before the burst and the buffer
+		for(k=0; k<rec->nPending; k++) {
+			i = (rec->pendingHead - rec->nPending + k + rec->prePadding) % rec->prePadding;
+			recorder_queue(rec, rec->pending + (size_t) i*RTL_BUFFER_SIZE, &(rec->pendingSlots[i]));
+		}
+		rec->nPending = 0;
+		recorder_queue(rec, buf, &slot);
+		rec->postLeft = rec->postPadding;
+	} else if( rec->postLeft > 0 ) {
+		//// Padding after the burst
+		recorder_queue(rec, buf, &slot);
+		rec->postLeft -= 1;
+	} else if( rec->prePadding > 0 ) {
+		//// Possible padding for the next burst
+		i = rec->pendingHead;
+		memcpy(rec->pending + (size_t) i*RTL_BUFFER_SIZE, buf, len);
+		rec->pendingSlots[i] = slot;
+		rec->pendingHead = (i + 1) % rec->prePadding;
+		if( rec->nPending < rec->prePadding ) {
+			rec->nPending += 1;
+		}
+	}
+	pthread_mutex_unlock(&(rec->lock));
+}
+
+
+/*
+  recorder_stop - Write out anything that is still queued, stop the writer 
+  thread, and close the file.  Returns 0 on success and -1 if there was a
+  problem writing to the file.
+*/
+
+static int recorder_stop(Recorder *rec) {
+	int status = 0;
+
+	pthread_mutex_lock(&(rec->lock));
+	rec->done = 1;
+	pthread_cond_signal(&(rec->ready));
+	pthread_mutex_unlock(&(rec->lock));
+	pthread_join(rec->thread, NULL);
+
+	if( rec->failed ) {
+		status = -1;
+	}
+	if( fclose(rec->fh) != 0 ) {
+		status = -1;
+	}
+
+	pthread_mutex_destroy(&(rec->lock));
+	pthread_cond_destroy(&(rec->ready));
+	free(rec->data);
+	rec->data = NULL;
+	free(rec->pending);
+	rec->pending = NULL;
+
+	return status;
+}
+
+
+/*
+  CaptureContext - Everything needed by decoder_callback for a single readRTL
+  capture.
+*/
+
+typedef struct {
+	DecoderState state;
+	rtlsdr_dev_t *dev;
+	PyObject *callback;
+	Recorder *recorder;
+	int asBytes;
+	time_t tStart;
+	int loopTimeOut;
+	int exit;
+	int failed;
+} CaptureContext;
+
+
+/*
+  decorder_callback - Function that receives the RTL-SDR buffer and performs
+  the Manchester decoding.  ctx is a pointer to the CaptureContext of the
+  capture.  This function is called without the GIL so the GIL is only taken
+  if a stream callback has been set and there are new bits to hand off to it
+  at the end of the buffer.  If a Recorder has been set, the raw buffer is 
+  handed off to it as well.
 */
 
 static void decoder_callback(unsigned char *buf, uint32_t len, void *ctx) {
-	int j, power, edge, addBit;
-	float real, imag, instPower;
-	PyObject *temp;
+	CaptureContext *capture = (CaptureContext *) ctx;
+	PyGILState_STATE gstate;
+	double tBuffer;
+	long offset, edges;
+	int status, wasOn;
 
 	if( ctx ) {
 		// Exit if we are done
-		if( do_exit ) {
-        	return;
-        }
-		
+		if( do_exit || capture->exit || capture->failed ) {
+			rtlsdr_cancel_async(capture->dev);
+			return;
+		}
+
 		// Get the current time to figure out how long we've been running
-		tNow = (int) time(NULL);
-		diff = tNow - tStart;
-		if( loopTimeOut && diff > loopTimeOut ) {
-			do_exit = 1;
-			rtlsdr_cancel_async(dev);
+		if( capture->loopTimeOut && ((int) (time(NULL) - capture->tStart)) > capture->loopTimeOut ) {
+			capture->exit = 1;
+			rtlsdr_cancel_async(capture->dev);
+		}
+
+		// Time stamp the buffer - the last sample arrived just now
+		tBuffer = wall_time();
+		decoderstate_set_clock(&(capture->state), tBuffer, capture->state.dataCounter + len/2);
+		if( len < RTL_BUFFER_SIZE ) {
+			capture->state.stats.shortBuffers += 1;
 		}
-		
+
 		// Process the buffer
-		for(j=0; j<len/2; j++) {
-			//// Unpack
-			real = ((float) *(buf + 2*j+0)) - 127.0;
-			imag = ((float) *(buf + 2*j+1)) - 127.0;
-			instPower = real*real + imag*imag;
-			dataCounter += 1;
-		
-			//// Moving average
-			runningSum += instPower - *(powerBuffer + (dataCounter-1) % SMOOTH_WINDOW);
-			*(powerBuffer + (dataCounter-1) % SMOOTH_WINDOW) = instPower;
-		
-			//// Convert to an integer
-			if( runningSum >= THRESHOLD*SMOOTH_WINDOW ) {
-				power = 1;
-			} else {
-				power = 0;
-			}
-		
-			//// Edge detection
-			edge = power - prevPower;
-			prevPower = power;
-		
-			//// Timing
-			if( edge != 0 ) {
-				if( prevEdge < 0 ) {
-					prevEdge = dataCounter;
-				}
-				edgeCountDiff = dataCounter - prevEdge;
-			}
-				
-			if( edge == 1 ) {
-				////// Rising edge
-		
-				if( edgeCountDiff > 80000 ) {
-					prevEdge = dataCounter;
-					halfTime = 0;
-					addBit = 1;
-				} else if( edgeCountDiff < 200 || edgeCountDiff > 1100 ) {
-					addBit = 0;
-				} else if( edgeCountDiff < 615 ) {
-					prevEdge = dataCounter;
-					halfTime += 1;
-					addBit = 1;
-				} else {
-					prevEdge = dataCounter;
-					halfTime += 2;
-					addBit = 1;
-				}
-			
-				if( addBit && halfTime % 2 == 0 ) {
-					temp = PyInt_FromLong(1);
-					PyList_Append(ctx, temp);
-					Py_DECREF(temp);
-				}
-			
-			} else if( edge == -1 ) {
-				////// Falling edge
-			
-				if( edgeCountDiff > 80000 ) {
-					prevEdge = dataCounter;
-					halfTime = 0;
-					addBit = 1;
-				} else if( edgeCountDiff < 400 || edgeCountDiff > 1400 ) {
-					addBit = 0;
-				} else if( edgeCountDiff < 850 ) {
-					prevEdge = dataCounter;
-					halfTime += 1;
-					addBit = 1;
-				} else {
-					prevEdge = dataCounter;
-					halfTime += 2;
-					addBit = 1;
-				}
+		offset = capture->state.dataCounter;
+		edges = capture->state.stats.edges;
+		wasOn = capture->state.prevPower;
+		decoderstate_process(&(capture->state), buf, len);
+
+		// Save the raw data, if requested - the buffer has signal in it if the
+		// power was ever above the threshold
+		if( capture->recorder != NULL ) {
+			recorder_write(capture->recorder, buf, len, offset, \
+			               tBuffer - ((double) (len/2)) / capture->state.config.sampleRate, \
+			               wasOn || capture->state.prevPower || capture->state.stats.edges != edges);
+		}
+
+		// Check for memory problems
+		if( decoderstate_failed(&(capture->state)) ) {
+			capture->failed = 1;
+			rtlsdr_cancel_async(capture->dev);
+			return;
+		}
+
+		// Stream the new bits out, if requested
+		if( capture->callback != NULL && decoderstate_pending(&(capture->state)) > 0 ) {
+			gstate = PyGILState_Ensure();
+			status = decoderstate_publish(&(capture->state), capture->callback, capture->asBytes);
+			PyGILState_Release(gstate);
 			
-				if( addBit && halfTime % 2 == 0 ) {
-					temp = PyInt_FromLong(0);
-					PyList_Append(ctx, temp);
-					Py_DECREF(temp);
-				}
+			if( status < 0 ) {
+				//// The callback raised an exception - stop and let the caller
+				//// deal with it
+				capture->failed = 1;
+				rtlsdr_cancel_async(capture->dev);
+			} else if( status > 0 ) {
+				//// The callback has everything it needs - stop early
+				capture->exit = 1;
+				rtlsdr_cancel_async(capture->dev);
 			}
 		}
-		// end buffer processing loop
-		
+
+		// Update the statistics
+		decoderstate_count_buffer(&(capture->state), len, wall_time() - tBuffer);
 	}
 }
 
@@ -223,103 +1539,212 @@ int verbose_device_search(char *s) {
 }
 
 
+/*
+  setup_signals - Setup the signal handler so that we can exit the decoding
+  loops.
+*/
+
+static void setup_signals(void) {
+	struct sigaction sigact;
+
+	do_exit = 0;
+	sigact.sa_handler = sighandler;
+	sigemptyset(&sigact.sa_mask);
+	sigact.sa_flags = 0;
+	sigaction(SIGINT, &sigact, NULL);
+	sigaction(SIGTERM, &sigact, NULL);
+	sigaction(SIGQUIT, &sigact, NULL);
+	sigaction(SIGPIPE, &sigact, NULL);
+}
+
+
 /*
   readRTL - Function for reading directly from an RTL-SDR and returning a list of
   Manchester decoded bits.
 */
 
-static PyObject *readRTL(PyObject *self, PyObject *args) {
-	PyObject *output, *bits;
-	int r, i, dev_index;
-	long duration;
-	struct sigaction sigact;
-	
-	if( !PyArg_ParseTuple(args, "i", &duration) ) {
+static PyObject *readRTL(PyObject *self, PyObject *args, PyObject *kwds) {
+	PyObject *output, *callback = Py_None, *asBytes = Py_False, *framed = Py_False, *adaptive = Py_False;
+	PyObject *device = NULL, *deviceStr;
+	PyObject *bursts = Py_False;
+	int r, dev_index, duration, padding, recordStatus = 0;
+	long frequency = FREQUENCY;
+	char *record = NULL;
+	double paddingTime = BURST_PADDING;
+	DecoderConfig config;
+	CaptureContext capture;
+	Recorder recorder;
+
+	decoderconfig_init(&config);
+	static char *kwlist[] = {"duration", "callback", "asBytes", "framed", "frequency", "sampleRate", "smoothWindow", "threshold", "decimation", "adaptive", "device", "record", "bursts", "padding", NULL};
+	if( !PyArg_ParseTupleAndKeywords(args, kwds, "i|OOOllidiOOzOd", kwlist, &duration, &callback, &asBytes, &framed, \
+	                                 &frequency, &(config.sampleRate), &(config.smoothWindow), &(config.threshold), \
+	                                 &(config.decimation), &adaptive, &device, &record, &bursts, &paddingTime) ) {
 		PyErr_Format(PyExc_RuntimeError, "Invalid parameters");
 		return NULL;
 	}
-	
+
 	// Validate the input
 	if( duration <= 0 ) {
 		PyErr_Format(PyExc_ValueError, "Duration value must be greater than zero");
 		return NULL;
 	}
-	
-	// Setup the RTL SDR device
-	dev_index = verbose_device_search("0");
+	if( frequency <= 0 ) {
+		PyErr_Format(PyExc_ValueError, "Frequency must be greater than zero");
+		return NULL;
+	}
+	config.framed = PyObject_IsTrue(framed);
+	config.adaptive = PyObject_IsTrue(adaptive);
+	if( decoderconfig_setup(&config) < 0 ) {
+		return NULL;
+	}
+	if( callback != Py_None && !PyCallable_Check(callback) ) {
+		PyErr_Format(PyExc_TypeError, "Callback must be callable");
+		return NULL;
+	}
+	if( paddingTime < 0 ) {
+		PyErr_Format(PyExc_ValueError, "Padding must be greater than or equal to zero");
+		return NULL;
+	}
+
+	// Burst recording padding in whole buffers
+	padding = (int) ceil(paddingTime*config.sampleRate / (RTL_BUFFER_SIZE/2));
+	if( padding > BURST_MAX_PADDING ) {
+		padding = BURST_MAX_PADDING;
+	}
+
+	// Setup the RTL SDR device - either an index or a serial number
+	if( device == NULL || device == Py_None ) {
+		dev_index = verbose_device_search("0");
+	} else {
+		deviceStr = PyObject_Str(device);
+		if( deviceStr == NULL ) {
+			return NULL;
+		}
+		dev_index = verbose_device_search(PyString_AsString(deviceStr));
+		Py_DECREF(deviceStr);
+	}
 	if( dev_index < 0 ) {
 		PyErr_Format(PyExc_RuntimeError, "RTL SDR device not found");
 		return NULL;
 	}
-	r = rtlsdr_open(&dev, (uint32_t)dev_index);
+	r = rtlsdr_open(&(capture.dev), (uint32_t)dev_index);
 	if( r < 0 ) {
 		PyErr_Format(PyExc_RuntimeError, "Cannot open RTL SDR device");
 		return NULL;
 	}
 
-	// Setup the signal handler	so that we can exit the callback function
-	do_exit = 0;
-	sigact.sa_handler = sighandler;
-	sigemptyset(&sigact.sa_mask);
-	sigact.sa_flags = 0;
-	sigaction(SIGINT, &sigact, NULL);
-	sigaction(SIGTERM, &sigact, NULL);
-	sigaction(SIGQUIT, &sigact, NULL);
-	sigaction(SIGPIPE, &sigact, NULL);
-	
+	// Setup the signal handler so that we can exit the callback function
+	setup_signals();
+
 	// Setup the radio
-	r = rtlsdr_set_sample_rate(dev, SAMPLE_RATE);
-	r = rtlsdr_set_center_freq(dev, FREQUENCY);
-	r = rtlsdr_set_tuner_gain_mode(dev, 0);
-	
+	r = rtlsdr_set_sample_rate(capture.dev, (uint32_t) config.sampleRate);
+	if( r < 0 ) {
+		rtlsdr_close(capture.dev);
+		PyErr_Format(PyExc_ValueError, "Cannot set the sample rate to %ld Hz", config.sampleRate);
+		return NULL;
+	}
+	r = rtlsdr_set_center_freq(capture.dev, (uint32_t) frequency);
+	if( r < 0 ) {
+		rtlsdr_close(capture.dev);
+		PyErr_Format(PyExc_ValueError, "Cannot set the frequency to %ld Hz", frequency);
+		return NULL;
+	}
+	r = rtlsdr_set_tuner_gain_mode(capture.dev, 0);
+
+	// Setup the decoder
+	if( decoderstate_init(&(capture.state), &config) < 0 ) {
+		rtlsdr_close(capture.dev);
+		return PyErr_NoMemory();
+	}
+
 	// Reset endpoint before we start reading from it (mandatory)
-	r = rtlsdr_reset_buffer(dev);
-	
-	// Setup the output list
-	bits = PyList_New(0);
-	
-	// Reset the loop control
-	runningSum = 0;
-	prevPower = 0;
-	dataCounter = 0;
-	prevEdge = -1;
-	edgeCountDiff = -1;
-	halfTime = 0;
-	
-	// Setup the variables - Power Detection
-	powerBuffer = (float *) malloc(SMOOTH_WINDOW*sizeof(float));
-	for(i=0; i<SMOOTH_WINDOW; i++) {
-		*(powerBuffer + i) = 0.0;
+	r = rtlsdr_reset_buffer(capture.dev);
+	if( r < 0 ) {
+		capture.state.stats.readErrors += 1;
 	}
-	
-	// Setup the raw data buffer
-	unsigned char *raw;
-	raw = (unsigned char *) malloc(RTL_BUFFER_SIZE*sizeof(unsigned char));
-	
-	// Read in data
-	tStart = (int) time(NULL);
-	loopTimeOut = (int) duration;
-	r = rtlsdr_read_async(dev, decoder_callback, (void *) bits, 0, RTL_BUFFER_SIZE);
-	
+
+	// Setup the recording, if requested
+	capture.recorder = NULL;
+	if( record != NULL ) {
+		r = recorder_start(&recorder, record, config.sampleRate, PyObject_IsTrue(bursts), padding);
+		if( r < 0 ) {
+			decoderstate_free(&(capture.state));
+			rtlsdr_close(capture.dev);
+			if( r == -1 ) {
+				PyErr_Format(PyExc_IOError, "Cannot open file for writing");
+				return NULL;
+			}
+			return PyErr_NoMemory();
+		}
+		capture.recorder = &recorder;
+	}
+	capture.callback = (callback != Py_None) ? callback : NULL;
+	capture.asBytes = PyObject_IsTrue(asBytes);
+	capture.exit = 0;
+	capture.failed = 0;
+
+	// Read in data - without the GIL so that other threads can run
+	capture.tStart = time(NULL);
+	capture.loopTimeOut = duration;
+	Py_BEGIN_ALLOW_THREADS
+	r = rtlsdr_read_async(capture.dev, decoder_callback, (void *) &capture, 0, RTL_BUFFER_SIZE);
+	if( capture.recorder != NULL ) {
+		recordStatus = recorder_stop(capture.recorder);
+		capture.state.stats.recordDropped = capture.recorder->dropped;
+		capture.state.stats.recordSamples = capture.recorder->written;
+	}
+	Py_END_ALLOW_THREADS
+	if( r < 0 ) {
+		capture.state.stats.readErrors += 1;
+	}
+	decoderstate_finish(&(capture.state));
+	decoderstate_save_stats(&(capture.state));
+
 	// Done
-	if( do_exit ) {
+	if( PyErr_Occurred() ) {
+		fprintf(stderr, "\nCallback error, exiting...\n");
+	} else if( decoderstate_failed(&(capture.state)) ) {
+		fprintf(stderr, "\nOut of memory, exiting...\n");
+	} else if( do_exit || capture.exit ) {
 		fprintf(stderr, "\nUser cancel, exiting...\n");
 	} else {
 		fprintf(stderr, "\nLibrary error %d, exiting...\n", r);
 	}
-	
+
 	/*
 	If the call to rtlsdr_close() here generates a segfault then try
 	updating to a newer libusb.
 	*/
-	rtlsdr_close(dev);
-	
-	// Cleanup
-	free(raw);
-	free(powerBuffer);
+	rtlsdr_close(capture.dev);
+
+	// Check for a problem with the callback or the output buffer
+	if( PyErr_Occurred() ) {
+		decoderstate_free(&(capture.state));
+		return NULL;
+	}
+	if( decoderstate_failed(&(capture.state)) ) {
+		decoderstate_free(&(capture.state));
+		return PyErr_NoMemory();
+	}
+	if( recordStatus < 0 ) {
+		decoderstate_free(&(capture.state));
+		PyErr_Format(PyExc_IOError, "Error while writing to file");
+		return NULL;
+	}
 
 	// Return
-	output = Py_BuildValue("O", bits);
+	if( capture.callback != NULL ) {
+		//// Hand off anything that was left at the end of the capture
+		r = decoderstate_publish(&(capture.state), capture.callback, capture.asBytes);
+		decoderstate_free(&(capture.state));
+		if( r < 0 ) {
+			return NULL;
+		}
+		Py_RETURN_NONE;
+	}
+	output = decoderstate_take(&(capture.state), capture.asBytes);
+	decoderstate_free(&(capture.state));
 	return output;
 }
 
@@ -330,9 +1755,75 @@ and v3.0 sensor data.\n\
 \n\
 Inputs:\n\
   * duration - integer number of seconds to capture data for\n\
+  * callback - optional callable to stream the bits to as they are decoded\n\
+  * asBytes - optional boolean to return the bits as a bytearray with one\n\
+              bit per byte rather than as a list (default = False)\n\
+  * framed - optional boolean to return candidate packets rather than the\n\
+             raw bits (default = False)\n\
+  * frequency - optional center frequency in Hz (default = 433800000)\n\
+  * sampleRate - optional sample rate in Hz (default = 1000000)\n\
+  * smoothWindow - optional length of the power smoothing window in samples\n\
+                   (default = 488 scaled by sampleRate/1000000)\n\
+  * threshold - optional smoothed power detection threshold\n\
+                (default = 6800.0)\n\
+  * decimation - optional number of samples to sum together before the edge\n\
+                 detection (default = 1)\n\
+  * adaptive - optional boolean to use a threshold that tracks the noise\n\
+               floor and the signal level rather than a fixed threshold\n\
+               (default = False)\n\
+  * device - optional device index or serial number (default = 0)\n\
+  * record - optional filename to write the raw I/Q data to while decoding\n\
+             (default = None)\n\
+  * bursts - optional boolean to only record the data around bursts of\n\
+             signal (default = False)\n\
+  * padding - optional time in seconds to record on either side of each\n\
+              burst (default = 0.05)\n\
 \n\
 Outputs:\n\
- * bits - a list of ones and zeros for the data bits\n\
+ * bits - a list (or bytearray) of ones and zeros for the data bits\n\
+\n\
+The edge timing windows used for the Manchester decoding scale with the\n\
+sample rate.  The power detection is done with integer math and, if the\n\
+decimation is greater than one, on blocks of 'decimation' samples so that the\n\
+edge detection runs at a lower rate.  The edge timing resolution is then\n\
+'decimation' samples.\n\
+\n\
+With the adaptive threshold the detection threshold sits midway between\n\
+running estimates of the noise floor and the signal level, with hysteresis,\n\
+and pulses must be at least twice the noise floor.  Between pulses the signal\n\
+level decays toward four times the noise floor so that sensors weaker than\n\
+'threshold', which then only sets the starting point, are found as well.\n\
+\n\
+In framed mode the decoder looks for the v2.1 preamble and sync nibble itself\n\
+and returns a list of (sample offset, timestamp, packet bits) tuples instead.\n\
+The packet bits are de-interleaved, i.e., they are bits[i::2] of the raw\n\
+stream where i is the start of the preamble, and are up to 112 bits long.  The\n\
+sample offset is the sample at which the first preamble bit was decoded and\n\
+the timestamp is the corresponding UNIX time, estimated from the time at which\n\
+each RTL SDR buffer arrives.\n\
+\n\
+If a callback is provided it is called once per RTL SDR buffer with the bits\n\
+decoded from that buffer and None is returned at the end of the capture.  If\n\
+the callback returns a true value the capture is stopped early, i.e., before\n\
+the full duration has elapsed.  Any exception raised by the callback stops the\n\
+capture and is re-raised.\n\
+\n\
+The capture runs without the GIL and keeps all of its state to itself so\n\
+several devices can be captured from at once by calling readRTL from\n\
+different threads.  The statistics for the capture are available from stats()\n\
+once it is done.\n\
+\n\
+If 'record' is set, the raw data are also written to that file in the same\n\
+format as 'rtl_sdr' uses so that the capture can be replayed later with\n\
+readRTLFile.  The writing is done from a separate thread with its own ring of\n\
+buffers so that a slow disk does not hold up the decoding.  If the disk falls\n\
+too far behind, buffers are dropped from the recording and counted in the\n\
+'recordDropped' entry of stats().\n\
+\n\
+If 'bursts' is also set, only the RTL SDR buffers in which the smoothed power\n\
+was above the detection threshold, plus 'padding' seconds of buffers on either\n\
+side, are recorded.  Each buffer is stored with its sample offset and time\n\
+stamp in a burst recording that readRTLFile can replay directly.\n\
 \n\
 Based on:\n\
  * http://www.osengr.org/WxShield/Downloads/OregonScientific-RF-Protocols-II.pdf\n\
@@ -341,30 +1832,42 @@ Based on:\n\
 
 
 /*
-  readRTLFile - Function for reading from a file created by 'rtl_sdr' and 
+  readRTLFile - Function for reading from a file created by 'rtl_sdr' and
   returning a list of Manchester decoded bits.
 */
 
-static PyObject *readRTLFile(PyObject *self, PyObject *args) {
-	PyObject *output, *bits;
-	int i;
+static PyObject *readRTLFile(PyObject *self, PyObject *args, PyObject *kwds) {
+	PyObject *output, *callback = Py_None, *asBytes = Py_False, *framed = Py_False, *adaptive = Py_False;
+	int i, status, outputAsBytes, bursts;
 	char *filename;
-	struct sigaction sigact;
+	unsigned char *raw;
+	long chunkOffset, burstRate;
+	double startTime = 0.0, tBuffer, chunkTime;
+	DecoderConfig config;
+	DecoderState state;
 
-	if(!PyArg_ParseTuple(args, "s", &filename)) {
+	decoderconfig_init(&config);
+	static char *kwlist[] = {"filename", "callback", "asBytes", "framed", "sampleRate", "smoothWindow", "threshold", "decimation", "adaptive", "startTime", NULL};
+	if( !PyArg_ParseTupleAndKeywords(args, kwds, "s|OOOlidiOd", kwlist, &filename, &callback, &asBytes, &framed, \
+	                                 &(config.sampleRate), &(config.smoothWindow), &(config.threshold), \
+	                                 &(config.decimation), &adaptive, &startTime) ) {
 		PyErr_Format(PyExc_RuntimeError, "Invalid parameters");
 		return NULL;
 	}
-	
-	// Setup the signal handler	so that we can exit the callback function
-	sigact.sa_handler = sighandler;
-	sigemptyset(&sigact.sa_mask);
-	sigact.sa_flags = 0;
-	sigaction(SIGINT, &sigact, NULL);
-	sigaction(SIGTERM, &sigact, NULL);
-	sigaction(SIGQUIT, &sigact, NULL);
-	sigaction(SIGPIPE, &sigact, NULL);
-	
+	config.framed = PyObject_IsTrue(framed);
+	config.adaptive = PyObject_IsTrue(adaptive);
+	if( decoderconfig_setup(&config) < 0 ) {
+		return NULL;
+	}
+	if( callback != Py_None && !PyCallable_Check(callback) ) {
+		PyErr_Format(PyExc_TypeError, "Callback must be callable");
+		return NULL;
+	}
+	outputAsBytes = PyObject_IsTrue(asBytes);
+
+	// Setup the signal handler so that we can exit the decoding loop
+	setup_signals();
+
 	// Ready the file
 	FILE *fh = fopen(filename, "r");
 	if(fh == NULL) {
@@ -372,57 +1875,110 @@ static PyObject *readRTLFile(PyObject *self, PyObject *args) {
 		return NULL;
 	}
 
-	// Setup the output list
-	bits = PyList_New(0);
-	
-	// Reset the loop control
-	runningSum = 0;
-	prevPower = 0;
-	dataCounter = 0;
-	prevEdge = -1;
-	edgeCountDiff = -1;
-	halfTime = 0;
-	
-	// Setup the variables - Power Detection
-	powerBuffer = (float *) malloc(SMOOTH_WINDOW*sizeof(float));
-	for(i=0; i<SMOOTH_WINDOW; i++) {
-		*(powerBuffer + i) = 0.0;
+	// Check for a burst recording
+	bursts = burstfile_check(fh, &burstRate);
+	if( bursts && burstRate != config.sampleRate ) {
+		fclose(fh);
+		PyErr_Format(PyExc_ValueError, "Burst recording sample rate of %ld Hz does not match %ld Hz", burstRate, config.sampleRate);
+		return NULL;
 	}
-	
+
+	// Setup the decoder
+	if( decoderstate_init(&state, &config) < 0 ) {
+		fclose(fh);
+		return PyErr_NoMemory();
+	}
+	decoderstate_set_clock(&state, startTime, 0);
+
 	// Setup the raw data buffer
-	unsigned char *raw;
 	raw = (unsigned char *) malloc(RTL_BUFFER_SIZE*sizeof(unsigned char));
-	
-	// Reset the loop control
-	prevPower = 0;
-	dataCounter = 0;
-	prevEdge = -1;
-	edgeCountDiff = -1;
-	halfTime = 0;
-	
-	// Read in data and decode it
-	loopTimeOut = 0;
-	while( (i = fread(raw, sizeof(unsigned char), RTL_BUFFER_SIZE, fh)) > 0 ) {
-		decoder_callback(raw, i, (void *) bits);
-		
+	if( raw == NULL ) {
+		fclose(fh);
+		decoderstate_free(&state);
+		return PyErr_NoMemory();
+	}
+
+	// Read in data and decode it - without the GIL so that other threads can 
+	// run.  The GIL is only needed to hand off the bits to the callback.
+	Py_BEGIN_ALLOW_THREADS
+	while( (i = bursts ? burstfile_read(fh, raw, &chunkOffset, &chunkTime) \
+	                   : (int) fread(raw, sizeof(unsigned char), RTL_BUFFER_SIZE, fh)) > 0 ) {
+		tBuffer = wall_time();
+
+		//// Pick up the sample counter and time for the chunk in a burst 
+		//// recording
+		if( bursts ) {
+			if( chunkOffset != state.dataCounter ) {
+				decoderstate_skip_to(&state, chunkOffset);
+			}
+			decoderstate_set_clock(&state, chunkTime, chunkOffset);
+		}
+
+		decoderstate_process(&state, raw, i);
+
+		//// Check for memory problems
+		if( decoderstate_failed(&state) ) {
+			break;
+		}
+
+		//// Stream the new bits out, if requested
+		status = 0;
+		if( callback != Py_None && decoderstate_pending(&state) > 0 ) {
+			Py_BLOCK_THREADS
+			status = decoderstate_publish(&state, callback, outputAsBytes);
+			Py_UNBLOCK_THREADS
+		}
+
+		//// Update the statistics
+		decoderstate_count_buffer(&state, i, wall_time() - tBuffer);
+		if( status != 0 ) {
+			break;
+		}
+
 		//// Check for a request to exit
 		if( do_exit ) {
 			break;
 		}
 	}
-	if( ferror(fh) ) {
-		PyErr_Format(PyExc_IOError, "Error while reading from file");
+	Py_END_ALLOW_THREADS
+	if( ferror(fh) || i < 0 ) {
+		state.stats.readErrors += 1;
+		decoderstate_save_stats(&state);
+		PyErr_Format(PyExc_IOError, i < 0 ? "Invalid burst recording" : "Error while reading from file");
 		fclose(fh);
 		free(raw);
+		decoderstate_free(&state);
 		return NULL;
 	}
-	
+
 	// Done
 	fclose(fh);
 	free(raw);
+	decoderstate_finish(&state);
+	decoderstate_save_stats(&state);
+
+	// Check for a problem with the callback or the output buffer
+	if( PyErr_Occurred() ) {
+		decoderstate_free(&state);
+		return NULL;
+	}
+	if( decoderstate_failed(&state) ) {
+		decoderstate_free(&state);
+		return PyErr_NoMemory();
+	}
 
 	// Return
-	output = Py_BuildValue("O", bits);
+	if( callback != Py_None ) {
+		//// Hand off anything that was left at the end of the file
+		status = decoderstate_publish(&state, callback, outputAsBytes);
+		decoderstate_free(&state);
+		if( status < 0 ) {
+			return NULL;
+		}
+		Py_RETURN_NONE;
+	}
+	output = decoderstate_take(&state, outputAsBytes);
+	decoderstate_free(&state);
 	return output;
 }
 
@@ -433,9 +1989,40 @@ identifying Oregon Scientific v2.1 and v3.0 sensor data.\n\
 \n\
 Inputs:\n\
   * filename - filename to open for reading\n\
+  * callback - optional callable to stream the bits to as they are decoded\n\
+  * asBytes - optional boolean to return the bits as a bytearray with one\n\
+              bit per byte rather than as a list (default = False)\n\
+  * framed - optional boolean to return candidate packets rather than the\n\
+             raw bits (default = False)\n\
+  * sampleRate - optional sample rate of the recording in Hz\n\
+                 (default = 1000000)\n\
+  * smoothWindow - optional length of the power smoothing window in samples\n\
+                   (default = 488 scaled by sampleRate/1000000)\n\
+  * threshold - optional smoothed power detection threshold\n\
+                (default = 6800.0)\n\
+  * decimation - optional number of samples to sum together before the edge\n\
+                 detection (default = 1)\n\
+  * adaptive - optional boolean to use a threshold that tracks the noise\n\
+               floor and the signal level rather than a fixed threshold\n\
+               (default = False)\n\
+  * startTime - optional time of the first sample in the file in seconds\n\
+                (default = 0.0)\n\
 \n\
 Outputs:\n\
- * bits - a list of ones and zeros for the data bits\n\
+ * bits - a list (or bytearray) of ones and zeros for the data bits\n\
+\n\
+See readRTL for a description of the framed mode output.  The timestamps are\n\
+startTime plus the sample offset divided by the sample rate.\n\
+\n\
+The file can also be a burst recording made by readRTL.  The sample offsets\n\
+and timestamps then come from the recording and startTime is not used.  The\n\
+sample rate needs to match the one that the recording was made with.\n\
+\n\
+If a callback is provided it is called once per file buffer with the bits\n\
+decoded from that buffer and None is returned at the end of the file.  If\n\
+the callback returns a true value the decoding is stopped early.  Any\n\
+exception raised by the callback stops the decoding and is re-raised.  The\n\
+statistics for the file are available from stats() once it is done.\n\
 \n\
 Based on:\n\
  * http://www.osengr.org/WxShield/Downloads/OregonScientific-RF-Protocols-II.pdf\n\
@@ -443,13 +2030,354 @@ Based on:\n\
 ");
 
 
+/*
+  Decoder - Python type that owns a DecoderState so that data can be fed in
+  incrementally.
+*/
+
+typedef struct {
+	PyObject_HEAD
+	DecoderState state;
+	int asBytes;
+	int busy;
+	int hasLeftover;
+	unsigned char leftover[2];
+} Decoder;
+
+static void Decoder_dealloc(Decoder *self) {
+	decoderstate_free(&(self->state));
+	Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static PyObject *Decoder_new(PyTypeObject *type, PyObject *args, PyObject *kwds) {
+	Decoder *self;
+
+	self = (Decoder *) type->tp_alloc(type, 0);
+	if( self == NULL ) {
+		return NULL;
+	}
+
+	// The decoder state is setup in Decoder_init once the parameters are known
+	self->state.powerBuffer = NULL;
+	self->state.bits.data = NULL;
+	self->state.frames.data = NULL;
+	self->asBytes = 0;
+	self->busy = 0;
+	self->hasLeftover = 0;
+
+	return (PyObject *) self;
+}
+
+static int Decoder_init(Decoder *self, PyObject *args, PyObject *kwds) {
+	PyObject *asBytes = Py_False, *framed = Py_False, *adaptive = Py_False, *midStream = Py_False;
+	double startTime = 0.0;
+	DecoderConfig config;
+
+	decoderconfig_init(&config);
+	static char *kwlist[] = {"asBytes", "framed", "sampleRate", "smoothWindow", "threshold", "decimation", "adaptive", "startTime", "midStream", NULL};
+	if( !PyArg_ParseTupleAndKeywords(args, kwds, "|OOlidiOdO", kwlist, &asBytes, &framed, \
+	                                 &(config.sampleRate), &(config.smoothWindow), &(config.threshold), \
+	                                 &(config.decimation), &adaptive, &startTime, &midStream) ) {
+		PyErr_Format(PyExc_RuntimeError, "Invalid parameters");
+		return -1;
+	}
+	if( self->busy ) {
+		PyErr_Format(PyExc_RuntimeError, "Decoder is in use by another thread");
+		return -1;
+	}
+	config.framed = PyObject_IsTrue(framed);
+	config.adaptive = PyObject_IsTrue(adaptive);
+	config.midStream = PyObject_IsTrue(midStream);
+	if( decoderconfig_setup(&config) < 0 ) {
+		return -1;
+	}
+	self->asBytes = PyObject_IsTrue(asBytes);
+
+	// (Re)build the decoder state
+	decoderstate_free(&(self->state));
+	if( decoderstate_init(&(self->state), &config) < 0 ) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	decoderstate_set_clock(&(self->state), startTime, 0);
+	self->hasLeftover = 0;
+
+	return 0;
+}
+
+/*
+  decoder_check - Make sure that a Decoder is ready to use, returning 0 if it 
+  is and -1 with a Python exception set if it is not.
+*/
+
+static int decoder_check(Decoder *self) {
+	if( self->state.powerBuffer == NULL ) {
+		PyErr_Format(PyExc_RuntimeError, "Decoder has not been initialized");
+		return -1;
+	}
+	if( self->busy ) {
+		PyErr_Format(PyExc_RuntimeError, "Decoder is in use by another thread");
+		return -1;
+	}
+	return 0;
+}
+
+/*
+  decoder_take - Return the bits, or frames, decoded so far as a Python object 
+  and empty the output buffers.
+*/
+
+static PyObject *decoder_take(Decoder *self) {
+	if( decoderstate_failed(&(self->state)) ) {
+		self->state.bits.failed = 0;
+		self->state.bits.size = 0;
+		self->state.frames.failed = 0;
+		self->state.frames.size = 0;
+		return PyErr_NoMemory();
+	}
+
+	return decoderstate_take(&(self->state), self->asBytes);
+}
+
+static PyObject *Decoder_feed(Decoder *self, PyObject *args) {
+	Py_buffer view;
+	const unsigned char *data;
+	Py_ssize_t len;
+	double tBuffer;
+
+	if( !PyArg_ParseTuple(args, "s*", &view) ) {
+		PyErr_Format(PyExc_RuntimeError, "Invalid parameters");
+		return NULL;
+	}
+	if( decoder_check(self) < 0 ) {
+		PyBuffer_Release(&view);
+		return NULL;
+	}
+	data = (const unsigned char *) view.buf;
+	len = view.len;
+
+	// Process the buffer - without the GIL so that other threads can run
+	self->busy = 1;
+	Py_BEGIN_ALLOW_THREADS
+	tBuffer = wall_time();
+
+	//// Complete any I/Q pair that was split across calls
+	if( self->hasLeftover && len > 0 ) {
+		self->leftover[1] = *data;
+		decoderstate_process(&(self->state), self->leftover, 2);
+		self->hasLeftover = 0;
+		data += 1;
+		len -= 1;
+	}
+
+	decoderstate_process(&(self->state), data, (uint32_t) len);
+
+	//// Save any trailing byte for the next call
+	if( len % 2 == 1 ) {
+		self->leftover[0] = *(data + len - 1);
+		self->hasLeftover = 1;
+	}
+
+	decoderstate_count_buffer(&(self->state), (uint32_t) view.len, wall_time() - tBuffer);
+	Py_END_ALLOW_THREADS
+	self->busy = 0;
+	PyBuffer_Release(&view);
+
+	return decoder_take(self);
+}
+
+PyDoc_STRVAR(Decoder_feed_doc, \
+"Feed a string/buffer of interleaved 8-bit I/Q samples, as created by\n\
+'rtl_sdr', to the decoder and return the bits that were decoded from it as\n\
+a list (or bytearray), or the list of frames that were completed by it in\n\
+framed mode.  The decoder state is kept between calls so a stream\n\
+can be fed in pieces of any size.  The decoding runs without the GIL so\n\
+several Decoder instances can be fed from different threads at once.");
+
+static PyObject *Decoder_flush(Decoder *self) {
+	PyObject *output;
+
+	if( decoder_check(self) < 0 ) {
+		return NULL;
+	}
+
+	decoderstate_finish(&(self->state));
+	output = decoder_take(self);
+
+	// Reset the decoder for a new stream, closing out any pulse that is still
+	// in progress before the sample counter goes back to zero
+	if( self->state.prevPower ) {
+		self->state.stats.pulseSamples += self->state.dataCounter;
+	}
+	decoderstate_reset(&(self->state));
+	self->hasLeftover = 0;
+
+	return output;
+}
+
+PyDoc_STRVAR(Decoder_flush_doc, \
+"Signal the end of the current stream and return any bits, or frames, that\n\
+have not yet been returned.  The decoder is then reset so that it is ready for a new\n\
+stream.");
+
+static PyObject *Decoder_stats(Decoder *self) {
+	if( self->state.powerBuffer == NULL ) {
+		PyErr_Format(PyExc_RuntimeError, "Decoder has not been initialized");
+		return NULL;
+	}
+
+	return decoderstate_stats(&(self->state));
+}
+
+PyDoc_STRVAR(Decoder_stats_doc, \
+"Return a dictionary of the statistics for all of the data fed to the\n\
+decoder since it was created.  Each call to feed counts as one buffer.  See\n\
+decoder.stats for a description of the entries.");
+
+static PyMethodDef Decoder_methods[] = {
+	{"feed", (PyCFunction) Decoder_feed, METH_VARARGS, Decoder_feed_doc},
+	{"flush", (PyCFunction) Decoder_flush, METH_NOARGS, Decoder_flush_doc},
+	{"stats", (PyCFunction) Decoder_stats, METH_NOARGS, Decoder_stats_doc},
+	{NULL, NULL, 0, NULL}
+};
+
+PyDoc_STRVAR(DecoderType_doc, \
+"Manchester decoder for a stream of RTL SDR data that keeps all of its state\n\
+so that data can be fed to it incrementally and so that several streams can\n\
+be decoded at once.\n\
+\n\
+Inputs:\n\
+  * asBytes - optional boolean to return the bits as a bytearray with one\n\
+              bit per byte rather than as a list (default = False)\n\
+  * framed - optional boolean to return candidate packets rather than the\n\
+             raw bits (default = False).  See readRTL for details.\n\
+  * sampleRate - optional sample rate of the data in Hz (default = 1000000)\n\
+  * smoothWindow - optional length of the power smoothing window in samples\n\
+                   (default = 488 scaled by sampleRate/1000000)\n\
+  * threshold - optional smoothed power detection threshold\n\
+                (default = 6800.0)\n\
+  * decimation - optional number of samples to sum together before the edge\n\
+                 detection (default = 1)\n\
+  * adaptive - optional boolean to use a threshold that tracks the noise\n\
+               floor and the signal level rather than a fixed threshold\n\
+               (default = False)\n\
+  * startTime - optional time of the first sample in seconds used for the\n\
+                framed mode timestamps (default = 0.0)\n\
+  * midStream - optional boolean for data that starts partway through a\n\
+                recording.  The first edge then restarts the Manchester\n\
+                decoding, as it would after a quiet stretch, rather than\n\
+                only starting the edge timing (default = False)\n\
+\n\
+Example:\n\
+>>> d = Decoder()\n\
+>>> bits = []\n\
+>>> for chunk in iter(lambda: fh.read(32768), ''):\n\
+...     bits.extend( d.feed(chunk) )\n\
+>>> bits.extend( d.flush() )\n\
+");
+
+static PyTypeObject DecoderType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"decoder.Decoder",                        /* tp_name */
+	sizeof(Decoder),                          /* tp_basicsize */
+	0,                                        /* tp_itemsize */
+	(destructor) Decoder_dealloc,             /* tp_dealloc */
+	0,                                        /* tp_print */
+	0,                                        /* tp_getattr */
+	0,                                        /* tp_setattr */
+	0,                                        /* tp_compare */
+	0,                                        /* tp_repr */
+	0,                                        /* tp_as_number */
+	0,                                        /* tp_as_sequence */
+	0,                                        /* tp_as_mapping */
+	0,                                        /* tp_hash */
+	0,                                        /* tp_call */
+	0,                                        /* tp_str */
+	0,                                        /* tp_getattro */
+	0,                                        /* tp_setattro */
+	0,                                        /* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /* tp_flags */
+	DecoderType_doc,                          /* tp_doc */
+	0,                                        /* tp_traverse */
+	0,                                        /* tp_clear */
+	0,                                        /* tp_richcompare */
+	0,                                        /* tp_weaklistoffset */
+	0,                                        /* tp_iter */
+	0,                                        /* tp_iternext */
+	Decoder_methods,                          /* tp_methods */
+	0,                                        /* tp_members */
+	0,                                        /* tp_getset */
+	0,                                        /* tp_base */
+	0,                                        /* tp_dict */
+	0,                                        /* tp_descr_get */
+	0,                                        /* tp_descr_set */
+	0,                                        /* tp_dictoffset */
+	(initproc) Decoder_init,                  /* tp_init */
+	0,                                        /* tp_alloc */
+	Decoder_new,                              /* tp_new */
+};
+
+
+/*
+  stats - Function for retrieving the statistics from the last readRTL or 
+  readRTLFile call made by the current thread.
+*/
+
+static PyObject *stats(PyObject *self) {
+	PyObject *dict, *output;
+
+	dict = PyThreadState_GetDict();
+	if( dict != NULL ) {
+		output = PyDict_GetItemString(dict, STATS_KEY);
+		if( output != NULL ) {
+			return PyDict_Copy(output);
+		}
+	}
+
+	Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(stats_doc, \
+"Return a dictionary of the statistics from the last call to readRTL or\n\
+readRTLFile made by the current thread, or None if there has not been one.\n\
+The statistics are kept per thread so that several devices can be captured\n\
+from at once.\n\
+\n\
+Entries:\n\
+  * samples - number of I/Q samples processed\n\
+  * buffers - number of buffers processed\n\
+  * shortBuffers - number of RTL SDR buffers that were not full\n\
+  * overruns - number of buffers that took longer to process than to record\n\
+  * readErrors - number of errors reported by the device or file read\n\
+  * processTime - total time in seconds spent processing buffers, including\n\
+                  any stream callbacks\n\
+  * maxProcessTime - longest time in seconds spent processing a buffer\n\
+  * pulseSamples - number of samples above the detection threshold\n\
+  * edges - number of edges detected\n\
+  * edgeResets - number of edges that restarted the Manchester decoding\n\
+  * riseTooShort/riseTooLong - number of rising edges rejected for being\n\
+                               too close to/far from the previous edge\n\
+  * fallTooShort/fallTooLong - number of falling edges rejected for being\n\
+                               too close to/far from the previous edge\n\
+  * bits - number of bits emitted\n\
+  * frames - number of candidate packets found in framed mode\n\
+  * framesDropped - number of candidate packets dropped because too many\n\
+                    were in progress at once\n\
+  * recordDropped - number of buffers dropped from the readRTL recording\n\
+  * recordSamples - number of samples written to the readRTL recording\n\
+\n\
+With the adaptive threshold 'noiseLevel' and 'signalLevel' give the current\n\
+noise floor and signal level estimates as the mean power per sample.");
+
+
 /*
   Module Setup - Function Definitions and Documentation
 */
 
 static PyMethodDef DecoderMethods[] = {
-	{"readRTL", (PyCFunction) readRTL, METH_VARARGS, readRTL_doc}, 
-	{"readRTLFile", (PyCFunction) readRTLFile, METH_VARARGS, readRTLFile_doc}, 
+	{"readRTL", (PyCFunction) readRTL, METH_VARARGS | METH_KEYWORDS, readRTL_doc},
+	{"readRTLFile", (PyCFunction) readRTLFile, METH_VARARGS | METH_KEYWORDS, readRTLFile_doc},
+	{"stats", (PyCFunction) stats, METH_NOARGS, stats_doc},
 	{NULL, NULL, 0, NULL}
 };
 
@@ -465,9 +2393,32 @@ station data.");
 PyMODINIT_FUNC initdecoder(void) {
 	PyObject *m;
 
+	// Make sure the GIL exists since the decoding runs without it
+	PyEval_InitThreads();
+
+	// Fill in the power lookup table
+	powertable_init();
+
+	// Ready the Decoder type
+	if( PyType_Ready(&DecoderType) < 0 ) {
+		return;
+	}
+
 	// Module definitions and functions
 	m = Py_InitModule3("decoder", DecoderMethods, Decoder_doc);
-	
+	if( m == NULL ) {
+		return;
+	}
+	Py_INCREF(&DecoderType);
+	PyModule_AddObject(m, "Decoder", (PyObject *) &DecoderType);
+
+	// Default device/detection parameters
+	PyModule_AddIntConstant(m, "FREQUENCY", FREQUENCY);
+	PyModule_AddIntConstant(m, "SAMPLE_RATE", SAMPLE_RATE);
+	PyModule_AddIntConstant(m, "SMOOTH_WINDOW", SMOOTH_WINDOW);
+	PyModule_AddObject(m, "THRESHOLD", PyFloat_FromDouble(THRESHOLD));
+	PyModule_AddIntConstant(m, "DECIMATION", DECIMATION);
+
 	// Version and revision information
 	PyModule_AddObject(m, "__version__", PyString_FromString("0.1"));
 }
@@ -4,11 +4,58 @@
 Function for parsing data packets from Oregon Scientific weather sensors
 """
 
+import string
+import threading
+from collections import OrderedDict
+
 from utils import computeDewPoint, computeWindchill, computeSeaLevelPressure
 
 __version__ = '0.1'
-__all__ = ['nibbles2value', 'computeChecksum', 'parsePacketv21', 'parseBitStream', 
-           '__version__', '__all__']
+__all__ = ['nibbles2value', 'computeChecksum', 'parsePacketv21', 'Reading', 'iterBitStream', 
+           'iterFrames', 'parseBitStream', 'parseFrames', 'BitStreamParser', '__version__', '__all__']
+
+
+# Maximum number of bits in a packet, i.e., the longest packet (BHTR968) plus
+# its checksum and postamble, and the number of bits that it spans in the 
+# interleaved bit stream
+_MAX_PACKET_BITS = 96+16
+_MAX_PACKET_SPAN = 2*_MAX_PACKET_BITS
+
+# Number of distinct packets to remember when looking for repeats
+_PACKET_CACHE_SIZE = 64
+
+# Preamble in the interleaved bit stream with one bit per character, i.e.,
+# 16 ones each followed by its logical negation
+_PREAMBLE = '\x01\x00'*16
+
+
+# Translation tables for packing bits with one bit per character into a 
+# binary string and for turning hexadecimal digits into nibble values
+_BITS_TO_BINARY = string.maketrans('\x00\x01', '01')
+_HEX_TO_NIBBLES = string.maketrans('0123456789abcdef', ''.join([chr(i) for i in xrange(16)]))
+
+
+def _packBits(bits):
+	"""
+	Pack a sequence of bits into a single integer with the first bit as the
+	least significant one so that nibble k of the sequence is simply
+	(value >> 4*k) & 0xF.
+	"""
+	
+	if len(bits) == 0:
+		return 0
+		
+	# Let int() do the work on the reversed binary string
+	binary = str(bytearray(bits))[::-1].translate(_BITS_TO_BINARY)
+	return int(binary, 2)
+
+
+def _sumNibbles(value):
+	"""
+	Return the sum of the nibbles in a packed integer.
+	"""
+	
+	return sum(bytearray(('%x' % value).translate(_HEX_TO_NIBBLES)))
 
 
 def nibbles2value(nibbles):
@@ -18,14 +65,20 @@ def nibbles2value(nibbles):
 	
 	# A nibbles is 4 bits
 	n = len(nibbles)/4
-	
-	# Loop over the nibbles
-	out = []
-	for i in xrange(n):
-		out.append( (nibbles[4*i+3]<<3) | (nibbles[4*i+2]<<2) | (nibbles[4*i+1]<<1) | nibbles[4*i+0] )
+	if n == 0:
+		return []
 		
-	# Done
-	return out
+	# Pack the bits and unpack the nibbles from the hexadecimal digits
+	value = _packBits(nibbles[:4*n])
+	return list(bytearray(('%0*x' % (n, value))[::-1].translate(_HEX_TO_NIBBLES)))
+
+
+def _foldChecksum(value):
+	"""
+	Convert a nibble sum to the 8-bit checksum used by the sensors.
+	"""
+	
+	return (value & 0xFF) + (value >> 8)
 
 
 def computeChecksum(bits):
@@ -33,171 +86,240 @@ def computeChecksum(bits):
 	Compute the byte-based checksum for a sequence of bits.
 	"""
 	
-	# Bits -> Integers
-	values = nibbles2value(bits)
-	
-	# Sum
-	value = sum(values)
+	# Bits -> Integer, ignoring any partial nibble at the end
+	n = len(bits)/4
+	value = _packBits(bits[:4*n])
 	
-	# Convert to an 8-bit value
-	value = (value & 0xFF) + (value >> 8)
+	# Sum and convert to an 8-bit value
+	return _foldChecksum(_sumNibbles(value))
+
+
+def _decodeDigits(data, nibble, weights):
+	"""
+	Decode a BCD field from a packed data section that starts at the given 
+	nibble and return the sum of the digits multiplied by their weights.  
+	The digits are summed starting with the most significant one.
+	"""
 	
-	# Done
+	value = 0
+	for j in xrange(len(weights)-1, -1, -1):
+		value += weights[j]*((data >> 4*(nibble+j)) & 0xF)
+		
 	return value
 
 
-def _parseBHTR968(data):
+# BHTR968 "comfort level" and pressure-based weather forecast codes
+_COMFORT_LEVELS = {0: 'normal', 4: 'comfortable', 8: 'dry', 0xC: 'wet'}
+_FORECASTS = {2: 'cloudy', 3: 'rainy', 6: 'partly cloudy', 0xC: 'sunny'}
+
+
+def _decodeBHTR968(data, output):
 	"""
-	Parse the data section of a BHTR968 indoor temperature/humidity/pressure
-	sensor packet and return a dictionary of the values recovered.
+	Decode the parts of a BHTR968 indoor temperature/humidity/pressure 
+	sensor packet that are not simple BCD fields.
 	"""
 	
-	output = {'temperature': -99, 'humidity': -99, 'pressure': -99, 
-			  'comfortLevel': 'unknown', 'forecast': 'unknown'}
-			  
-	# Indoor temperature in C
-	temp = nibbles2value(data[0:12])
-	temp = 10*temp[2] + temp[1] + 0.1*temp[0]
-	if sum(data[12:16]) > 0:
-		temp *= -1
-	output['temperature'] = temp
-	
-	# Indoor relative humidity as a percentage
-	humi = nibbles2value(data[16:24])
-	output['humidity'] = 10*humi[1]+humi[0]
+	# Indoor temperature sign
+	if (data >> 12) & 0xF:
+		output['temperature'] *= -1
 		
 	# Indoor "comfort level"
-	comf = nibbles2value(data[24:28])[0]
-	if comf == 0:
-		output['comfortLevel'] = 'normal'
-	elif comf == 4:
-		output['comfortLevel'] = 'comfortable'
-	elif comf == 8:
-		output['comfortLevel'] = 'dry'
-	elif comf == 0xC:
-		output['comfortLevel'] = 'wet'
-	else:
-		output['comfortLevel'] = 'unknown'
-		
+	output['comfortLevel'] = _COMFORT_LEVELS.get((data >> 24) & 0xF, 'unknown')
+	
 	# Barometric pressure in mbar
-	baro = nibbles2value(data[28:36])
-	baro = (baro[1] << 4) | (baro[0])
+	baro = (data >> 28) & 0xFF
 	if baro >= 128:
 		baro -= 256
 	output['pressure'] = baro + 856
-		
-	# Pressure-based weather forecast
-	fore = nibbles2value(data[40:44])[0]
-	if fore == 2:
-		output['forecast'] = 'cloudy'
-	elif fore == 3:
-		output['forecast']  = 'rainy'
-	elif fore == 6:
-		output['forecast']  = 'partly cloudy'
-	elif fore == 0xC:
-		output['forecast']  = 'sunny'
-	else:
-		output['forecast']  = 'unknown'
-		
-	return output
-
-def _parseRGR968(data):
-	"""
-	Parse the data section of a RGR968 rain gauge packet and return a dictionary 
-	of the values recovered.
-	"""
 	
-	output = {'rainrate': -99, 'rainfall': -99}
-	
-	# Rainfall rate in mm/hr
-	rrate = nibbles2value(data[0:12])
-	output['rainrate'] = 10*rrate[2] + rrate[1] + 0.1*rrate[0]
-	
-	# Total rainfall in mm
-	rtotl = nibbles2value(data[12:32])
-	output['rainfall'] = 1000*rtotl[4] + 100*rtotl[3] + 10*rtotl[2] + rtotl[1] + 0.1*rtotl[0]
+	# Pressure-based weather forecast
+	output['forecast'] = _FORECASTS.get((data >> 40) & 0xF, 'unknown')
 	
 	return output
 
-def _parseWGR968(data):
+
+def _decodeTHGR268(data, output):
 	"""
-	Parse the data section of a WGR968 anemometer packet and return a dictionary 
-	of the values recovered.
+	Decode the temperature sign of a THGR268 temperature/humidity sensor
+	packet.
 	"""
 	
-	output = {'average': -99, 'gust': -99, 'direction': -99}
-	
-	# Wind direction in degrees (N = 0)
-	wdir = nibbles2value(data[0:12])
-	output['direction'] = 100*wdir[2] + 10*wdir[1] + wdir[0]
-	
-	# Gust wind speed in m/s
-	gspd = nibbles2value(data[12:24])
-	output['gust'] = 10*gspd[2] + gspd[1] + 0.1*gspd[0]
-	
-	# Average wind speed in m/s
-	aspd = nibbles2value(data[24:36])
-	output['average'] = 10*aspd[2] + aspd[1] + 0.1*aspd[0]
-	
+	if (data >> 12) & 0xF:
+		output['temperature'] *= -1
+		
 	return output
-	
-def _parseTHGR268(data):
+
+
+# Sensor registry - a dictionary of 16-bit sensor ID to a four-element tuple
+# of the sensor name, the end of the data section (and the start of the 
+# checksum) in bits, the BCD fields in the data section, and a function to 
+# decode anything else.  Each BCD field is a (key, first nibble, digit 
+# weights) tuple with the weights listed from the least significant digit.
+# The decoding functions take the packed data section and the output 
+# dictionary.
+#
+# .. note::
+#    The location of the THGR968 temperature sign is not known so it is
+#    not decoded.
+_SENSORS = {0x5d60: ('BHTR968', 96, (('temperature', 0, (0.1, 1, 10)), ('humidity', 4, (1, 10))), _decodeBHTR968),
+            0x2d10: ('RGR968',  84, (('rainrate', 0, (0.1, 1, 10)), ('rainfall', 3, (0.1, 1, 10, 100, 1000))), None),
+            0x3d00: ('WGR968',  88, (('direction', 0, (1, 10, 100)), ('gust', 3, (0.1, 1, 10)), ('average', 6, (0.1, 1, 10))), None),
+            0x1d20: ('THGR268', 80, (('temperature', 0, (0.1, 1, 10)), ('humidity', 4, (1, 10))), _decodeTHGR268),
+            0x1d30: ('THGR968', 80, (('temperature', 0, (0.1, 1, 10)), ('humidity', 4, (1, 10))), None),
+            0xec70: ('UVR128',  68, (('uvIndex', 0, (1, 10)),), None)}
+
+
+class _PacketCache(object):
 	"""
-	Parse the data section of a THGR268 temperature/humidity sensor packet and return a dictionary 
-	of the values recovered.
+	Bounded least recently used cache of the valid packets seen so far that 
+	is used to skip the repeated transmissions of a packet.  Only the latest
+	packet from each sensor/channel is kept so that a value that changes and
+	then changes back is not mistaken for a repeat.  The number of repeats 
+	found is stored in the 'duplicates' attribute.
 	"""
 	
-	output = {'temperature': -99, 'humidity': -99}
-	
-	# Temperature in C
-	temp = nibbles2value(data[0:12])
-	temp = 10*temp[2] + temp[1] + 0.1*temp[0]
-	if sum(data[12:16]) > 0:
-		temp *= -1
-	output['temperature'] = temp
+	def __init__(self, size=_PACKET_CACHE_SIZE):
+		self.size = size
+		self.duplicates = 0
 		
-	# Relative humidity as a percentage
-	humi = nibbles2value(data[16:24])
-	output['humidity'] = 10*humi[1]+humi[0]
-	
-	return output
+		# Packed packet -> source and source -> packed packet
+		self._packets = OrderedDict()
+		self._latest = {}
+		
+	def check(self, source, payload):
+		"""
+		Check whether or not a packet from the given source, e.g., a 
+		(sensor ID, channel) tuple, is a repeat of the latest one from that
+		source and add it to the cache if it is not.
+		"""
+		
+		if payload in self._packets:
+			## Move it to the most recently used end
+			self._packets[payload] = self._packets.pop(payload)
+			self.duplicates += 1
+			return True
+			
+		## Replace the previous packet from this source
+		try:
+			del self._packets[self._latest[source]]
+		except KeyError:
+			pass
+		self._packets[payload] = source
+		self._latest[source] = payload
+		
+		## Enforce the size limit
+		if len(self._packets) > self.size:
+			oldPayload, oldSource = self._packets.popitem(last=False)
+			del self._latest[oldSource]
+			
+		return False
 
-def _parseTHGR968(data):
+
+class Reading(object):
 	"""
-	Parse the data section of a THGR268 temperature/humidity sensor packet and return a dictionary 
-	of the values recovered.
+	Class to hold a single reading, i.e., the values decoded from one valid
+	packet.  The attributes are:
+	  * sensorName - the sensor name, e.g., 'THGR268',
+	  * channel - the channel number,
+	  * offset - the sample offset of the packet for framed data or the 
+	    index of the packet in the bit stream otherwise,
+	  * timestamp - the UNIX time at which the packet was received, or None 
+	    if it is not known, and
+	  * data - a dictionary of the values decoded from the packet, without
+	    any of the derived quantities.
 	"""
 	
-	output = {'temperature': -99, 'humidity': -99}
+	__slots__ = ('sensorName', 'channel', 'offset', 'timestamp', 'data')
 	
-	# Temperature in C
-	temp = nibbles2value(data[0:12])
-	temp = 10*temp[2] + temp[1] + 0.1*temp[0]
-	if sum(data[64:68]) > 0:
-		temp *= -1
-	output['temperature'] = temp
+	def __init__(self, sensorName, channel, offset, timestamp, data):
+		self.sensorName = sensorName
+		self.channel = channel
+		self.offset = offset
+		self.timestamp = timestamp
+		self.data = data
 		
-	# Relative humidity as a percentage
-	humi = nibbles2value(data[16:24])
-	output['humidity'] = 10*humi[1]+humi[0]
-	
-	return output
-	
-def _parseUVR128(data):
+	def __repr__(self):
+		return "<Reading %s channel %i at %s (%s): %s>" % (self.sensorName, self.channel, self.offset, self.timestamp, self.data)
+
+
+def _parsePacket(packet, cache=None, verbose=False):
 	"""
-	Parse the data section of a RVY128 UV sensor packet and return a dictionary of the
-	values recovered.
+	Worker function for parsePacketv21 that returns a five-element tuple of
+	whether or not the packet is valid, whether or not it is a repeat of a
+	packet already in the cache, the sensor name, the channel number, and a
+	dictionary of the values recovered.  Repeated packets are not decoded 
+	and have an empty dictionary.
 	"""
 	
-	output = {'uvIndex': -99}
+	# Pack the bits into a single integer so that the rest of the checks are
+	# integer operations
+	value = _packBits(packet[:_MAX_PACKET_BITS])
 	
-	# UV index
-	uv = nibbles2value(data[0:8])
-	uv = 10*uv[1] + uv[0]
-	output['uvIndex'] = uv
-	
-	return output
+	# Check for a valid preamble
+	if value & 0xFFFF != 0xFFFF:
+		return False, False, 'Invalid', -1, {}
 	
+	# Check for a valid sync word.
+	if (value >> 16) & 0xF != 10:
+		return False, False, 'Invalid', -1, {}
+		
+	# Try to figure out which sensor is present so that we can get 
+	# the packet length
+	sensor = (value >> 20) & 0xFFFF
+	sensor = ((sensor & 0xF) << 12) | (((sensor >> 4) & 0xF) << 8) | (((sensor >> 8) & 0xF) << 4) | (sensor >> 12)
+	try:
+		nm, ds, fields, decoder = _SENSORS[sensor]
+	except KeyError:
+		## Unknown - fail
+		return False, False, 'Invalid', -1, {}
+		
+	# Make sure there are enough bits that we get a checksum
+	if len(packet) < ds+8:
+		return False, False, 'Invalid', -1, {}
+		
+	# Report
+	if verbose:
+		print 'preamble ', list(packet[ 0:16]), ["%x" % i for i in nibbles2value(packet[0:16])]
+		print 'sync     ', list(packet[16:20]), ["%x" % i for i in nibbles2value(packet[16:20])]
+		print 'sensor   ', list(packet[20:36]), ["%x" % i for i in nibbles2value(packet[20:36])]
+		print 'channel  ', list(packet[36:40]), ["%x" % i for i in nibbles2value(packet[36:40])]
+		print 'code     ', list(packet[40:48]), ["%x" % i for i in nibbles2value(packet[40:48])]
+		print 'flags    ', list(packet[48:52]), ["%x" % i for i in nibbles2value(packet[48:52])]
+		print 'data     ', list(packet[52:ds]), ["%x" % i for i in nibbles2value(packet[52:ds])]
+		print 'checksum ', list(packet[ds:ds+8]), ["%x" % i for i in nibbles2value(packet[ds:ds+8])]
+		print 'postamble', list(packet[ds+8:ds+16])
+		print '---------'
+		
+	# Compute the checksum and compare it to what is in the packet
+	ccs = _foldChecksum(_sumNibbles((value >> 20) & ((1 << (ds-20)) - 1)))
+	ocs = (value >> ds) & 0xFF
+	if ocs != ccs & 0xFF:
+		return False, False, 'Invalid', -1, {} 
+	
+	# Skip packets that have already been seen - int() keeps the channel from
+	# being a long
+	channel = int((value >> 36) & 0xF)
+	if cache is not None and cache.check((sensor, channel), value & ((1 << (ds+8)) - 1)):
+		if verbose:
+			print 'repeated packet'
+		return True, True, nm, channel, {}
+		
+	# Parse
+	data = int((value >> 52) & ((1 << (ds-52)) - 1))
+	output = {}
+	for key,nibble,weights in fields:
+		output[key] = _decodeDigits(data, nibble, weights)
+	if decoder is not None:
+		decoder(data, output)
+		
+	# Report
+	if verbose:
+		print output
+		
+	# Return the packet validity, channel, and data dictionary
+	return True, False, nm, channel, output
+
+
 def parsePacketv21(packet, wxData=None, verbose=False):
 	"""
 	Given a sequence of bits try to find a valid Oregon Scientific v2.1 
@@ -212,96 +334,217 @@ def parsePacketv21(packet, wxData=None, verbose=False):
 	  * 1D20 - THGR268 - Outdoor temperature/humidity
 	  * 1D30 - THGR968 - Outdoor temperature/humidity
 	  * EC70 - UVR128  - UV sensor
+	  
+	Only the first 112 bits of the sequence are used so there is no need to
+	pass in more than that.
 	"""
 	
-	# Check for a valid preamble
-	if sum(packet[:16]) != 16:
-		return False, 'Invalid', -1, {}
+	valid, duplicate, nm, channel, output = _parsePacket(packet, verbose=verbose)
+	return valid, nm, channel, output
+
+
+def _mergePacket(output, sensorName, channel, sensorData, elevation=0.0):
+	"""
+	Compute the derived quantities for a valid packet and merge the values 
+	into the output dictionary.
+	"""
 	
-	# Check for a valid sync word.
-	if nibbles2value(packet[16:20])[0] != 10:
-		return False, 'Invalid', -1, {}
+	# Dew point - indoor and output
+	if sensorName in ('BHTR968', 'THGR268', 'THGR968'):
+		sensorData['dewpoint'] = computeDewPoint(sensorData['temperature'], sensorData['humidity'])
+	# Sea level corrected barometric pressure
+	if sensorName in ('BHTR968',) and elevation != 0.0:
+		sensorData['pressure'] = computeSeaLevelPressure(sensorData['pressure'], elevation)
+	# Disentangle the indoor temperatures from the outdoor temperatures
+	if sensorName == 'BHTR968':
+		for key in ('temperature', 'humidity', 'dewpoint'):
+			newKey = 'indoor%s' % key.capitalize()
+			sensorData[newKey] = sensorData[key]
+			del sensorData[key]
+	# Multiplex the THGR268 values
+	for key in sensorData.keys():
+		if key in ('temperature', 'humidity', 'dewpoint'):
+			if sensorName == 'THGR968':
+				output[key] = sensorData[key]
+			else:
+				try:
+					output['alt%s' % key.capitalize()][channel-1] = sensorData[key]
+				except KeyError:
+					output['alt%s' % key.capitalize()] = [None, None, None, None]
+					output['alt%s' % key.capitalize()][channel-1] = sensorData[key]
+		else:
+			output[key] = sensorData[key]
+			
+	return output
+
+
+def _findPreambles(bits, stop):
+	"""
+	Return a list of the indices before 'stop' at which a complete v2.1 
+	preamble (and its logical negation counterpart) starts in the bits.
+	"""
+	
+	if stop <= 0:
+		return []
 		
-	# Try to figure out which sensor is present so that we can get 
-	# the packet length
-	sensor = ''.join(["%x" % i for i in nibbles2value(packet[20:36])])
-	if sensor == '5d60':
-		nm = 'BHTR968'
-		ds = 96
-	elif sensor == '2d10':
-		nm = 'RGR968'
-		ds = 84
-	elif sensor == '3d00':
-		nm = 'WGR968'
-		ds = 88
-	elif sensor == '1d20':
-		nm = 'THGR268'
-		ds = 80
-	elif sensor == '1d30':
-		nm = 'THGR968'
-		ds = 80
-	elif sensor == 'ec70':
-		nm = 'UVR128'
-		ds = 68
-	else:
-		## Unknown - fail
-		return False, 'Invalid', -1, {}
+	# Pack the bits into a string with one bit per character so that the 
+	# search runs in C via str.find
+	if not isinstance(bits, bytearray):
+		bits = bytearray(bits)
+	data = str(bits)
+	
+	# Find all of the matches, including overlapping ones
+	end = stop + len(_PREAMBLE) - 1
+	indices = []
+	i = data.find(_PREAMBLE, 0, end)
+	while i >= 0:
+		indices.append( i )
+		i = data.find(_PREAMBLE, i+1, end)
+		
+	return indices
+
+
+def _iterBitStream(bits, stop, cache=None, verbose=False):
+	"""
+	Scan the bits for valid Oregon Scientific v2.1 packets that start before
+	index 'stop' and yield a two-element tuple of whether or not the packet
+	repeats one already in the _PacketCache provided, if any, and a Reading
+	for each one.  The Readings for repeated packets have no data.
+	"""
+	
+	for i in _findPreambles(bits, stop):
+		## Assume nothing
+		valid = duplicate = False
+		
+		## Packet #1 - only the bits that can belong to it so that each
+		## candidate costs the same no matter how long the stream is
+		offset = i
+		packet = bits[i+0:i+0+_MAX_PACKET_SPAN:2]
+		try:
+			valid, duplicate, sensorName, channel, sensorData = _parsePacket(packet, cache=cache, verbose=verbose)
+		except IndexError:
+			pass
 			
-	# Make sure there are enough bits that we get a checksum
-	if len(packet) < ds+8:
-		return False, 'Invalid', -1, {}
+		if not valid:
+			## Packet #2
+			offset = i + 1
+			packet = bits[i+1:i+1+_MAX_PACKET_SPAN:2]
+			try:
+				valid, duplicate, sensorName, channel, sensorData = _parsePacket(packet, cache=cache, verbose=verbose)
+			except IndexError:
+				pass
+				
+		if valid:
+			yield duplicate, Reading(sensorName, channel, offset, None, sensorData)
+
+
+def _iterFrames(frames, cache=None, verbose=False):
+	"""
+	Parse the candidate packets from readRTL/readRTLFile in framed mode and 
+	yield a two-element tuple of whether or not the packet repeats one 
+	already in the _PacketCache provided, if any, and a Reading for each 
+	valid one.  The Readings for repeated packets have no data.
+	"""
+	
+	for offset,timestamp,packet in frames:
+		## Assume nothing
+		valid = duplicate = False
 		
-	# Report
-	if verbose:
-		print 'preamble ', packet[ 0:16], ["%x" % i for i in nibbles2value(packet[0:16])]
-		print 'sync     ', packet[16:20], ["%x" % i for i in nibbles2value(packet[16:20])]
-		print 'sensor   ', packet[20:36], ["%x" % i for i in nibbles2value(packet[20:36])]
-		print 'channel  ', packet[36:40], ["%x" % i for i in nibbles2value(packet[36:40])]
-		print 'code     ', packet[40:48], ["%x" % i for i in nibbles2value(packet[40:48])]
-		print 'flags    ', packet[48:52], ["%x" % i for i in nibbles2value(packet[48:52])]
-		print 'data     ', packet[52:ds], ["%x" % i for i in nibbles2value(packet[52:ds])]
-		print 'checksum ', packet[ds:ds+8], ["%x" % i for i in nibbles2value(packet[ds:ds+8])]
-		print 'postamble', packet[ds+8:ds+16]
-		print '---------'
+		## Parse
+		try:
+			valid, duplicate, sensorName, channel, sensorData = _parsePacket(packet, cache=cache, verbose=verbose)
+		except IndexError:
+			pass
+			
+		if valid:
+			yield duplicate, Reading(sensorName, channel, offset, timestamp, sensorData)
+
+
+def _mergeReadings(readings, output, elevation=0.0, snapshots=None, records=None):
+	"""
+	Merge the (duplicate, Reading) tuples from _iterBitStream/_iterFrames 
+	into the output dictionary and return a list of (sensor name, channel) 
+	tuples for all of the valid packets, including the repeats.  If a 
+	'snapshots' list is provided, a (timestamp, data dictionary) tuple with
+	the state of the output after each new reading is appended to it.  If a
+	'records' list is provided, each new Reading is appended to it.
+	"""
+	
+	found = []
+	for duplicate,reading in readings:
+		found.append( (reading.sensorName, reading.channel) )
 		
-	# Compute the checksum and compare it to what is in the packet
-	ccs = computeChecksum(packet[20:ds])
-	ccs1 = ccs & 0xF
-	ccs2 = (ccs >> 4) & 0xF
-	ocs1, ocs2 = nibbles2value(packet[ds:ds+8])
-	if ocs1 != ccs1 or ocs2 != ccs2:
-		return False, 'Invalid', -1, {} 
+		## Data reorganization and computed quantities - repeats have already
+		## been merged
+		if not duplicate:
+			_mergePacket(output, reading.sensorName, reading.channel, dict(reading.data), elevation=elevation)
+			if snapshots is not None:
+				snapshots.append( (reading.timestamp, _snapshotOutput(output)) )
+			if records is not None:
+				records.append( reading )
+				
+	return found
+
+
+def _finalizeOutput(output):
+	"""
+	Compute the quantities that combine data from several sensors.
+	"""
 	
-	# Parse
-	data = packet[52:ds]
-	channel = nibbles2value(packet[36:40])[0]
-	if nm == 'BHTR968':
-		output = _parseBHTR968(data)
-	elif nm == 'RGR968':
-		output = _parseRGR968(data)
-	elif nm == 'WGR968':
-		output = _parseWGR968(data)
-	elif nm == 'THGR268':
-		output = _parseTHGR268(data)
-	elif nm == 'THGR968':
-		output = _parseTHGR968(data)
-	elif nm == 'UVR128':
-		output = _parseUVR128(data)
-	else:
-		return False, 'Invalid', -1, {}
+	if 'temperature' in output.keys() and 'average' in output.keys():
+		output['windchill'] = computeWindchill(output['temperature'], output['average'])
 		
-	# Report
-	if verbose:
-		print output
+	return output
+
+
+def _snapshotOutput(output):
+	"""
+	Return a copy of the output dictionary with the combined quantities 
+	computed.
+	"""
+	
+	snapshot = {}
+	for key,value in output.iteritems():
+		if isinstance(value, list):
+			value = list(value)
+		snapshot[key] = value
 		
-	# Return the packet validity, channel, and data dictionary
-	return True, nm, channel, output
+	return _finalizeOutput(snapshot)
+
+
+def iterBitStream(bits, verbose=False):
+	"""
+	Given a sequence of bits (a list or a bytearray with one bit per byte)
+	from readRTL/readRTLFile, find all of the valid Oregon Scientific v2.1 
+	packets and yield a Reading for each one in the order that they appear.
+	Repeated transmissions of a packet are only yielded once.  The offset
+	of each Reading is the index of the packet in the bits and the 
+	timestamp is None.
+	"""
+	
+	for duplicate,reading in _iterBitStream(bits, len(bits)-32, cache=_PacketCache(), verbose=verbose):
+		if not duplicate:
+			yield reading
+
+
+def iterFrames(frames, verbose=False):
+	"""
+	Version of iterBitStream that works on the list of (sample offset, 
+	timestamp, packet bits) candidate packets returned by readRTL/readRTLFile
+	in framed mode.  The offset and timestamp of each Reading are those of
+	the packet.
+	"""
+	
+	for duplicate,reading in _iterFrames(frames, cache=_PacketCache(), verbose=verbose):
+		if not duplicate:
+			yield reading
 
 
 def parseBitStream(bits, elevation=0.0, inputDataDict=None, verbose=False):
 	"""
-	Given a sequence of bits from readRTL/readRTLFile, find all of the 
-	valid Oregon Scientific v2.1 packets and return the data contained
+	Given a sequence of bits (a list or a bytearray with one bit per byte)
+	from readRTL/readRTLFile, find all of the valid Oregon Scientific v2.1 
+	packets and return the data contained
 	within the packets as a dictionary.  In the process, compute various
 	derived quantities (dew point, windchill, and sea level corrected
 	pressure).
@@ -318,61 +561,237 @@ def parseBitStream(bits, elevation=0.0, inputDataDict=None, verbose=False):
 			output[key] = value
 			
 	# Find the packets and save the output
-	i = 0
-	while i < len(bits)-32:
-		## Check for a valid preamble (and its logical negation counterpart)
-		if sum(bits[i:i+32:2]) == 16 and sum(bits[i+1:i+1+32:2]) == 0:
-			### Assume nothing
-			valid = False
+	_mergeReadings(_iterBitStream(bits, len(bits)-32, cache=_PacketCache(), verbose=verbose), output, 
+				elevation=elevation)
+	
+	# Compute combined quantities
+	_finalizeOutput(output)
+	
+	# Done
+	return output
+
+
+def parseFrames(frames, elevation=0.0, inputDataDict=None, verbose=False, snapshots=None):
+	"""
+	Version of parseBitStream that works on the list of (sample offset, 
+	timestamp, packet bits) candidate packets returned by readRTL/readRTLFile
+	in framed mode.
+	
+	If a list is passed in with the 'snapshots' keyword, a (timestamp, data 
+	dictionary) tuple is appended to it for every valid packet.  The 
+	timestamp is the time at which the packet was received and the 
+	dictionary holds all of the data merged so far, as of that packet.  
+	Repeated transmissions of a packet only appear once.
+	"""
+	
+	# Setup the output dictionary
+	output = {}
+	if inputDataDict is not None:
+		for key,value in inputDataDict.iteritems():
+			output[key] = value
 			
-			### Packet #1
-			packet = bits[i+0::2]
+	# Parse the packets and save the output
+	_mergeReadings(_iterFrames(frames, cache=_PacketCache(), verbose=verbose), output, 
+				elevation=elevation, snapshots=snapshots)
+	
+	# Compute combined quantities
+	_finalizeOutput(output)
+	
+	# Done
+	return output
+
+
+def _parseExpected(expected):
+	"""
+	Convert a collection of expected sensors into a set of (sensor name, 
+	channel) tuples.  Each entry can be a sensor name, e.g., 'RGR968', a 
+	sensor name and channel separated by a colon, e.g., 'THGR268:1', or a 
+	(sensor name, channel) tuple.  A channel of None matches any channel.
+	"""
+	
+	out = set()
+	for entry in expected:
+		if isinstance(entry, basestring):
 			try:
-				valid, sensorName, channel, sensorData = parsePacketv21(packet, verbose=verbose)
-			except IndexError:
-				pass
+				name, channel = entry.split(':', 1)
+				channel = int(channel)
+			except ValueError:
+				name, channel = entry, None
+			entry = (name.strip(), channel)
+		out.add( tuple(entry) )
+		
+	return out
+
+
+class BitStreamParser(object):
+	"""
+	Incremental version of parseBitStream that is suitable for use as the
+	'callback' for readRTL/readRTLFile.  Each call with a new chunk of bits 
+	parses all of the packets that are complete and keeps the remainder 
+	around until the next chunk arrives so that packets which span chunks
+	are not lost.  Once the stream is finished, call the flush() method to 
+	parse whatever is left and return the data dictionary.
+	
+	If a collection of expected sensors is provided through the 'expected'
+	keyword (see _parseExpected for the format), each call returns True once
+	every one of them has sent a valid packet.  This signals readRTL to stop 
+	the capture early.
+	
+	If the 'framed' keyword is set to True, the parser expects the candidate
+	packets from readRTL/readRTLFile in framed mode rather than raw bits.
+	
+	Several captures can feed the same parser at once by passing a 'device'
+	keyword to each call, e.g., through readMultipleRTL.  The bits from each
+	device are kept apart and the device that last sent a valid packet for 
+	each sensor is stored in the 'sources' dictionary.
+	
+	Besides the merged output, the parser keeps two lists with an entry for
+	every new packet, in the order in which they were parsed:
+	  * 'records' holds a Reading with just the values from that packet.  In
+	    bit stream mode the offset of each one is the index of the packet 
+	    in all of the bits from its device.
+	  * 'snapshots', in framed mode only, holds a (timestamp, data 
+	    dictionary) tuple with a copy of all of the data merged so far, 
+	    including the derived quantities, as of the time at which the packet
+	    was received.  These are what rtl_osv21.py archives.
+	
+	Repeated transmissions of a packet, including the same packet heard on 
+	more than one device, are only merged into the output once and do not
+	appear in either list.  A packet counts as a repeat whenever it matches
+	the latest one from the same sensor and channel, for the life of the 
+	parser, so a sensor whose values do not change only shows up once until
+	they do.  The number of repeats skipped is available through the 
+	'duplicates' attribute.
+	
+	Example:
+	>>> bsp = BitStreamParser(elevation=elevation, expected=['RGR968', 'THGR268:1'])
+	>>> readRTL(90, callback=bsp)
+	>>> output = bsp.flush()
+	"""
+	
+	def __init__(self, elevation=0.0, inputDataDict=None, expected=None, framed=False, verbose=False):
+		self.elevation = elevation
+		self.framed = framed
+		self.verbose = verbose
+		
+		# Sensors that we are waiting to hear from
+		self.expected = None
+		if expected:
+			self.expected = _parseExpected(expected)
+		self.seen = set()
+		
+		# Device that sent the most recent valid packet from each sensor
+		self.sources = {}
+		
+		# New packets - individual readings and time stamped copies of the 
+		# merged data (framed mode only)
+		self.records = []
+		self.snapshots = []
+		
+		# Setup the output dictionary
+		self.output = {}
+		if inputDataDict is not None:
+			for key,value in inputDataDict.iteritems():
+				self.output[key] = value
 				
-			if not valid:
-				### Packet #2
-				packet = bits[i+1::2]
-				try:
-					valid, sensorName, channel, sensorData = parsePacketv21(packet, verbose=verbose)
-				except IndexError:
-					pass
+		# Bits that are still waiting to be parsed and the number of bits
+		# already parsed, by device
+		self._bits = {}
+		self._consumed = {}
+		
+		# Recently seen packets
+		self._cache = _PacketCache()
+		
+		# Lock for when several captures are feeding the parser
+		self._lock = threading.Lock()
+		
+	@property
+	def duplicates(self):
+		"""
+		Number of repeated packets that have been skipped.
+		"""
+		
+		return self._cache.duplicates
+		
+	def _iterPending(self, device, stop):
+		"""
+		Run _iterBitStream on the bits waiting to be parsed from a device and
+		fix up the offsets so that they count from the start of the stream.
+		"""
+		
+		consumed = self._consumed.get(device, 0)
+		for duplicate,reading in _iterBitStream(self._bits[device], stop, cache=self._cache, verbose=self.verbose):
+			reading.offset += consumed
+			yield duplicate, reading
+			
+	def _update(self, found, device=None):
+		"""
+		Update the set of sensors seen and return whether or not all of the 
+		expected sensors have been seen.
+		"""
+		
+		self.seen.update(found)
+		for entry in found:
+			self.sources[entry] = device
+			
+		if self.expected is None:
+			return False
+			
+		for name, channel in self.expected:
+			if channel is None:
+				if not any(n == name for n,c in self.seen):
+					return False
+			elif (name, channel) not in self.seen:
+				return False
+		return True
+		
+	def __call__(self, bits, device=None):
+		"""
+		Add a new chunk of bits (or candidate packets in framed mode) from
+		the specified device to the stream and parse any packets that are 
+		complete.  Returns True if all of the expected sensors have been 
+		seen, False otherwise.
+		"""
+		
+		with self._lock:
+			# Framed mode - the packets are already complete
+			if self.framed:
+				found = _mergeReadings(_iterFrames(bits, cache=self._cache, verbose=self.verbose), self.output, 
+								elevation=self.elevation, snapshots=self.snapshots, records=self.records)
+				return self._update(found, device=device)
+				
+			try:
+				pending = self._bits[device]
+			except KeyError:
+				pending = self._bits[device] = bytearray()
+			pending.extend(bits)
+			
+			# Parse everything that cannot be part of an incomplete packet
+			stop = len(pending) - _MAX_PACKET_SPAN
+			if stop > 0:
+				found = _mergeReadings(self._iterPending(device, stop), self.output, 
+									elevation=self.elevation, records=self.records)
+				del pending[:stop]
+				self._consumed[device] = self._consumed.get(device, 0) + stop
+				return self._update(found, device=device)
 				
-			### Data reorganization and computed quantities
-			if valid:
-				#### Dew point - indoor and output
-				if sensorName in ('BHTR968', 'THGR268', 'THGR968'):
-					sensorData['dewpoint'] = computeDewPoint(sensorData['temperature'], sensorData['humidity'])
-				#### Sea level corrected barometric pressure
-				if sensorName in ('BHTR968',) and elevation != 0.0:
-					sensorData['pressure'] = computeSeaLevelPressure(sensorData['pressure'], elevation)
-				#### Disentangle the indoor temperatures from the outdoor temperatures
-				if sensorName == 'BHTR968':
-					for key in ('temperature', 'humidity', 'dewpoint'):
-						newKey = 'indoor%s' % key.capitalize()
-						sensorData[newKey] = sensorData[key]
-						del sensorData[key]
-				#### Multiplex the THGR268 values
-				for key in sensorData.keys():
-					if key in ('temperature', 'humidity', 'dewpoint'):
-						if sensorName == 'THGR968':
-							output[key] = sensorData[key]
-						else:
-							try:
-								output['alt%s' % key.capitalize()][channel-1] = sensorData[key]
-							except KeyError:
-								output['alt%s' % key.capitalize()] = [None, None, None, None]
-								output['alt%s' % key.capitalize()][channel-1] = sensorData[key]
-					else:
-						output[key] = sensorData[key]
-						
-		i += 1
+			return False
+			
+	def flush(self):
+		"""
+		Parse any bits that remain in the stream and return the data 
+		dictionary.
+		"""
 		
-	# Compute combined quantities
-	if 'temperature' in output.keys() and 'average' in output.keys():
-		output['windchill'] = computeWindchill(output['temperature'], output['average'])
+		with self._lock:
+			for device,pending in self._bits.iteritems():
+				found = _mergeReadings(self._iterPending(device, len(pending)-32), self.output, 
+									elevation=self.elevation, records=self.records)
+				self._update(found, device=device)
+			self._bits = {}
+			self._consumed = {}
+			
+		# Compute combined quantities
+		_finalizeOutput(self.output)
 		
-	# Done
-	return output
+		return self.output
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pure NumPy version of the readRTLFile function from the decoder extension
+for decoding RTL SDR recordings on systems without librtlsdr or a compiler.
+"""
+
+import numpy
+
+from bursts import getBurstSampleRate, iterBursts
+
+__version__ = '0.1'
+__all__ = ['FREQUENCY', 'SAMPLE_RATE', 'SMOOTH_WINDOW', 'THRESHOLD', 'DECIMATION',
+		   'readRTLFile', '__version__', '__all__']
+
+
+# Device/detection parameters - defaults, see decoder.c
+FREQUENCY = 433800000
+SAMPLE_RATE = 1000000
+SMOOTH_WINDOW = 488
+THRESHOLD = 6800.0
+DECIMATION = 1
+
+# Edge timing windows in samples at SAMPLE_RATE
+_EDGE_RESET = 80000
+_RISE_MIN, _RISE_SHORT, _RISE_MAX = 200, 615, 1100
+_FALL_MIN, _FALL_SHORT, _FALL_MAX = 400, 850, 1400
+
+# Number of I/Q samples to read from the file at a time
+_READ_SIZE = 4*1024*1024
+
+
+def _scaleWindow(value, scale):
+	"""
+	Scale an edge timing window in the same way that the decoder extension
+	does.
+	"""
+	
+	return int(value*scale + 0.5)
+
+
+class _DecoderState(object):
+	"""
+	Class to hold the state of the decoding between blocks of data read from
+	a file.  This mirrors the DecoderConfig/DecoderState structures in
+	decoder.c.
+	"""
+	
+	def __init__(self, sampleRate=SAMPLE_RATE, smoothWindow=-1, threshold=THRESHOLD, decimation=DECIMATION):
+		# Validate and setup the detection parameters
+		if sampleRate <= 0:
+			raise ValueError("Sample rate must be greater than zero")
+		if threshold <= 0:
+			raise ValueError("Threshold must be greater than zero")
+		scale = float(sampleRate) / SAMPLE_RATE
+		
+		if smoothWindow < 0:
+			smoothWindow = _scaleWindow(SMOOTH_WINDOW, scale)
+		if smoothWindow < 1:
+			raise ValueError("Smoothing window must be at least one sample")
+		if decimation < 1 or decimation > smoothWindow:
+			raise ValueError("Decimation must be between one and the smoothing window length")
+			
+		self.decimation = decimation
+		self.nTaps = (smoothWindow + decimation//2) // decimation
+		self.thresholdSum = int(numpy.ceil(threshold*self.nTaps*decimation))
+		
+		self.edgeReset = _scaleWindow(_EDGE_RESET, scale)
+		self.rise = [_scaleWindow(v, scale) for v in (_RISE_MIN, _RISE_SHORT, _RISE_MAX)]
+		self.fall = [_scaleWindow(v, scale) for v in (_FALL_MIN, _FALL_SHORT, _FALL_MAX)]
+		
+		# Power detection
+		self.history = numpy.zeros(self.nTaps, dtype=numpy.int64)
+		self.prevPower = 0
+		
+		# Edge timing
+		self.dataCounter = 0
+		self.prevEdge = -1
+		self.edgeCountDiff = -1
+		self.halfTime = 0
+		
+	def process(self, data, bits):
+		"""
+		Decode a block of interleaved 8-bit I/Q samples, whose length is a
+		multiple of twice the decimation, and append the bits to 'bits'.
+		"""
+		
+		# Unpack and compute the power
+		data = data.astype(numpy.int32) - 127
+		power = data[0::2]**2 + data[1::2]**2
+		
+		# Decimate
+		if self.decimation > 1:
+			power = power.reshape(-1, self.decimation).sum(axis=1)
+		nBlocks = power.size
+		if nBlocks == 0:
+			return bits
+			
+		# Moving average via a cumulative sum that includes the end of the
+		# previous block
+		csum = numpy.cumsum(numpy.concatenate([self.history, power.astype(numpy.int64)]))
+		running = csum[self.nTaps:] - csum[:nBlocks]
+		self.history = numpy.concatenate([self.history, power])[-self.nTaps:]
+		
+		# Threshold and find the edges, i.e., where the level changes
+		level = running >= self.thresholdSum
+		index = numpy.flatnonzero(level[1:] != level[:-1]) + 1
+		if level[0] != self.prevPower:
+			index = numpy.concatenate([[0,], index])
+		rising = level[index]
+		self.prevPower = int(level[-1])
+		
+		# Sample counter (1-based) at each of the edges
+		counters = self.dataCounter + (index + 1)*self.decimation
+		self.dataCounter += nBlocks*self.decimation
+		
+		# Manchester timing - this depends on which of the previous edges were
+		# accepted so it runs edge by edge
+		edgeReset = self.edgeReset
+		prevEdge, halfTime = self.prevEdge, self.halfTime
+		edgeCountDiff = self.edgeCountDiff
+		for counter,edge in zip(counters.tolist(), rising.tolist()):
+			if prevEdge < 0:
+				prevEdge = counter
+			edgeCountDiff = counter - prevEdge
+			
+			if edge:
+				bit = 1
+				windowMin, windowShort, windowMax = self.rise
+			else:
+				bit = 0
+				windowMin, windowShort, windowMax = self.fall
+				
+			if edgeCountDiff > edgeReset:
+				prevEdge = counter
+				halfTime = 0
+			elif edgeCountDiff < windowMin or edgeCountDiff > windowMax:
+				continue
+			elif edgeCountDiff < windowShort:
+				prevEdge = counter
+				halfTime += 1
+			else:
+				prevEdge = counter
+				halfTime += 2
+				
+			if halfTime % 2 == 0:
+				bits.append(bit)
+				
+		self.prevEdge, self.halfTime = prevEdge, halfTime
+		self.edgeCountDiff = edgeCountDiff
+		
+		return bits
+		
+	def skipTo(self, counter):
+		"""
+		Move the sample counter ahead for data that does not follow on from 
+		the data processed so far, i.e., the next burst in a burst recording.
+		"""
+		
+		self.history[:] = 0
+		self.prevPower = 0
+		self.dataCounter = counter
+
+
+def readRTLFile(filename, asBytes=False, sampleRate=SAMPLE_RATE, smoothWindow=-1, threshold=THRESHOLD, decimation=DECIMATION):
+	"""
+	Given a filename pointing to a RTL SDR recording, read in the data,
+	perform Manchester decoding, and return a list of bits (1 or 0) suitable
+	for identifying Oregon Scientific v2.1 and v3.0 sensor data.  The bits
+	are the same as those returned by decoder.readRTLFile with the fixed
+	threshold.
+	
+	Keywords accepted are:
+	  * 'asBytes' to return the bits as a bytearray with one bit per byte,
+	  * 'sampleRate' for the sample rate of the recording in Hz,
+	  * 'smoothWindow' for the length of the power smoothing window in
+	    samples (default = 488 scaled by sampleRate/1000000),
+	  * 'threshold' for the smoothed power detection threshold, and
+	  * 'decimation' for the number of samples to sum together before the
+	    edge detection.
+	
+	The file can also be a burst recording made by decoder.readRTL.
+	"""
+	
+	state = _DecoderState(sampleRate=sampleRate, smoothWindow=smoothWindow, threshold=threshold, decimation=decimation)
+	bits = bytearray() if asBytes else []
+	
+	# Burst recordings are decoded one burst at a time
+	burstRate = getBurstSampleRate(filename)
+	if burstRate is not None:
+		if burstRate != sampleRate:
+			raise ValueError("Burst recording sample rate of %i Hz does not match %i Hz" % (burstRate, sampleRate))
+			
+		for offset,timestamp,data in iterBursts(filename):
+			if offset != state.dataCounter:
+				state.skipTo(offset)
+			data = numpy.frombuffer(data, dtype=numpy.uint8)
+			usable = data.size // (2*decimation) * (2*decimation)
+			state.process(data[:usable], bits)
+			state.dataCounter += (data.size - usable) // 2
+		return bits
+		
+	# Read in the data in whole decimation blocks and decode it
+	readSize = 2*max(1, _READ_SIZE // decimation)*decimation
+	fh = open(filename, 'rb')
+	try:
+		leftover = numpy.zeros(0, dtype=numpy.uint8)
+		while True:
+			data = numpy.fromfile(fh, dtype=numpy.uint8, count=readSize)
+			if data.size == 0:
+				break
+			if leftover.size:
+				data = numpy.concatenate([leftover, data])
+				
+			usable = data.size // (2*decimation) * (2*decimation)
+			state.process(data[:usable], bits)
+			leftover = data[usable:]
+	finally:
+		fh.close()
+		
+	return bits
@@ -6,21 +6,41 @@ Module for recording RTL SDR data for later analysis.
 
 import os
 import re
+import math
+import time
+
+try:
+	from decoder import readRTL
+except ImportError:
+	readRTL = None
 
 __version__ = "0.1"
-__all__ = ['record433MHzData', '__version__', '__all__']
+__all__ = ['record433MHzData', 'getRingFilename', 'pruneRing', '__version__', '__all__']
+
+
+# Filename pattern for the recordings kept in a ring directory
+_RING_FORMAT = 'iq-%i%s.bin'
+_RING_RE = re.compile(r'^iq-(?P<time>\d+)(-.*)?\.bin$')
 
 
 def _getParameters():
 	"""
-	Get the frequency and sample rate parameters from the decoder.c file
-	and return them as a two element tuple of frequency in Hz and sample
-	rate in Hz.
+	Get the default frequency and sample rate parameters from the decoder
+	module and return them as a two element tuple of frequency in Hz and 
+	sample rate in Hz.  If the decoder module has not been built, they are 
+	read from the decoder.c file instead.
 	
 	If the decoder.c file cannot be found, the default values of 433800000
 	for the frequency and 100000 for the sample rate are returned.
 	"""
 	
+	# Try the module first
+	try:
+		from decoder import FREQUENCY, SAMPLE_RATE
+		return FREQUENCY, SAMPLE_RATE
+	except ImportError:
+		pass
+		
 	# Find the file
 	decoderFilename = os.path.dirname(os.path.abspath(__file__))
 	decoderFilename = os.path.join(decoderFilename, "decoder.c")
@@ -50,11 +70,11 @@ def _getParameters():
 				else:
 					pass
 					
+		fh.close()
+		
 	except IOError:
 		pass
 		
-	fh.close()
-	
 	return freq, srate
 
 
@@ -62,27 +82,54 @@ def _getParameters():
 _rtlsdrFreq, _rtlsdrRate = _getParameters()	
 
 
-def record433MHzData(filename, duration, rtlsdrPath=None, useTimeout=False):
+def record433MHzData(filename, duration, rtlsdrPath=None, useTimeout=False, frequency=None, sampleRate=None, device=None, bursts=False):
 	"""
-	Call the "rtl_sdr" program to record data at 433.8 MHz for the specified 
-	duration in second to the specified filename.  
+	Record data at 433.8 MHz for the specified duration in second to the 
+	specified filename.  The recording is done in-process with the decoder 
+	module's readRTL function.  If the decoder module has not been built, 
+	the "rtl_sdr" program is called instead.
 	
 	Keywords accepted are:
-	  * 'rtlsdrPath' to specify the full path of the executable and 
+	  * 'rtlsdrPath' to specify the full path of the "rtl_sdr" executable,
 	  * 'useTimeout' for whether or not to wrap the "rtl_sdr" call with 
 	    "timeout".  This feature is useful on some systems, such as the 
-	    Raspberry Pi, where the "rtl_sdr" hangs after recording data.
+	    Raspberry Pi, where the "rtl_sdr" hangs after recording data,
+	  * 'frequency' and 'sampleRate' to override the decoder's default 
+	    center frequency and sample rate in Hz,
+	  * 'device' for the device index or serial number to record from, and
+	  * 'bursts' to only record the data around bursts of signal in a 
+	    burst recording.  This requires the decoder module.
+	
+	The in-process recording covers whole seconds so it may run up to a 
+	second past 'duration'.
 	"""
 	
+	# Setup the radio
+	if frequency is None:
+		frequency = _rtlsdrFreq
+	if sampleRate is None:
+		sampleRate = _rtlsdrRate
+		
+	# Record in-process, if we can
+	if readRTL is not None:
+		readRTL(int(math.ceil(duration)), asBytes=True, framed=True, frequency=frequency, 
+			   sampleRate=sampleRate, device=device, record=filename, bursts=bursts)
+		return True
+	elif bursts:
+		raise RuntimeError("Burst recordings require the decoder module")
+		
 	# Setup the duration in samples
-	samplesToRecord = int(duration*_rtlsdrRate)
+	samplesToRecord = int(duration*sampleRate)
 	
 	# Setup the program
 	if rtlsdrPath is None:
 		cmd = "rtl_sdr"
 	else:
 		cmd = rtlsdrPath
-	cmd = "%s -f %i -s %i -n %i %s" % (cmd, _rtlsdrFreq, _rtlsdrRate, samplesToRecord, filename)
+	cmd = "%s -f %i -s %i -n %i" % (cmd, frequency, sampleRate, samplesToRecord)
+	if device is not None:
+		cmd = "%s -d %s" % (cmd, device)
+	cmd = "%s %s" % (cmd, filename)
 	if useTimeout:
 		timeoutPeriod = duration + 10
 		cmd = "timeout -s 9 %i %s" % (timeoutPeriod, cmd)
@@ -91,4 +138,41 @@ def record433MHzData(filename, duration, rtlsdrPath=None, useTimeout=False):
 	os.system(cmd)
 	
 	# Done
-	return True
\ No newline at end of file
+	return True
+
+
+def getRingFilename(directory, device=None, tStart=None):
+	"""
+	Return the filename to use for a new recording in a ring directory.  
+	The filename includes the start time of the recording (default = now) 
+	and, if provided, the device.
+	"""
+	
+	if tStart is None:
+		tStart = time.time()
+	suffix = '' if device is None else '-%s' % device
+	
+	return os.path.join(directory, _RING_FORMAT % (int(tStart), suffix))
+
+
+def pruneRing(directory, keep, tNow=None):
+	"""
+	Remove the recordings in a ring directory that started more than 'keep'
+	seconds ago so that only the last 'keep' seconds or so of data are kept
+	on disk.  Returns a list of the filenames that were removed.
+	"""
+	
+	if tNow is None:
+		tNow = time.time()
+		
+	removed = []
+	for name in sorted(os.listdir(directory)):
+		mtch = _RING_RE.match(name)
+		if mtch is None:
+			continue
+		if int(mtch.group('time')) < tNow - keep:
+			filename = os.path.join(directory, name)
+			os.unlink(filename)
+			removed.append( filename )
+			
+	return removed
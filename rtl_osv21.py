@@ -8,32 +8,82 @@ weather sensors and send the results to WUnderground.
 This script takes no arguments.
 """
 
+import os
 import sys
 import time
 
-from config import CONFIG_FILE, loadConfig
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+from capture import readMultipleRTL
 from database import Archive
-from decoder import readRTL
-from parser import parseBitStream
+from decoder import readRTL, stats
+from parser import BitStreamParser
+from recorder import getRingFilename, pruneRing
 from utils import generateWeatherReport, wuUploader
 
 
+def _reportStats(device, s):
+	"""
+	Print out a summary of the decoder statistics for the capture from a 
+	device.
+	"""
+	
+	if s is None:
+		return
+		
+	print "Device %s: %i samples in %i buffers (%i short, %i overruns, %i read errors)" % \
+		(device, s['samples'], s['buffers'], s['shortBuffers'], s['overruns'], s['readErrors'])
+	print "  %.3f ms/buffer on average, %.3f ms max" % \
+		(1000.0*s['processTime']/max(1, s['buffers']), 1000.0*s['maxProcessTime'])
+	print "  %.2f%% of samples above threshold, %i edges, %i rejected, %i bits, %i frames" % \
+		(100.0*s['pulseSamples']/max(1, s['samples']), s['edges'], 
+		 s['riseTooShort']+s['riseTooLong']+s['fallTooShort']+s['fallTooLong'], s['bits'], s['frames'])
+
+
 def main(args):
 	# Read in the configuration file
 	config = loadConfig(CONFIG_FILE)
 	
-	# Record some data and extract the bits on-the-fly
-	bits = readRTL(int(config['duration']))
-	
-	# Read in the most recent state
-	db = Archive()
+	# Read in the most recent state - the writes are batched so that all of 
+	# the readings from this capture go in as one transaction
+	db = Archive(batchSize=1000)
 	tLast, output = db.getData()
 	
-	# Find the packets and save the output
-	output = parseBitStream(bits, elevation=config['elevation'], inputDataDict=output, verbose=config['verbose'])
+	# Record some data and find the packets on-the-fly
+	bsp = BitStreamParser(elevation=config['elevation'], inputDataDict=output, 
+					expected=config['expectedSensors'], framed=True, verbose=config['verbose'])
+	record = None
+	if config['recordDir'] is not None:
+		## Keep a copy of the raw data as well
+		if not os.path.exists(config['recordDir']):
+			os.makedirs(config['recordDir'])
+		pruneRing(config['recordDir'], 60*config['recordKeep'])
+		record = lambda device: getRingFilename(config['recordDir'], device=device)
 		
-	# Save to the database
-	db.writeData(time.time(), output)
+	if len(config['devices']) > 1:
+		deviceStats = readMultipleRTL(int(config['duration']), config['devices'], bsp, asBytes=True, framed=True, 
+							record=record, bursts=config['recordBursts'], **getDecoderOptions(config))
+	else:
+		device = config['devices'][0] if config['devices'] else None
+		readRTL(int(config['duration']), callback=bsp, asBytes=True, framed=True, device=device, 
+			   record=record(device) if record is not None else None, bursts=config['recordBursts'], 
+			   **getDecoderOptions(config))
+		deviceStats = {device: stats()}
+	output = bsp.flush()
+	if config['verbose']:
+		for device in sorted(deviceStats.keys()):
+			_reportStats(device, deviceStats[device])
+		print "%i valid packets from %i sensors, %i repeats skipped" % (len(bsp.records)+bsp.duplicates, len(bsp.seen), bsp.duplicates)
+	if config['verbose'] and len(config['devices']) > 1:
+		for (name,channel),device in sorted(bsp.sources.items()):
+			print "%s on channel %i last heard on device %s" % (name, channel, device)
+			
+	# Save to the database - each reading at the time it was received
+	if bsp.snapshots:
+		for timestamp,snapshot in bsp.snapshots:
+			db.writeData(timestamp, snapshot)
+	else:
+		db.writeData(time.time(), output)
+	db.flush()
 	
 	# Upload
 	wuUploader(config['ID'], config['PASSWORD'], output, archive=db, 
@@ -8,6 +8,10 @@ This script takes two arguments:
  1) the duration of the recording in seconds
  2) a filename for where to write the data to
 
+If the '-b' option is given, only the data around bursts of signal are 
+recorded.  The resulting burst recording can be replayed with rtl_replay.py
+and read with the iterBursts function in bursts.py.
+
 The resulting data can be read in with NumPy via:
 >>> import numpy
 >>> data = numpy.fromfile(filename, dtype=numpy.uint8)
@@ -18,6 +22,7 @@ The resulting data can be read in with NumPy via:
 
 import os
 import sys
+import getopt
 
 from config import CONFIG_FILE, loadConfig
 from recorder import record433MHzData
@@ -25,6 +30,11 @@ from recorder import record433MHzData
 
 def main(args):
 	# Parse the command line
+	opts, args = getopt.getopt(args, 'b', ['bursts',])
+	bursts = False
+	for opt,value in opts:
+		if opt in ('-b', '--bursts'):
+			bursts = True
 	if len(args) != 2:
 		raise RuntimeError("Invalid number of arguments provided, expected a duration and a filename")
 	duration = float(args[0])
@@ -40,7 +50,10 @@ def main(args):
 			sys.exit()
 			
 	# Record the data
-	record433MHzData(filename, duration, rtlsdrPath=config['rtlsdr'], useTimeout=config['useTimeout'])
+	device = config['devices'][0] if config['devices'] else None
+	record433MHzData(filename, duration, rtlsdrPath=config['rtlsdr'], useTimeout=config['useTimeout'], 
+				  frequency=config['frequency'], sampleRate=config['sampleRate'], device=device, 
+				  bursts=bursts)
 	
 	# Report
 	print "Recorded %i bytes to '%s'" % (os.path.getsize(filename), filename)
@@ -5,14 +5,23 @@
 Script to replay a saved 433MHz rtl_sdr file for testing purposes.
 
 This script takes one argument:
- 1) a filename to read raw RTL SDR data from
+ 1) a filename to read raw RTL SDR data from, either a rtl_sdr recording
+    or a burst recording from rtl_record.py
+
+If the decoder extension has not been built, the NumPy decoder in 
+pydecoder.py is used instead.
 """
 
 import sys
 
-from config import CONFIG_FILE, loadConfig
-from decoder import readRTLFile
-from parser import parseBitStream
+from config import CONFIG_FILE, loadConfig, getDecoderOptions
+from parser import parseBitStream, parseFrames
+try:
+	from capture import readRTLFileParallel
+except ImportError:
+	# No decoder extension - fall back to the NumPy decoder
+	readRTLFileParallel = None
+	from pydecoder import readRTLFile
 from utils import generateWeatherReport
 
 
@@ -25,11 +34,19 @@ def main(args):
 	# Read in the configuration file
 	config = loadConfig(CONFIG_FILE)
 	
-	# Find the bits in the freshly recorded data and remove the file
-	bits = readRTLFile(filename)
-	
-	# Find the packets
-	output = parseBitStream(bits, elevation=config['elevation'], verbose=True)
+	# Find the packets - in parallel with the decoder extension or with the
+	# NumPy decoder if the extension is not available
+	options = getDecoderOptions(config, live=False)
+	if readRTLFileParallel is not None:
+		frames = readRTLFileParallel(filename, asBytes=True, **options)
+		output = parseFrames(frames, elevation=config['elevation'], verbose=True)
+	else:
+		try:
+			del options['adaptive']
+		except KeyError:
+			pass
+		bits = readRTLFile(filename, asBytes=True, **options)
+		output = parseBitStream(bits, elevation=config['elevation'], verbose=True)
 	
 	# Report
 	print " "
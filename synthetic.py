@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+Module for generating synthetic Oregon Scientific v2.1 packets and RTL SDR
+recordings of them for testing and benchmarking the decoder and parser.
+
+The packets are built from physical values for each of the sensors that
+parser.parsePacketv21 supports, Manchester encoded, and on-off keyed onto
+a carrier with a random phase.  The recordings are written in the same
+interleaved 8-bit I/Q format as rtl_sdr with Gaussian noise at the
+requested signal-to-noise ratio.
+"""
+
+import math
+import random
+
+import numpy
+
+__version__ = '0.1'
+__all__ = ['SENSORS', 'encodeValues', 'randomValues', 'makePacket', 'randomPacket',
+		   'modulate', 'noisePower', 'generateRecording', '__version__', '__all__']
+
+
+# Sensor name -> (sensor ID, end of the data section in bits)
+SENSORS = {'BHTR968': (0x5d60, 96),
+		   'RGR968':  (0x2d10, 84),
+		   'WGR968':  (0x3d00, 88),
+		   'THGR268': (0x1d20, 80),
+		   'THGR968': (0x1d30, 80),
+		   'UVR128':  (0xec70, 68)}
+
+# BHTR968 "comfort level" and pressure-based weather forecast codes
+_COMFORT_CODES = {'normal': 0, 'comfortable': 4, 'dry': 8, 'wet': 0xC}
+_FORECAST_CODES = {'cloudy': 2, 'rainy': 3, 'partly cloudy': 6, 'sunny': 0xC}
+
+# Bit rate of the interleaved bit stream in bits/s - each of these bits is
+# Manchester encoded
+_BIT_RATE = 1024.0
+
+# Time between the two transmissions of a packet in s
+_REPEAT_GAP = 0.1
+
+# Number of samples to generate at a time
+_BLOCK_SIZE = 1000000
+
+
+def _digits(value, n, decimals=0):
+	"""
+	Convert the magnitude of a value to a list of 'n' BCD nibbles, least
+	significant first, with 'decimals' digits after the decimal point.
+	"""
+	
+	value = int(round(abs(value)*10**decimals))
+	return [(value // 10**k) % 10 for k in xrange(n)]
+
+
+def encodeValues(sensorName, values):
+	"""
+	Given a sensor name and a dictionary of values in the same format as
+	returned by parser.parsePacketv21, return the data section of the
+	packet as a list of nibbles.
+	"""
+	
+	if sensorName == 'BHTR968':
+		pressure = (int(values['pressure']) - 856) & 0xFF
+		nibbles = _digits(values['temperature'], 3, 1) + [8 if values['temperature'] < 0 else 0]
+		nibbles += _digits(values['humidity'], 2)
+		nibbles += [_COMFORT_CODES[values['comfortLevel']], pressure & 0xF, pressure >> 4, 0]
+		nibbles += [_FORECAST_CODES[values['forecast']],]
+	elif sensorName == 'RGR968':
+		nibbles = _digits(values['rainrate'], 3, 1) + _digits(values['rainfall'], 5, 1)
+	elif sensorName == 'WGR968':
+		nibbles = _digits(values['direction'], 3) + _digits(values['gust'], 3, 1) + _digits(values['average'], 3, 1)
+	elif sensorName in ('THGR268', 'THGR968'):
+		nibbles = _digits(values['temperature'], 3, 1) + [8 if values['temperature'] < 0 else 0]
+		nibbles += _digits(values['humidity'], 2) + [0,]
+	elif sensorName == 'UVR128':
+		nibbles = _digits(values['uvIndex'], 2) + [0, 0]
+	else:
+		raise ValueError("Unknown sensor '%s'" % sensorName)
+		
+	return nibbles
+
+
+def randomValues(sensorName, rng=random):
+	"""
+	Return a dictionary of random, but plausible, values for the specified
+	sensor using the random.Random instance provided.
+	
+	.. note::
+		The THGR968 temperature is always positive since the parser does not
+		decode its sign.
+	"""
+	
+	temperature = lambda low, high: round(rng.uniform(low, high), 1)
+	
+	if sensorName == 'BHTR968':
+		values = {'temperature': temperature(10, 35), 'humidity': rng.randint(20, 80),
+				  'pressure': rng.randint(860, 983),
+				  'comfortLevel': rng.choice(_COMFORT_CODES.keys()),
+				  'forecast': rng.choice(_FORECAST_CODES.keys())}
+	elif sensorName == 'RGR968':
+		values = {'rainrate': round(rng.uniform(0, 50), 1), 'rainfall': round(rng.uniform(0, 5000), 1)}
+	elif sensorName == 'WGR968':
+		values = {'direction': rng.randint(0, 359), 'gust': round(rng.uniform(0, 30), 1),
+				  'average': round(rng.uniform(0, 20), 1)}
+	elif sensorName == 'THGR268':
+		values = {'temperature': temperature(-30, 45), 'humidity': rng.randint(10, 99)}
+	elif sensorName == 'THGR968':
+		values = {'temperature': temperature(0, 45), 'humidity': rng.randint(10, 99)}
+	elif sensorName == 'UVR128':
+		values = {'uvIndex': rng.randint(0, 12)}
+	else:
+		raise ValueError("Unknown sensor '%s'" % sensorName)
+		
+	# Avoid negative zero, which the packets cannot represent
+	if values.get('temperature', 1.0) == 0.0:
+		values['temperature'] = 0.0
+		
+	return values
+
+
+def _nibble(value):
+	"""
+	Convert an integer nibble to a list of four bits, least significant bit
+	first.
+	"""
+	
+	return [(value >> k) & 1 for k in xrange(4)]
+
+
+def makePacket(sensorName, channel, dataNibbles, code=0xa5, flags=0):
+	"""
+	Build the bits of a valid v2.1 packet from the sensor name, channel,
+	and data section nibbles, including the preamble, sync word, checksum,
+	and postamble.  The rolling code and flags can also be set.
+	"""
+	
+	sensorId, ds = SENSORS[sensorName]
+	
+	# Header
+	nibbles = [(sensorId >> k) & 0xF for k in (12, 8, 4, 0)]
+	nibbles += [channel, code & 0xF, (code >> 4) & 0xF, flags]
+	nibbles += list(dataNibbles)
+	if len(nibbles) != (ds-20)//4:
+		raise ValueError("Expected %i data nibbles for a %s packet, found %i" % ((ds-52)//4, sensorName, len(dataNibbles)))
+		
+	# Checksum
+	checksum = sum(nibbles)
+	checksum = (checksum & 0xFF) + (checksum >> 8)
+	nibbles += [checksum & 0xF, (checksum >> 4) & 0xF]
+	
+	# Bits
+	packet = [1]*16 + _nibble(10)
+	for value in nibbles:
+		packet += _nibble(value)
+	packet += [0]*8
+	
+	return packet
+
+
+def randomPacket(sensorName=None, rng=random):
+	"""
+	Build a packet with random values for the specified sensor, or for a
+	random sensor if no name is given.  Returns a four-element tuple of the
+	sensor name, channel, dictionary of values, and packet bits.
+	"""
+	
+	if sensorName is None:
+		sensorName = rng.choice(sorted(SENSORS.keys()))
+		
+	channel = rng.randint(1, 3) if sensorName == 'THGR268' else 0
+	values = randomValues(sensorName, rng=rng)
+	packet = makePacket(sensorName, channel, encodeValues(sensorName, values), code=rng.randint(0, 255))
+	
+	return sensorName, channel, values, packet
+
+
+def modulate(packet, sampleRate=1000000, amplitude=116.0, jitter=0.0, phase=0.0, rng=numpy.random):
+	"""
+	Modulate the bits of a packet and return the complex baseband signal as
+	a numpy.complex64 array.  Each bit is sent followed by its logical
+	negation and then each of these is Manchester encoded at 1024 bits/s.
+	The length of every half-bit can be varied by a fraction 'jitter'
+	(standard deviation) using the numpy.random.RandomState provided.
+	"""
+	
+	# Interleaved bits -> on/off levels for each half-bit
+	levels = numpy.empty(4*len(packet), dtype=numpy.uint8)
+	bits = numpy.array(packet, dtype=numpy.uint8)
+	levels[0::4] = 1 - bits
+	levels[1::4] = bits
+	levels[2::4] = bits
+	levels[3::4] = 1 - bits
+	
+	# Half-bit boundaries in samples
+	halfBit = sampleRate / (2*_BIT_RATE)
+	lengths = numpy.ones(levels.size)
+	if jitter > 0:
+		lengths += jitter*rng.standard_normal(levels.size)
+		lengths = numpy.clip(lengths, 0.1, None)
+	edges = numpy.round(numpy.concatenate([[0,], numpy.cumsum(lengths*halfBit)])).astype(numpy.int64)
+	
+	# Expand to samples
+	envelope = numpy.repeat(levels, numpy.diff(edges)).astype(numpy.float32)
+	return (amplitude*numpy.exp(1j*phase)*envelope).astype(numpy.complex64)
+
+
+def noisePower(snr, amplitude=116.0):
+	"""
+	Given a signal-to-noise ratio in dB and a signal amplitude in 8-bit 
+	counts, return the mean noise power per sample, I^2 + Q^2, that 
+	generateRecording adds.
+	"""
+	
+	if snr is None:
+		return 0.0
+		
+	return amplitude**2 / 10**(snr/10.0)
+
+
+def generateRecording(filename, duration=60.0, sampleRate=1000000, snr=20.0, jitter=0.0, density=0.5,
+				  amplitude=116.0, sensors=None, seed=0):
+	"""
+	Write a synthetic rtl_sdr recording of Oregon Scientific v2.1 sensors to
+	a file and return a list of what was sent.  The keywords are:
+	  * 'duration' - length of the recording in s,
+	  * 'sampleRate' - sample rate in Hz,
+	  * 'snr' - ratio of the signal power to the noise power in dB or None
+	    for no noise,
+	  * 'jitter' - fractional timing jitter of each Manchester half-bit,
+	  * 'density' - average number of packets, each sent twice, per second,
+	  * 'amplitude' - signal amplitude in 8-bit counts,
+	  * 'sensors' - list of sensor names to use (default = all of them), and
+	  * 'seed' - random number generator seed.
+	
+	The packets start at random with an exponential distribution of times
+	between them but are pushed back so that they never overlap.  The list returned contains a five-element
+	tuple of the sample offset of the first transmission, the sample offset
+	of the end of the second transmission, the sensor name, the channel,
+	and the dictionary of values for each packet.
+	"""
+	
+	if sensors is None:
+		sensors = sorted(SENSORS.keys())
+	rng = random.Random(seed)
+	nrng = numpy.random.RandomState(seed)
+	nSamples = int(duration*sampleRate)
+	
+	# Build the schedule
+	sent = []
+	signals = []
+	t = int(rng.expovariate(density)*sampleRate) if density > 0 else nSamples
+	while True:
+		sensorName, channel, values, packet = randomPacket(rng.choice(sensors), rng=rng)
+		signal = modulate(packet, sampleRate=sampleRate, amplitude=amplitude, jitter=jitter,
+					   phase=rng.uniform(0, 2*math.pi), rng=nrng)
+		gap = int(_REPEAT_GAP*sampleRate)
+		end = t + 2*signal.size + gap
+		if end > nSamples:
+			break
+			
+		sent.append( (t, end, sensorName, channel, values) )
+		signals.append( (t, signal) )
+		signals.append( (t+signal.size+gap, signal) )
+		
+		t = max(t + int(rng.expovariate(density)*sampleRate), end + gap)
+		
+	# Noise level
+	if snr is not None:
+		sigma = amplitude / math.sqrt(2*10**(snr/10.0))
+		
+	# Write the file one block at a time
+	fh = open(filename, 'wb')
+	try:
+		k = 0
+		for start in xrange(0, nSamples, _BLOCK_SIZE):
+			stop = min(start+_BLOCK_SIZE, nSamples)
+			block = numpy.zeros(stop-start, dtype=numpy.complex64)
+			if snr is not None:
+				block.real = nrng.normal(0, sigma, block.size)
+				block.imag = nrng.normal(0, sigma, block.size)
+				
+			## Add in the transmissions that overlap this block
+			while k < len(signals) and signals[k][0] + signals[k][1].size <= start:
+				k += 1
+			j = k
+			while j < len(signals) and signals[j][0] < stop:
+				t0, signal = signals[j]
+				i0, i1 = max(t0, start), min(t0+signal.size, stop)
+				block[i0-start:i1-start] += signal[i0-t0:i1-t0]
+				j += 1
+				
+			data = numpy.empty(2*block.size, dtype=numpy.uint8)
+			data[0::2] = numpy.clip(numpy.round(block.real + 127), 0, 255)
+			data[1::2] = numpy.clip(numpy.round(block.imag + 127), 0, 255)
+			data.tofile(fh)
+	finally:
+		fh.close()
+		
+	return sent